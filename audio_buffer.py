@@ -0,0 +1,107 @@
+import argparse
+import json
+import os
+import subprocess
+
+import numpy as np
+import scipy.io.wavfile
+
+from video_cut import FFMPEG_BINARY
+
+# Same format as moviepy's write_audiofile, which wrote the event wav files before
+AUDIO_SAMPLE_RATE = 44100
+AUDIO_CHANNELS = 2
+
+
+def audio_stem(cache_folder, video, sample_rate=AUDIO_SAMPLE_RATE, channels=AUDIO_CHANNELS):
+    """Path prefix of a decoded audio track, e.g. {cache_folder}audio_gopro_44100hz_2ch."""
+    return os.path.join(cache_folder, f'audio_{video}_{sample_rate}hz_{channels}ch')
+
+
+def decode_audio(video_path, stem, sample_rate=AUDIO_SAMPLE_RATE, channels=AUDIO_CHANNELS):
+    """
+    Decode the whole audio track of a video once into 16-bit PCM {stem}.s16 of shape (samples, channels), with
+    {stem}.json holding the sample rate, shape and the size and mtime of the video. ffmpeg resamples to
+    sample_rate and writes the file itself. A track decoded with the same settings before is skipped.
+
+    Parameters:
+        video_path (str): Path to the video, e.g. data_video_gopro.mp4.
+        stem (str): Path prefix of the output, see audio_stem.
+        sample_rate (int): Sample rate of the buffer, e.g. 16000 for speech models.
+        channels (int): Number of channels of the buffer.
+
+    Returns:
+        dict: Content of {stem}.json.
+    """
+    stat = os.stat(video_path)
+    if os.path.exists(stem + '.json') and os.path.exists(stem + '.s16'):
+        with open(stem + '.json') as f:
+            meta = json.load(f)
+        if meta['src_size'] == stat.st_size and meta['src_mtime_ns'] == stat.st_mtime_ns:
+            print(f"Audio of {video_path} is up to date in {stem}.s16")
+            return meta
+
+    subprocess.run([FFMPEG_BINARY, '-y', '-v', 'error', '-i', video_path, '-vn', '-acodec', 'pcm_s16le',
+                    '-ar', str(sample_rate), '-ac', str(channels), '-f', 's16le', stem + '.s16.tmp'],
+                   check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    os.replace(stem + '.s16.tmp', stem + '.s16')
+
+    num_samples = os.path.getsize(stem + '.s16') // (2 * channels)
+    meta = {'shape': [num_samples, channels], 'sample_rate': sample_rate, 'src_size': stat.st_size, 'src_mtime_ns': stat.st_mtime_ns}
+    # The stats are written last so an interrupted run never validates a partial decode
+    with open(stem + '.json.tmp', 'w') as f:
+        json.dump(meta, f)
+    os.replace(stem + '.json.tmp', stem + '.json')
+    print(f"Decoded audio of {video_path}: {meta['shape']} at {sample_rate} Hz to {stem}.s16")
+    return meta
+
+
+def load_audio(stem):
+    """
+    Memory-map an audio track decoded by decode_audio.
+
+    Returns:
+        tuple[np.memmap, dict]: int16 samples of shape (samples, channels) and the content of {stem}.json.
+    """
+    with open(stem + '.json') as f:
+        meta = json.load(f)
+    return np.memmap(stem + '.s16', dtype=np.int16, mode='r', shape=tuple(meta['shape'])), meta
+
+
+def audio_slice(samples, meta, start_time, end_time):
+    """Samples of [start_time, end_time) seconds as a view of the buffer, rounded to the nearest sample."""
+    sample_rate = meta['sample_rate']
+    start, end = int(round(start_time * sample_rate)), int(round(end_time * sample_rate))
+    return samples[max(0, start):min(len(samples), end)]
+
+
+def write_event_audio(samples, meta, start_time, end_time, output_audio_path):
+    """Write [start_time, end_time) seconds of the buffer as a 16-bit PCM wav file."""
+    scipy.io.wavfile.write(output_audio_path, meta['sample_rate'], np.asarray(audio_slice(samples, meta, start_time, end_time)))
+
+
+def decode_walk_audio(subject, walk, sample_rate=AUDIO_SAMPLE_RATE, channels=AUDIO_CHANNELS):
+    """
+    Decode the GoPro audio of a walk once into RW{subject}-Walk{walk}-cache/.
+
+    Returns:
+        str: Stem of the buffer, see load_audio.
+    """
+    cache_folder = f'../RW{subject}/RW{subject}-Walk{walk}-cache/'
+    if not os.path.exists(cache_folder):
+        os.makedirs(cache_folder)
+    stem = audio_stem(cache_folder, 'gopro', sample_rate, channels)
+    decode_audio(f'../RW{subject}/RW{subject}-Walk{walk}-extracted/data_video_gopro.mp4', stem, sample_rate, channels)
+    return stem
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Decode the GoPro audio of walks once into PCM buffers for slicing event audio.")
+    parser.add_argument("--subject", type=int, default=1, help="Subject number (default: 1).")
+    parser.add_argument("--walks", type=int, nargs='+', default=[1], help="Walk numbers (default: 1).")
+    parser.add_argument("--sample-rate", type=int, default=AUDIO_SAMPLE_RATE, help="Sample rate of the buffer (default: %(default)s).")
+    parser.add_argument("--channels", type=int, default=AUDIO_CHANNELS, help="Channels of the buffer (default: %(default)s).")
+    args = parser.parse_args()
+
+    for walk in args.walks:
+        decode_walk_audio(args.subject, walk, sample_rate=args.sample_rate, channels=args.channels)
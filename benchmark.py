@@ -0,0 +1,169 @@
+import argparse
+import contextlib
+import csv
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+import extract_mat_data
+import synchronize
+from ntp_time import find_close_frames, matlab_datenum_to_datetime64
+from phone_streams import load_walk_streams
+from plan_coverage import MODALITY_FREQ, list_events
+from synthetic_walk import generate_walk
+from video_cut import build_keyframe_index, video_stream_params
+
+
+@contextlib.contextmanager
+def working_directory(path):
+    # The pipeline scripts use paths relative to the working directory
+    os.makedirs(path, exist_ok=True)
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(cwd)
+
+
+def timed(results, stage, fn, repeat=1, modality='', items=0):
+    """
+    Run fn `repeat` times and record the fastest wall time.
+
+    Parameters:
+        results (list): Result rows, one dict per measurement is appended.
+        stage (str): Name of the stage.
+        fn (callable): The measured function, called without arguments.
+        repeat (int): Number of runs.
+        modality (str): Modality the measurement belongs to, if any.
+        items (int): Number of processed items (events, samples, ...) to report the throughput.
+
+    Returns:
+        The return value of the last run of fn.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        value = fn()
+        best = min(best, time.perf_counter() - start)
+    results.append({'Stage': stage, 'Modality': modality, 'Seconds': round(best, 6), 'Items': items,
+                    'Items per Second': round(items / best, 1) if items and best > 0 else ''})
+    print(f"{stage:<24} {modality:<18} {best:10.4f} s" + (f" ({items} items)" if items else ""))
+    return value
+
+
+def run_benchmark(root, subject=1, walk=1, repeat=3, video_events=5, full_sync=False):
+    """
+    Time the pipeline stages separately on a synthetic walk from synthetic_walk.generate_walk.
+
+    Parameters:
+        root (str): Root folder of the synthetic dataset.
+        subject (int): Subject number.
+        walk (int): Walk number.
+        repeat (int): Number of runs of every stage, the fastest run is reported.
+        video_events (int): Number of events cut in the video stages.
+        full_sync (bool): Also time synchronize.synchronize_walk end to end.
+
+    Returns:
+        list: One dict per measurement ('Stage', 'Modality', 'Seconds', 'Items', 'Items per Second').
+    """
+    results = []
+    run_folder = os.path.join(root, 'run')
+    extracted_folder = os.path.join(root, f'RW{subject}', f'RW{subject}-Walk{walk}-extracted') + '/'
+    cache_folder = os.path.join(root, f'RW{subject}', f'RW{subject}-Walk{walk}-cache') + '/'
+
+    ## Step 1: extraction
+    extract_mat_data.data_root = root
+    extract_mat_data.mat_folder = os.path.join(root, 'mat_RWNApp_Output_Jan2024') + '/'
+    with working_directory(os.path.join(run_folder, 'stage')):  # move_files saves to ../../RW{subject}/
+        timed(results, 'move_files', lambda: extract_mat_data.move_files(subject, walk), repeat)
+    timed(results, 'extract_mat', lambda: extract_mat_data.extract_mat(subject, walk), repeat)
+
+    ## stream loading
+    shutil.rmtree(cache_folder, ignore_errors=True)
+    timed(results, 'load_streams', lambda: load_walk_streams(extracted_folder), repeat, 'csv')
+    timed(results, 'load_streams', lambda: load_walk_streams(extracted_folder, cache_folder), 1, 'cache (cold)')
+    timed(results, 'load_streams', lambda: load_walk_streams(extracted_folder, cache_folder), repeat, 'cache')
+    streams = timed(results, 'load_streams', lambda: load_walk_streams(extracted_folder, cache_folder, mmap_mode='r'), repeat, 'cache + mmap')
+
+    ## boundary search
+    df = pd.read_csv(os.path.join(root, 'label_RWNApp_Output_Jan2024', f'evnts_RWNApp_RW{subject}_Walk{walk}.csv'))
+    time_label_ns = matlab_datenum_to_datetime64(df['NTP']/60/60/24).astype(np.int64)
+    events, _ = list_events(df['Event'])
+    label_frames = {}
+    for modality, (time_ns, _) in streams.items():
+        if modality != 'np':
+            label_frames[modality] = timed(results, 'boundary_search', lambda: find_close_frames(time_label_ns, time_ns), repeat, modality, len(time_label_ns))
+    label_frames['np'] = df['NPSample'].to_numpy()
+
+    ## per-modality slicing, windows are saved to a temporary folder as in the main loop
+    synchronize.label_missing_cnt = {}
+    with tempfile.TemporaryDirectory() as save_folder:
+        for modality, modality_freq in MODALITY_FREQ.items():
+            time_ns, data = streams[modality]
+            extract = lambda: [synchronize.extract_modalities(start, end, label_frames[modality], data, modality,
+                                                              None if modality == 'np' else time_label_ns, save_folder + '/',
+                                                              time_window=synchronize.time_window if modality_freq else None,
+                                                              modality_freq=modality_freq, time_data=time_ns)
+                               for start, end, _ in events]
+            timed(results, 'slicing', extract, repeat, modality, len(events))
+
+    ## video cutting
+    data_gopro = extracted_folder + 'data_video_gopro.mp4'
+    data_pupil = extracted_folder + 'data_video_pupil.mp4'
+    frame = df[synchronize.video_sync_modality_frame]
+    video_subset = [(frame[start], frame[end]) for start, end, _ in events[:video_events]]
+    keyframes = {path: timed(results, 'keyframe_index', lambda: build_keyframe_index(path), 1, os.path.basename(path)) for path in [data_gopro, data_pupil]}
+    params = {path: video_stream_params(path) for path in [data_gopro, data_pupil]}
+    with tempfile.TemporaryDirectory() as save_folder:
+        for mode in ['reencode', 'stream_copy']:
+            # the reencode mode is selected by passing no keyframes
+            index = keyframes if mode == 'stream_copy' else {}
+            cut_gopro = lambda: [synchronize.extract_video_audio_subset(data_gopro, start, end, f'{save_folder}/{i}_gopro.mp4', f'{save_folder}/{i}_gopro_audio.wav',
+                                                                        time_window=synchronize.time_window, fps=synchronize.fps_for_frame,
+                                                                        keyframes=index.get(data_gopro), stream_params=params[data_gopro])
+                                 for i, (start, end) in enumerate(video_subset)]
+            cut_pupil = lambda: [synchronize.extract_video_noaudio_subset(data_pupil, start, end, f'{save_folder}/{i}_pupil.mp4',
+                                                                          time_window=synchronize.time_window, fps=synchronize.fps_for_frame,
+                                                                          keyframes=index.get(data_pupil), stream_params=params[data_pupil])
+                                 for i, (start, end) in enumerate(video_subset)]
+            timed(results, f'video_cut_{mode}', cut_gopro, repeat, 'gopro + audio', len(video_subset))
+            timed(results, f'video_cut_{mode}', cut_pupil, repeat, 'pupil', len(video_subset))
+
+    ## end to end
+    if full_sync:
+        with working_directory(run_folder):
+            def sync():
+                shutil.rmtree(os.path.join(root, 'synchronized'), ignore_errors=True)
+                return synchronize.synchronize_walk(subject, walk)
+            timed(results, 'synchronize_walk', sync, 1, '', len(events))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the extraction and synchronization stages on a synthetic walk.")
+    parser.add_argument("--root", default=None, help="Root folder of the synthetic dataset (default: a temporary folder).")
+    parser.add_argument("--duration", type=float, default=300, help="Length of the synthetic walk (second).")
+    parser.add_argument("--events", type=int, default=100, help="Number of random events.")
+    parser.add_argument("--video-size", default='320x240', help="Resolution of the test videos.")
+    parser.add_argument("--mat-version", choices=['5', '7.3'], default='5', help="Format of the synthetic RWNApp .mat file.")
+    parser.add_argument("--video-events", type=int, default=5, help="Number of events cut in the video stages.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per stage, the fastest is reported.")
+    parser.add_argument("--full", action="store_true", help="Also time synchronize_walk end to end.")
+    parser.add_argument("--output", default="benchmark_results.csv", help="Csv file of the results.")
+    args = parser.parse_args()
+
+    root = args.root or tempfile.mkdtemp(prefix='brain-navigation-bench-')
+    if not os.path.exists(os.path.join(root, 'label_RWNApp_Output_Jan2024', 'evnts_RWNApp_RW1_Walk1.csv')):
+        generate_walk(root, 1, 1, duration=args.duration, num_events=args.events, video_size=args.video_size, mat_version=args.mat_version)
+    results = run_benchmark(root, 1, 1, repeat=args.repeat, video_events=args.video_events, full_sync=args.full)
+
+    with open(args.output, mode='w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(results[0]))
+        writer.writeheader()
+        writer.writerows(results)
+    print(f"Benchmark results have been saved to {args.output}")
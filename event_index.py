@@ -0,0 +1,222 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+from event_intervals import build_intervals, events_of
+from pipeline_config import interested_labels, merge_successive_events, parse_index_set, video_sync_modality_frame
+
+# Fields of the events in the index, those of event_intervals.build_intervals without the grep reason
+EVENT_FIELDS = ['index', 'end_index', 'label', 'start_ns', 'end_ns', 'start_frame', 'end_frame', 'start_np', 'end_np', 'depth']
+
+
+def event_dtype(label_dtype='U1'):
+    """dtype of the events in the index: 'subject', 'walk' and EVENT_FIELDS."""
+    return np.dtype([('subject', np.int32), ('walk', np.int32), ('index', np.int64), ('end_index', np.int64), ('label', label_dtype),
+                     ('start_ns', np.int64), ('end_ns', np.int64), ('start_frame', np.int64), ('end_frame', np.int64),
+                     ('start_np', np.int64), ('end_np', np.int64), ('depth', np.int32)])
+
+
+def load_walk_events(subject, walk, frame_column=video_sync_modality_frame, merge_successive=merge_successive_events):
+    """Events of a walk's events csv as in synchronize.py, with 'subject' and 'walk' fields."""
+    df = pd.read_csv(f'../label_RWNApp_Output_Jan2024/evnts_RWNApp_RW{subject}_Walk{walk}.csv')
+    intervals = events_of(build_intervals(df, interested_labels, frame_column=frame_column, merge_successive=merge_successive))
+    events = np.zeros(len(intervals), dtype=event_dtype(intervals.dtype['label']))
+    events['subject'], events['walk'] = subject, walk
+    for field in EVENT_FIELDS:
+        events[field] = intervals[field]
+    return events
+
+
+def build_max_end(end):
+    """
+    Largest end in the subtree of every node of an implicit interval tree over start-sorted events. Events at even
+    positions are leaves; position i at level k has its k lowest bits set and the children i -/+ 2^(k-1).
+
+    Returns:
+        tuple[NDArray, int]: Largest end per node and the level of the root (-1 if there are no events).
+    """
+    num = len(end)
+    max_end = np.array(end, dtype=np.int64)
+    if num == 0:
+        return max_end, -1
+    last_i = (num - 1) & ~1 # rightmost node of the current level and the largest end below it
+    last = int(max_end[last_i])
+    k = 1
+    while 1 << k <= num:
+        x = 1 << (k - 1)
+        i = np.arange(2 * x - 1, num, 4 * x)
+        right = np.where(i + x < num, max_end[np.minimum(i + x, num - 1)], last)
+        max_end[i] = np.maximum(max_end[i], np.maximum(max_end[i - x], right))
+        last_i = last_i - x if last_i >> k & 1 else last_i + x
+        if last_i < num and max_end[last_i] > last:
+            last = int(max_end[last_i])
+        k += 1
+    return max_end, k - 1
+
+
+class EventIndex:
+    """
+    Interval index over the events of any number of walks, on the label times in epoch nanoseconds. Events are
+    sorted by start and carry the largest end of their subtree of an implicit interval tree, so overlap queries
+    take O(log n + matches) and containment and nearest queries O(log n + candidates).
+
+    An event covers [start_ns, end_ns). Query results are structured arrays of events sorted by start, with the
+    fields of load_walk_events, and can be passed to window_events or to synchronize_walk(events=...).
+    """
+
+    def __init__(self, events):
+        order = np.argsort(events['start_ns'], kind='stable')
+        self.events = events[order]
+        self.start = self.events['start_ns']
+        self.end = self.events['end_ns']
+        self.max_end, self.root_level = build_max_end(self.end)
+        self.end_order = np.argsort(self.end, kind='stable')
+        self.sorted_end = self.end[self.end_order]
+        self.subsets = {} # {labels: EventIndex of the events with these labels}
+
+    def __len__(self):
+        return len(self.events)
+
+    def select(self, labels):
+        """Index of the events with one of the labels, built once and kept for later queries."""
+        if labels is None:
+            return self
+        labels = (labels,) if isinstance(labels, str) else tuple(sorted(labels))
+        if labels not in self.subsets:
+            self.subsets[labels] = EventIndex(self.events[np.isin(self.events['label'], labels)])
+        return self.subsets[labels]
+
+    def overlap_positions(self, start_ns, end_ns):
+        """Positions of the events overlapping [start_ns, end_ns), in start order."""
+        num, start, end, max_end = len(self), self.start, self.end, self.max_end
+        found = []
+        if num == 0:
+            return np.array(found, dtype=np.int64)
+        stack = [((1 << self.root_level) - 1, self.root_level, False)] # (node, level, left child done)
+        while stack:
+            x, k, left_done = stack.pop()
+            if k <= 3:
+                ## small subtree, scan it
+                first = x >> k << k
+                for i in range(first, min(num, first + (1 << (k + 1)) - 1)):
+                    if start[i] >= end_ns:
+                        break
+                    if start_ns < end[i]:
+                        found.append(i)
+            elif not left_done:
+                stack.append((x, k, True))
+                left = x - (1 << (k - 1))
+                # nodes past the last event have no max_end of their own, their left child may hold events
+                if left >= num or max_end[left] > start_ns:
+                    stack.append((left, k - 1, False))
+            elif x < num and start[x] < end_ns:
+                if start_ns < end[x]:
+                    found.append(x)
+                stack.append((x + (1 << (k - 1)), k - 1, False))
+        return np.array(found, dtype=np.int64)
+
+    def overlap(self, start_ns, end_ns, labels=None):
+        """Events overlapping [start_ns, end_ns)."""
+        index = self.select(labels)
+        return index.events[index.overlap_positions(int(start_ns), int(end_ns))]
+
+    def within(self, start_ns, end_ns, labels=None):
+        """Events inside [start_ns, end_ns]: they start and end within it."""
+        index = self.select(labels)
+        first, last = np.searchsorted(index.start, int(start_ns), side='left'), np.searchsorted(index.start, int(end_ns), side='right')
+        candidates = index.events[first:last]
+        return candidates[candidates['end_ns'] <= end_ns]
+
+    def containing(self, start_ns, end_ns=None, labels=None):
+        """Events containing [start_ns, end_ns], or the time start_ns if end_ns is None."""
+        index = self.select(labels)
+        candidates = index.events[index.overlap_positions(int(start_ns), int(start_ns) + 1)]
+        return candidates[candidates['end_ns'] >= (start_ns if end_ns is None else end_ns)]
+
+    def nearest(self, time_ns, labels=None):
+        """
+        The event closest to time_ns: the first event containing it, otherwise the event ending last before it or
+        starting first after it, whichever is closer.
+
+        Returns:
+            NDArray: One event, or none if the index is empty.
+        """
+        index = self.select(labels)
+        containing = index.containing(time_ns)
+        if len(containing) or len(index) == 0:
+            return containing[:1]
+        candidates = []
+        before = np.searchsorted(index.sorted_end, int(time_ns), side='right')
+        if before > 0:
+            candidates.append((int(time_ns) - int(index.sorted_end[before - 1]), index.end_order[before - 1]))
+        after = np.searchsorted(index.start, int(time_ns), side='right')
+        if after < len(index):
+            candidates.append((int(index.start[after]) - int(time_ns), after))
+        return index.events[[min(candidates)[1]]]
+
+    def inside(self, outer_labels, labels=None):
+        """Events with one of labels inside an event with one of outer_labels of the same walk, e.g. Stop inside Outdoor."""
+        found = []
+        for outer in self.select(outer_labels).events:
+            inner = self.within(outer['start_ns'], outer['end_ns'], labels)
+            found.append(inner[(inner['subject'] == outer['subject']) & (inner['walk'] == outer['walk']) & (inner['index'] != outer['index'])])
+        if not found:
+            return self.events[:0]
+        found = np.concatenate(found)
+        _, first = np.unique(found[['subject', 'walk', 'index']], return_index=True)
+        return found[np.sort(first)]
+
+
+def build_event_index(subjects, walks, frame_column=video_sync_modality_frame, merge_successive=merge_successive_events):
+    """EventIndex over the events of all walks of the subjects that have an events csv."""
+    events = []
+    for subject in subjects:
+        for walk in walks:
+            if os.path.exists(f'../label_RWNApp_Output_Jan2024/evnts_RWNApp_RW{subject}_Walk{walk}.csv'):
+                events.append(load_walk_events(subject, walk, frame_column, merge_successive))
+    # labels of all walks are stored with the widest label
+    label_dtype = max([e.dtype['label'] for e in events], key=lambda d: d.itemsize, default=np.dtype('U1'))
+    return EventIndex(np.concatenate([e.astype(event_dtype(label_dtype)) for e in events]) if events else np.zeros(0, dtype=event_dtype()))
+
+
+def window_events(events):
+    """(index, label, start in epoch nanoseconds, end in epoch nanoseconds) per event, as windowing.iter_event_windows takes them."""
+    return [(int(e['index']), str(e['label']), int(e['start_ns']), int(e['end_ns'])) for e in events]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the events of walks by time span and label, and optionally extract only the matches.")
+    parser.add_argument("--subjects", nargs='+', required=True, help="Subjects to index, e.g. 1 2 or 1-3.")
+    parser.add_argument("--walks", nargs='+', required=True, help="Walks to index for every subject, e.g. 1-7 or 1,3,4.")
+    parser.add_argument("--labels", nargs='+', default=None, help="Labels of the events to return (default: all).")
+    parser.add_argument("--inside", nargs='+', default=None, help="Only return events inside an event with one of these labels, e.g. Outdoor.")
+    parser.add_argument("--overlap", nargs=2, default=None, metavar=('START', 'END'), help="Only return events overlapping this span, as numpy datetime64 strings.")
+    parser.add_argument("--merge-successive", action="store_true", help="Merge successive rows of the same instant label, as in synchronize.py.")
+    parser.add_argument("--output", default=None, help="Save the matches to this csv file.")
+    parser.add_argument("--synchronize", action="store_true", help="Run synchronize.py on the matching events of every walk.")
+    args = parser.parse_args()
+
+    subjects, walks = parse_index_set(args.subjects), parse_index_set(args.walks)
+    index = build_event_index(subjects, walks, merge_successive=args.merge_successive or merge_successive_events)
+    if args.inside:
+        matches = index.inside(args.inside, args.labels)
+    elif args.overlap:
+        start_ns, end_ns = (np.datetime64(t, 'ns').astype(np.int64) for t in args.overlap)
+        matches = index.overlap(start_ns, end_ns, args.labels)
+    else:
+        matches = index.select(args.labels).events
+    print(f"{len(matches)} of {len(index)} events match")
+
+    table = pd.DataFrame({name: matches[name] for name in matches.dtype.names})
+    if args.output:
+        table.to_csv(args.output, index=False)
+        print(f"Matches have been saved to {args.output}")
+    else:
+        print(table.to_string(index=False))
+
+    if args.synchronize:
+        from synchronize import synchronize_walk  # only needed to extract the matches
+        for subject, walk in sorted(set(zip(matches['subject'].tolist(), matches['walk'].tolist()))):
+            synchronize_walk(subject, walk, merge_successive=args.merge_successive or merge_successive_events, events=matches)
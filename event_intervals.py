@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+
+from ntp_time import matlab_datenum_to_datetime64
+
+# Filter reasons of label rows that are not events, as in greped_index.csv
+REASON_BEFORE_WALK = "Event before Walk Beg"
+REASON_AFTER_WALK = "Event after Walk End"
+REASON_NOT_INTERESTED = "Not intereted event"
+REASON_END_MISSING = "Corresponding End event missing"
+
+
+def split_label(name):
+    """Label without the ' Beg' / ' End' suffix, and whether the row begins or ends an event."""
+    is_beg, is_end = name.endswith("Beg"), name.endswith("End")
+    return (name[:-4] if is_beg or is_end else name), is_beg, is_end
+
+
+def build_intervals(df, interested, frame_column='GoProFrame', merge_successive=False):
+    """
+    Turn the rows of an events csv into events in one pass over the labels.
+
+    Every "X Beg" is open until the next "X End" row, which closes all open "X Beg" rows at once, so a Beg is
+    paired with the first End of its label after it as in the original forward scan. Instant events end at the
+    next row; with merge_successive, a run of successive rows of the same instant label (e.g. Doorway) is one event
+    ending after the run. Rows before "Walk Beg" and from "Walk End" on, "X End" rows and the merged rows of a run
+    are not events; all other rows are, or carry the reason they are filtered.
+
+    Parameters:
+        df (pd.DataFrame): Events csv with 'Event' and, if present, 'NTP', 'NPSample' and frame_column.
+        interested (list[str]): Labels extracted as events, e.g. synchronize.interested_labels.
+        frame_column (str): Video frame column of 'start_frame' and 'end_frame' ('GoProFrame' or 'PupilFrame').
+        merge_successive (bool): Merge successive rows of the same instant label into one event.
+
+    Returns:
+        NDArray: Structured array with one interval per event or filtered row, in row order. Fields: 'index' (start
+            row), 'end_index' (end row, -1 if missing), 'label', 'start_ns' / 'end_ns' (label time in epoch
+            nanoseconds), 'start_frame' / 'end_frame' (frame_column), 'start_np' / 'end_np' (NPSample), 'depth'
+            (number of Beg/End events open around the start row) and 'reason' ('' for events). Missing columns are -1.
+    """
+    names = [str(name) for name in df['Event']]
+    num_rows = len(names)
+    starts, ends, labels, reasons = [], [], [], []
+    open_begs = {} # {label: [interval of every Beg without an End yet]}
+    phase = 'before'
+    for row, name in enumerate(names):
+        cut_label, is_beg, is_end = split_label(name)
+        if is_end:
+            for interval in open_begs.pop(cut_label, []):
+                ends[interval] = row
+
+        if phase == 'before':
+            if name == "Walk Beg":
+                phase = 'walk'
+                continue
+            reason = REASON_BEFORE_WALK
+        elif phase == 'after' or name == "Walk End":
+            phase = 'after'
+            reason = REASON_AFTER_WALK
+        elif is_end:
+            continue
+        elif cut_label not in interested:
+            reason = REASON_NOT_INTERESTED
+        elif is_beg:
+            open_begs.setdefault(cut_label, []).append(len(starts))
+            reason, row_end = '', -1
+        elif merge_successive and labels and labels[-1] == cut_label and ends[-1] == row and names[row - 1] == name:
+            ends[-1] = row + 1
+            continue
+        else:
+            reason, row_end = '', row + 1
+
+        starts.append(row)
+        ends.append(row_end if reason == '' else -1)
+        labels.append(cut_label)
+        reasons.append(reason)
+
+    ## Begs still open at the end of the table, and instant events on the last row
+    for interval in [i for begs in open_begs.values() for i in begs] + [i for i, end in enumerate(ends) if end >= num_rows]:
+        ends[interval] = -1
+        reasons[interval] = f"{REASON_END_MISSING}: {starts[interval]} {labels[interval]}"
+
+    index = np.array(starts, dtype=np.int64)
+    end_index = np.array(ends, dtype=np.int64)
+    kept = (end_index >= 0) & (np.array(reasons, dtype=object) == '')
+    # depth: an event covers the rows after its start row up to its end row, counted with a running sum
+    cover = np.zeros(num_rows + 2, dtype=np.int64)
+    is_long = kept & (end_index > index + 1)
+    np.add.at(cover, index[is_long] + 1, 1)
+    np.add.at(cover, end_index[is_long], -1)
+    depth = np.cumsum(cover)[index] if len(index) else np.zeros(0, dtype=np.int64)
+
+    intervals = np.zeros(len(index), dtype=[('index', np.int64), ('end_index', np.int64), ('label', f'U{max(map(len, labels), default=1)}'),
+                                            ('start_ns', np.int64), ('end_ns', np.int64), ('start_frame', np.int64), ('end_frame', np.int64),
+                                            ('start_np', np.int64), ('end_np', np.int64), ('depth', np.int32),
+                                            ('reason', f'U{max(map(len, reasons), default=1)}')])
+    intervals['index'], intervals['end_index'], intervals['depth'] = index, end_index, depth
+    intervals['label'], intervals['reason'] = labels, reasons
+    columns = {'ns': matlab_datenum_to_datetime64(df['NTP']/60/60/24).astype(np.int64) if 'NTP' in df else None,
+               'frame': df[frame_column] if frame_column in df else None,
+               'np': df['NPSample'] if 'NPSample' in df else None}
+    for field, column in columns.items():
+        values = np.full(num_rows, -1, dtype=np.int64) if column is None else np.asarray(pd.Series(column).fillna(-1), dtype=np.int64)
+        intervals[f'start_{field}'] = values[index]
+        intervals[f'end_{field}'] = np.where(end_index >= 0, values[np.clip(end_index, 0, max(0, num_rows - 1))], -1)
+    return intervals
+
+
+def events_of(intervals):
+    """The intervals that are events, i.e. have no filter reason."""
+    return intervals[intervals['reason'] == '']
@@ -0,0 +1,164 @@
+import collections
+import csv
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from walk_container import CONTAINER_NAME, load_offsets, read_window
+
+# Modalities saved as media files; the reader returns their path instead of decoding them
+MEDIA_MODALITIES = {'gopro': '{}_gopro.mp4', 'pupil': '{}_pupil.mp4', 'gopro_audio': '{}_gopro_audio.wav'}
+
+SENSOR_MODALITIES = ['np', 'xs_CoM', 'chestphone_acc', 'chestphone_gyro', 'chestphone_mag', 'chestphone_gps',
+                     'chestphone_light', 'pupilphone_acc', 'pupilphone_gyro', 'pupilphone_mag', 'pupilphone_gps']
+
+
+class EventReader:
+    """
+    Read synchronized events keyed by (subject, walk, event index) for training loops.
+
+    Walk folders are opened lazily. Upcoming events are loaded on background threads, and decoded arrays are
+    kept in a bounded LRU cache. Both the per-file layout and the sensor_windows.h5 container are supported.
+
+    Parameters:
+        root (str): Folder holding RW{subject}/RW{subject}-Walk{walk}-self-syncronize-split/ folders.
+        cache_size (int): Maximum number of arrays kept in the LRU cache.
+        prefetch (int): Number of upcoming events loaded ahead by iter_events.
+        workers (int): Number of background loading threads.
+    """
+
+    def __init__(self, root='../synchronized/', cache_size=1024, prefetch=8, workers=4):
+        self.root = root
+        self.cache_size = cache_size
+        self.prefetch = prefetch
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.cache = collections.OrderedDict() # {(subject, walk, index, modality): array}
+        self.lock = threading.Lock() # guards the cache and the walk tables, never held while reading data
+        self.stats = {} # {(subject, walk): {index: (label, missing modalities)}}
+        self.containers = {} # {(subject, walk): (h5py.File, offsets map, lock of the file) or None}
+
+    def walk_folder(self, subject, walk):
+        return os.path.join(self.root, f'RW{subject}', f'RW{subject}-Walk{walk}-self-syncronize-split')
+
+    def walk_stats(self, subject, walk):
+        """
+        Events of one walk from its index_stats.csv.
+
+        Returns:
+            dict: {index: (label, list of missing modalities)} in event order.
+        """
+        with self.lock:
+            if (subject, walk) not in self.stats:
+                events = {}
+                with open(os.path.join(self.walk_folder(subject, walk), 'index_stats.csv'), newline='') as f:
+                    for row in csv.DictReader(f):
+                        if row['Index'] == 'Index': # repeated header of appended runs
+                            continue
+                        missing = [m for m in row['Missing Modalities'].split(', ') if m]
+                        events[int(row['Index'])] = (row['Label'], missing)
+                self.stats[(subject, walk)] = dict(sorted(events.items()))
+            return self.stats[(subject, walk)]
+
+    def missing_modalities(self, subject, walk, index):
+        """Modalities recorded as missing for the event in the "Missing Modalities" column of index_stats.csv."""
+        return self.walk_stats(subject, walk)[index][1]
+
+    def _container(self, subject, walk):
+        with self.lock:
+            if (subject, walk) not in self.containers:
+                path = os.path.join(self.walk_folder(subject, walk), CONTAINER_NAME)
+                if os.path.exists(path):
+                    import h5py  # optional dependency, only needed for the container output format
+                    container = h5py.File(path, 'r')
+                    self.containers[(subject, walk)] = (container, load_offsets(container), threading.Lock())
+                else:
+                    self.containers[(subject, walk)] = None
+            return self.containers[(subject, walk)]
+
+    def _load(self, subject, walk, index, modality):
+        key = (subject, walk, index, modality)
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+
+        if modality in self.missing_modalities(subject, walk, index):
+            arr = None
+        else:
+            container = self._container(subject, walk)
+            if container is not None:
+                container, offsets, container_lock = container
+                with container_lock: # h5py files are not safe to read from several threads at once
+                    arr = read_window(container, index, modality, offsets)
+            else:
+                path = os.path.join(self.walk_folder(subject, walk), f'{index}_{modality}.npy')
+                arr = np.load(path) if os.path.exists(path) else None
+
+        with self.lock:
+            self.cache[key] = arr
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return arr
+
+    def get(self, subject, walk, index, modalities=SENSOR_MODALITIES):
+        """
+        Load one event.
+
+        Parameters:
+            subject (int): Subject number.
+            walk (int): Walk number.
+            index (int): Event index (row of the events csv), as in index_stats.csv.
+            modalities (list[str]): Modalities to load. Videos and audio are returned as file paths.
+
+        Returns:
+            dict: 'label', 'missing' (requested modalities without data) and {modality: array or path}.
+        """
+        label, _ = self.walk_stats(subject, walk)[index]
+        sample = {'label': label, 'missing': []}
+        for modality in modalities:
+            if modality in MEDIA_MODALITIES:
+                value = os.path.join(self.walk_folder(subject, walk), MEDIA_MODALITIES[modality].format(index))
+                if not os.path.exists(value):
+                    value = None
+            else:
+                value = self._load(subject, walk, index, modality)
+            if value is None:
+                sample['missing'].append(modality)
+            sample[modality] = value
+        return sample
+
+    def iter_events(self, keys=None, modalities=SENSOR_MODALITIES, walks=None):
+        """
+        Iterate over events in order while the next `prefetch` events are loaded in the background.
+
+        Parameters:
+            keys (iterable): (subject, walk, index) per event. If None, all events of `walks` in event order.
+            modalities (list[str]): Modalities to load.
+            walks (iterable): (subject, walk) pairs used when keys is None.
+
+        Yields:
+            tuple: ((subject, walk, index), sample) with sample as returned by get.
+        """
+        if keys is None:
+            if walks is None:
+                raise ValueError("iter_events needs the keys of the events or the walks to read")
+            keys = [(subject, walk, index) for subject, walk in walks for index in self.walk_stats(subject, walk)]
+        keys = iter(keys)
+        pending = collections.deque()
+        for key in keys:
+            pending.append((key, self.pool.submit(self.get, *key, modalities)))
+            if len(pending) > self.prefetch:
+                key, future = pending.popleft()
+                yield key, future.result()
+        while pending:
+            key, future = pending.popleft()
+            yield key, future.result()
+
+    def close(self):
+        self.pool.shutdown()
+        for container in self.containers.values():
+            if container is not None:
+                container[0].close()
@@ -4,10 +4,15 @@ import datetime
 from datetime import timezone
 import matplotlib.pyplot as plt
 import os
-import shutil
 import pandas as pd
 import re
+import argparse
 from pathlib import Path
+from ntp_time import matlab_datenum_to_datetime64
+from instrumentation import StageMetrics, measure
+from mat_reader import RWNAPP_VARIABLES, MatFile
+from staging import stage_files
+from xsens_workbook import XSENS_COM_SHEET, convert_xsens_workbook
 
 # # Specify the folder path
 # folder_path = '../RWNApp_Output_Jan2024/'
@@ -19,6 +24,15 @@ from pathlib import Path
 # for filename in filenames:
 #     print(filename)
 
+# Raw recordings: RW{subject}/Original/Walk{walk} and RW{subject}/Synced/Walk{walk}_complete
+data_root = "E:/BrainNavigationData"
+# RWNApp_RW{subject}_Walk{walk}.mat exported by the RWNApp
+mat_folder = "../../mat_RWNApp_Output_Jan2024/"
+# Rows per chunk when streaming .mat variables to .npy (bounds the memory for v7.3 files)
+mat_chunk_rows = 1 << 20
+# Sheets of the Xsens workbook converted to arrays, synchronize.py uses the Center of Mass
+xsens_sheets = [XSENS_COM_SHEET]
+
 save_ori_dirname_map = {
     "chest_phone": "ChestPhone",
     "pupil_phone": "PupilPhone",
@@ -26,222 +40,115 @@ save_ori_dirname_map = {
     "pupil": "Pupil"
 }
 
-def move_files(subject, walk):
+# Raw phone exports: one pattern with a named group per modality, the group name is the destination suffix
+phone_file_pattern = re.compile(r'^(?:(?P<acc>accelData)|(?P<light>ambient)|(?P<gps>gps)|(?P<gyro>gyro)|(?P<mag>mag)).*csv$')
+# How move_files stages the raw files: 'auto' (reflink, then hardlink, then parallel copy), 'reflink', 'hardlink', 'symlink' or 'copy'
+staging_mode = 'auto'
+# Files staged at once (also the threads of a chunked copy)
+staging_workers = 4
+
+def move_files(subject, walk, mode=staging_mode, workers=staging_workers):
     save_folder = f"../../RW{subject}/RW{subject}-Walk{walk}-extracted/"
 
     if not os.path.exists(save_folder):
         os.makedirs(save_folder)
 
-    # -------------------------------
-    # move chest phone videos
-    acc = r'^accelData.*csv$'
-    ambient = r'^ambient.*csv$'
-    gps = r'^gps.*csv$'
-    gyro = r'^gyro.*csv$'
-    mag = r'^mag.*csv$'
-
-    data_type = "chest_phone"
-
-    chest_directory = f"E:/BrainNavigationData/RW{subject}/Original/Walk{walk}/{save_ori_dirname_map[data_type]}"
-
-    for root, dirs, files in os.walk(chest_directory):
-        for name in files:
-            filename = os.path.join(root, name)
-            # print(filename)
-            match = re.match(acc, name)
-            if match:
-                new_file = save_folder + f"data_{data_type}_acc.csv"
-                print(f"Copying {filename} to {new_file}...")
-                # input("Press Enter to continue")
-                shutil.copy(filename, new_file)
-
-            match = re.match(ambient, name)
-            if match:
-                new_file = save_folder + f"data_{data_type}_light.csv"
-                print(f"Copying {filename} to {new_file}...")
-                # input("Press Enter to continue")
-                shutil.copy(filename, new_file)
-            
-            match = re.match(gps, name)
-            if match:
-                new_file = save_folder + f"data_{data_type}_gps.csv"
-                print(f"Copying {filename} to {new_file}...")
-                # input("Press Enter to continue")
-                shutil.copy(filename, new_file)
-
-            match = re.match(gyro, name)
-            if match:
-                new_file = save_folder + f"data_{data_type}_gyro.csv"
-                print(f"Copying {filename} to {new_file}...")
-                # input("Press Enter to continue")
-                shutil.copy(filename, new_file)
-
-            match = re.match(mag, name)
-            if match:
-                new_file = save_folder + f"data_{data_type}_mag.csv"
-                print(f"Copying {filename} to {new_file}...")
-                # input("Press Enter to continue")
-                shutil.copy(filename, new_file)
-
-    print("Done moving chest phone")
+    # {destination: source}; files already at the destination with the same size and mtime are skipped
+    pairs = {}
 
     # -------------------------------
-    # move pupil phone
-    # acc = r'^accelData.*csv$'
-    # ambient = r'^ambient.*csv$'
-    # gps = r'^gps.*csv$'
-    # gyro = r'^gyro.*csv$'
-    data_type = "pupil_phone"
-
-    pupil_directory = f"E:/BrainNavigationData/RW{subject}/Original/Walk{walk}/{save_ori_dirname_map[data_type]}"
-
-    for root, dirs, files in os.walk(pupil_directory):
-        for name in files:
-            filename = os.path.join(root, name)
-            # print(filename)
-            match = re.match(acc, name)
-            if match:
-                new_file = save_folder + f"data_{data_type}_acc.csv"
-                print(f"Copying {filename} to {new_file}...")
-                # input("Press Enter to continue")
-                shutil.copy(filename, new_file)
-
-            match = re.match(gps, name)
-            if match:
-                new_file = save_folder + f"data_{data_type}_gps.csv"
-                print(f"Copying {filename} to {new_file}...")
-                # input("Press Enter to continue")
-                shutil.copy(filename, new_file)
-
-            match = re.match(gyro, name)
-            if match:
-                new_file = save_folder + f"data_{data_type}_gyro.csv"
-                print(f"Copying {filename} to {new_file}...")
-                # input("Press Enter to continue")
-                shutil.copy(filename, new_file)
-
-            match = re.match(mag, name)
-            if match:
-                new_file = save_folder + f"data_{data_type}_mag.csv"
-                print(f"Copying {filename} to {new_file}...")
-                # input("Press Enter to continue")
-                shutil.copy(filename, new_file)
-
-    print("Done moving pupil phone")
-        
+    # chest phone and pupil phone (the pupil phone has no ambient light)
+    for data_type in ["chest_phone", "pupil_phone"]:
+        directory = f"{data_root}/RW{subject}/Original/Walk{walk}/{save_ori_dirname_map[data_type]}"
+        for root, dirs, files in os.walk(directory):
+            for name in files:
+                match = phone_file_pattern.match(name)
+                if match and not (data_type == "pupil_phone" and match.lastgroup == "light"):
+                    pairs[save_folder + f"data_{data_type}_{match.lastgroup}.csv"] = os.path.join(root, name)
 
     # -------------------------------
-    # move gopro
-    # gopro = r'.*'
-    # gopro = r".*CleanedAudio.mp4$"
+    # gopro
     data_type = "gopro"
 
     ## gopro video is in Synced directory
-    original_dir = f"E:/BrainNavigationData/RW{subject}/Synced/Walk{walk}_complete/{save_ori_dirname_map[data_type]}"
+    original_dir = f"{data_root}/RW{subject}/Synced/Walk{walk}_complete/{save_ori_dirname_map[data_type]}"
     original_files = list(Path(original_dir).rglob('*CleanedAudio.mp4'))
     print("original_dir:", original_dir, "; original_files:", original_files)
     if len(original_files) > 1:
         raise ValueError("Multiple CleanedAudio.mp4 files")
-    
-    new_file = save_folder + f"data_video_{data_type}.mp4"
-    print(f"Copying {original_files[0]} to {new_file}...")
-    # input("Press Enter to continue")
-    shutil.copy(original_files[0], new_file)
-
-    print(f"Done moving gopro\nsub: {subject}, walk: {walk}")
+    pairs[save_folder + f"data_video_{data_type}.mp4"] = str(original_files[0])
 
     # -------------------------------
-    # move pupil video
-    # pv = r".*\.mp4$"
+    # pupil video
     data_type = "pupil"
 
     ## pupil video is in Synced directory
-    original_dir = f"E:/BrainNavigationData/RW{subject}/Synced/Walk{walk}_complete/{save_ori_dirname_map[data_type]}"
+    original_dir = f"{data_root}/RW{subject}/Synced/Walk{walk}_complete/{save_ori_dirname_map[data_type]}"
     original_files = list(Path(original_dir).rglob('*.mp4'))
     if len(original_files) > 1:
         raise ValueError("Multiple .mp4 files in Pupil (vedio) directory")
-    
-    new_file = save_folder + f"data_video_{data_type}.mp4"
-    print(f"Copying {original_files[0]} to {new_file}...")
-    # input("Press Enter to continue")
-    shutil.copy(original_files[0], new_file)
+    pairs[save_folder + f"data_video_{data_type}.mp4"] = str(original_files[0])
 
-    print(f"Done moving xsense\nsub: {subject}, walk: {walk}")
+    stage_files(pairs, mode=mode, workers=workers)
+    print(f"Done moving files\nsub: {subject}, walk: {walk}")
 
 
-def extract_mat(subject, walk):
-    mat = scipy.io.loadmat(f'../../mat_RWNApp_Output_Jan2024/RWNApp_RW{subject}_Walk{walk}.mat')
+def extract_mat(subject, walk, metrics=None, chunk_rows=mat_chunk_rows, sheets=xsens_sheets):
+    # Only the needed variables are read, v7.3 (HDF5) files are streamed to .npy in chunks of rows
+    with measure(metrics, 'loadmat'):
+        mat = MatFile(f'{mat_folder}RWNApp_RW{subject}_Walk{walk}.mat')
     print(mat.keys())
 
-    data_np = mat['d_np']
-    data_xs = mat['d_xs']
-    time_np = mat['ntp_np']
-    time_xs = mat['ntp_xs']
-    time_gopro = mat['ntp_gp']
-    time_pupil = mat['ntp_pupil']
+    missing = [variable for variable in RWNAPP_VARIABLES if variable not in mat.keys()]
+    if missing:
+        mat.close()
+        raise KeyError(f"RWNApp_RW{subject}_Walk{walk}.mat has no variable {', '.join(missing)}")
+
     print(f'subject: {subject}, walk: {walk}')
-    print(data_np.shape)
-    print(data_xs.shape)
-    print(time_np.shape)
-    print(time_xs.shape)
+    for variable in RWNAPP_VARIABLES:
+        print(variable, mat.shape(variable))
 
-    source_folder = f"E:/BrainNavigationData/RW{subject}/Original/Walk{walk}"
-    save_folder = f"E:/BrainNavigationData/RW{subject}/RW{subject}-Walk{walk}-extracted/"
+    source_folder = f"{data_root}/RW{subject}/Original/Walk{walk}"
+    save_folder = f"{data_root}/RW{subject}/RW{subject}-Walk{walk}-extracted/"
 
     if not os.path.exists(save_folder):
         os.makedirs(save_folder)
 
-    np.save(save_folder + "data_np", data_np)
-    np.save(save_folder + "data_xs", data_xs)
-
-    # Extract xsense
-    df = pd.read_excel(os.path.join(source_folder, f'Xsens/RW_{subject}_w{walk}.xlsx'), sheet_name='Center of Mass')
-    df.to_csv(save_folder + 'data_xs_Center-of-Mass.csv', index=False)
-
-
-    def matlab_datenum_to_formatted_string(matlab_datenum):
-
-        # Convert MATLAB datenum to Python datenum by subtracting the MATLAB epoch
-        python_datenum = matlab_datenum  # Adjust for MATLAB epoch
-
-        # Convert Python datenum to datetime
-        python_datetime = datetime.datetime.fromordinal(int(python_datenum)) + datetime.timedelta(days=python_datenum % 1) - datetime.timedelta(days=366)
-
-        # Format datetime string
-        formatted_string = python_datetime.strftime("%Y-%m-%d_%H-%M-%S-%f")[:-3]
-
-        return formatted_string
-
+    with measure(metrics, 'save_data', 'np'):
+        mat.save_npy('d_np', save_folder + "data_np.npy", chunk_rows)
+    with measure(metrics, 'save_data', 'xs'):
+        mat.save_npy('d_xs', save_folder + "data_xs.npy", chunk_rows)
 
-    # convert matlab NTP time to datetime timestamp
-    if time_np.shape[1] > 0:
-        np_formatted_strings = [matlab_datenum_to_formatted_string(md) for md in time_np[:, 0]/60/60/24]
-        np.save(save_folder + "time_np", np_formatted_strings)
-    else:
-        print("time_np missing")
+    # Extract xsense: only the requested sheets are parsed, unchanged workbooks are skipped
+    with measure(metrics, 'read_xlsx', 'xs_CoM'):
+        convert_xsens_workbook(os.path.join(source_folder, f'Xsens/RW_{subject}_w{walk}.xlsx'), save_folder, sheets=sheets)
 
-    if time_xs.shape[1] > 0:
-        xs_formatted_strings = [matlab_datenum_to_formatted_string(md) for md in time_xs[:, 0]/60/60/24]
-        np.save(save_folder + "time_xs", xs_formatted_strings)
-    else:
-        print("time_xs missing")
 
-    if time_gopro.shape[1] > 0:
-        gopro_formatted_strings = [matlab_datenum_to_formatted_string(md) for md in time_gopro[:, 0]/60/60/24]
-        np.save(save_folder + "time_gopro", gopro_formatted_strings)
-    else:
-        print("time_gopro missing")
+    # convert matlab NTP time to int64 epoch nanoseconds, read back with ntp_time.load_time_array
+    for variable, modality in [('ntp_np', 'np'), ('ntp_xs', 'xs'), ('ntp_gp', 'gopro'), ('ntp_pupil', 'pupil')]:
+        if mat.shape(variable)[1] > 0:
+            with measure(metrics, 'convert_time', modality):
+                mat.save_npy(variable, save_folder + f"time_{modality}.npy", chunk_rows,
+                             convert=lambda rows: matlab_datenum_to_datetime64(rows[:, 0]/60/60/24).astype(np.int64))
+        else:
+            print(f"time_{modality} missing")
 
-    if time_pupil.shape[1] > 0:
-        pupil_formatted_strings = [matlab_datenum_to_formatted_string(md) for md in time_pupil[:, 0]/60/60/24]
-        np.save(save_folder + "time_pupil", pupil_formatted_strings)
-    else:
-        print("time_pupil missing")
+    mat.close()
 
 
 
 if __name__ == "__main__":
-    subject = 1
-    for walk in range(6, 8):
-        move_files(subject, walk)
-        extract_mat(subject, walk)
+    parser = argparse.ArgumentParser(description="Extract labels, data and timestamps of walks into the extracted folders.")
+    parser.add_argument("--subject", type=int, default=1, help="Subject number (default: 1).")
+    parser.add_argument("--walks", type=int, nargs='+', default=[6, 7], help="Walk numbers (default: 6 7).")
+    parser.add_argument("--metrics", action="store_true", help="Record time, I/O and peak memory per stage into metrics_extract.csv/.json in the extracted folder.")
+    parser.add_argument("--staging-mode", choices=['auto', 'reflink', 'hardlink', 'symlink', 'copy'], default=staging_mode, help="How raw files are staged into the extracted folder (default: %(default)s).")
+    parser.add_argument("--xsens-sheets", nargs='+', default=xsens_sheets, help="Sheets of the Xsens workbook to convert (default: %(default)s).")
+    args = parser.parse_args()
+
+    for walk in args.walks:
+        metrics = StageMetrics(enabled=args.metrics)
+        with measure(metrics, 'move_files'):
+            move_files(args.subject, walk, mode=args.staging_mode)
+        extract_mat(args.subject, walk, metrics=metrics, sheets=args.xsens_sheets)
+        metrics.save(f"{data_root}/RW{args.subject}/RW{args.subject}-Walk{walk}-extracted/", name='metrics_extract', subject=args.subject, walk=walk)
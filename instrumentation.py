@@ -0,0 +1,167 @@
+import contextlib
+import csv
+import json
+import os
+import sys
+import time
+
+try:
+    import psutil  # optional, used for the I/O counters and peak memory on Windows and macOS
+except ImportError:
+    psutil = None
+
+# Columns of the metrics csv
+METRIC_FIELDS = ['stage', 'modality', 'event', 'seconds', 'read_bytes', 'write_bytes', 'peak_rss_bytes']
+
+
+def read_io_bytes():
+    """
+    Bytes read and written by this process so far, including page cache hits. None if no counter is available.
+
+    Returns:
+        tuple[int, int]: (read bytes, written bytes) or (None, None).
+    """
+    if os.path.exists('/proc/self/io'):
+        with open('/proc/self/io') as f:
+            counters = dict(line.split(': ') for line in f.read().splitlines())
+        return int(counters['rchar']), int(counters['wchar'])
+    if psutil is not None:
+        try:
+            io = psutil.Process().io_counters()
+            return io.read_bytes, io.write_bytes
+        except (AttributeError, psutil.Error):  # io_counters is not available on macOS
+            pass
+    return None, None
+
+
+def read_peak_rss():
+    """Peak resident memory of this process in bytes since start or the last reset_peak_rss, None if unknown."""
+    if os.path.exists('/proc/self/status'):
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    if psutil is not None and hasattr(psutil.Process().memory_info(), 'peak_wset'):  # Windows
+        return psutil.Process().memory_info().peak_wset
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def reset_peak_rss():
+    # Linux only: writing 5 to clear_refs resets VmHWM to the current resident memory
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+class StageMetrics:
+    """
+    Opt-in recorder of wall time, bytes read and written and peak resident memory per stage, modality and event.
+
+    Stages can be nested. On Linux the memory high-water mark is reset at the start of every stage so its peak
+    belongs to the stage; elsewhere it is the peak of the process up to the end of the stage. Work done in
+    worker processes (e.g. video encoding with workers > 1) and in ffmpeg is not included.
+
+    Parameters:
+        enabled (bool): If False, stage() does nothing, so the recorder can always be passed around.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.records = []
+        self.open_peaks = [] # peak memory of the open stages, innermost last
+        self.started = time.time()
+
+    @contextlib.contextmanager
+    def stage(self, stage, modality='', event=''):
+        """
+        Measure the enclosed block.
+
+        Parameters:
+            stage (str): Name of the stage, e.g. 'load_streams' or 'extract'.
+            modality (str): Modality the stage works on, if any.
+            event (int): Event index the stage works on, if any.
+        """
+        if not self.enabled:
+            yield
+            return
+
+        self._update_open_peaks()
+        reset_peak_rss()
+        self.open_peaks.append(read_peak_rss())
+        read_start, write_start = read_io_bytes()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            read_end, write_end = read_io_bytes()
+            self._update_open_peaks()
+            peak = self.open_peaks.pop()
+            if self.open_peaks and peak is not None:
+                self.open_peaks[-1] = max(self.open_peaks[-1], peak)
+            self.records.append({
+                'stage': stage, 'modality': modality, 'event': event, 'seconds': round(seconds, 6),
+                'read_bytes': None if read_start is None else read_end - read_start,
+                'write_bytes': None if write_start is None else write_end - write_start,
+                'peak_rss_bytes': peak,
+            })
+
+    def _update_open_peaks(self):
+        # fold the current high-water mark into all open stages before it is reset
+        peak = read_peak_rss()
+        if peak is not None:
+            self.open_peaks = [peak if p is None else max(p, peak) for p in self.open_peaks]
+
+    def summary(self):
+        """
+        Totals per (stage, modality) over all events.
+
+        Returns:
+            list[dict]: 'stage', 'modality', 'calls', 'seconds', 'read_bytes', 'write_bytes' and 'peak_rss_bytes' (max).
+        """
+        totals = {}
+        for record in self.records:
+            key = (record['stage'], record['modality'])
+            total = totals.setdefault(key, {'stage': key[0], 'modality': key[1], 'calls': 0, 'seconds': 0.0,
+                                            'read_bytes': 0, 'write_bytes': 0, 'peak_rss_bytes': 0})
+            total['calls'] += 1
+            total['seconds'] = round(total['seconds'] + record['seconds'], 6)
+            for field in ['read_bytes', 'write_bytes']:
+                total[field] = None if record[field] is None or total[field] is None else total[field] + record[field]
+            total['peak_rss_bytes'] = None if record['peak_rss_bytes'] is None else max(total['peak_rss_bytes'] or 0, record['peak_rss_bytes'])
+        return list(totals.values())
+
+    def save(self, save_folder, name='metrics', **info):
+        """
+        Write {name}.csv (one row per measured block) and {name}.json (run info, summary and all records).
+
+        Parameters:
+            save_folder (str): Output folder, e.g. the folder of index_stats.csv.
+            name (str): File name without extension.
+            info: Extra run information stored in the json, e.g. subject, walk and parameters.
+        """
+        if not self.enabled:
+            return
+        with open(os.path.join(save_folder, name + '.csv'), mode='w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=METRIC_FIELDS)
+            writer.writeheader()
+            writer.writerows(self.records)
+        with open(os.path.join(save_folder, name + '.json'), mode='w') as f:
+            json.dump({'started': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.started)), **info,
+                       'summary': self.summary(), 'records': self.records}, f, indent=1)
+        print(f"Metrics have been saved to {os.path.join(save_folder, name)}.csv and .json")
+
+
+def measure(metrics, stage, modality='', event=''):
+    """metrics.stage(...) if a StageMetrics is given, otherwise a no-op context."""
+    if metrics is None:
+        return contextlib.nullcontext()
+    return metrics.stage(stage, modality, event)
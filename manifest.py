@@ -0,0 +1,86 @@
+import hashlib
+import json
+import os
+
+# Name of the per-event manifest inside the self-syncronize-split folder
+MANIFEST_NAME = 'manifest.json'
+
+
+def load_manifest(save_folder):
+    """
+    Load the manifest of an output folder.
+
+    Returns:
+        dict: {'events': {str(index): {'inputs': hash, 'params': dict, 'files': list}}, 'inputs': file_fingerprints of
+            the last run, 'stats': {str(index): statistics of the event in the output csv files}}, empty if there is none yet.
+    """
+    path = os.path.join(save_folder, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {'events': {}, 'inputs': {}, 'stats': {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_manifest(save_folder, manifest):
+    # Write to a temporary file first so a crash never leaves a truncated manifest
+    path = os.path.join(save_folder, MANIFEST_NAME)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(path + '.tmp', path)
+
+
+def file_fingerprints(folder, names, known=None):
+    """
+    Content hash of the input files of a folder. The large sensor and video inputs are too big to hash on every
+    run, so the hash of a file whose size and mtime are unchanged since `known` is reused. A file that is only
+    rewritten or touched, e.g. by rerunning extract_mat_data.py, is hashed again but keeps its fingerprint.
+
+    Parameters:
+        folder (str): Folder of the files.
+        names (list[str]): Names of the files the outputs are made from.
+        known (dict): Fingerprints of an earlier run, e.g. the 'inputs' of the manifest.
+
+    Returns:
+        dict: {file name: {'size', 'mtime_ns', 'sha1'}}.
+    """
+    known = known or {}
+    fingerprints = {}
+    for name in sorted(names):
+        stat = os.stat(os.path.join(folder, name))
+        previous = known.get(name)
+        if previous and previous['size'] == stat.st_size and previous['mtime_ns'] == stat.st_mtime_ns:
+            fingerprints[name] = previous
+            continue
+        sha = hashlib.sha1()
+        with open(os.path.join(folder, name), 'rb') as f:
+            for block in iter(lambda: f.read(1 << 24), b''):
+                sha.update(block)
+        fingerprints[name] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha1': sha.hexdigest()}
+    return fingerprints
+
+
+def event_input_hash(label_rows, input_fingerprints, params):
+    """
+    Hash everything one event is extracted from: the content of its label rows, the content of the walk's
+    input files and the synchronization parameters.
+
+    Parameters:
+        label_rows (pd.DataFrame): Rows of the events csv that define the event (its Beg and End rows).
+        input_fingerprints (dict): From file_fingerprints of the files the event is read from.
+        params (dict): Parameters the outputs depend on, e.g. time_window and fps_for_frame.
+
+    Returns:
+        str: Hex digest.
+    """
+    sha = hashlib.sha1()
+    sha.update(label_rows.to_csv(index=False).encode())
+    sha.update(json.dumps({name: fingerprint['sha1'] for name, fingerprint in input_fingerprints.items()}, sort_keys=True).encode())
+    sha.update(json.dumps(params, sort_keys=True).encode())
+    return sha.hexdigest()
+
+
+def is_event_current(entry, input_hash, save_folder):
+    """Whether a manifest entry was produced from the same inputs and all of its files still exist."""
+    if entry is None or entry['inputs'] != input_hash:
+        return False
+    return all(os.path.exists(os.path.join(save_folder, name)) for name in entry['files'])
@@ -0,0 +1,114 @@
+import numpy as np
+import scipy.io
+from numpy.typing import NDArray
+
+# Variables of the RWNApp .mat files used by the pipeline
+RWNAPP_VARIABLES = ['d_np', 'd_xs', 'ntp_np', 'ntp_xs', 'ntp_gp', 'ntp_pupil']
+
+
+class MatFile:
+    """
+    Lazy reader of selected variables of a MATLAB .mat file, for both the v5/v7 format (scipy.io) and the
+    v7.3 format, which is HDF5 (h5py). Variables are only read when requested, and v7.3 variables can be
+    read in chunks of rows so large recordings never have to fit into memory at once.
+
+    Arrays are returned in MATLAB orientation, i.e. (rows, columns) as scipy.io.loadmat returns them.
+
+    Parameters:
+        path (str): Path to the .mat file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            major, _ = scipy.io.matlab.matfile_version(f)
+        self.is_hdf5 = major == 2
+        if self.is_hdf5:
+            import h5py  # optional dependency, only needed for v7.3 files
+            self.file = h5py.File(path, 'r')
+            self.shapes = {name: self._hdf5_shape(name) for name in self.file.keys() if not name.startswith('#')}
+        else:
+            self.file = None
+            self.shapes = {name: shape for name, shape, _ in scipy.io.whosmat(path)}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+    def keys(self):
+        return list(self.shapes)
+
+    def shape(self, name):
+        """Shape of a variable without reading it."""
+        return tuple(self.shapes[name])
+
+    def _hdf5_shape(self, name):
+        dataset = self.file[name]
+        if dataset.attrs.get('MATLAB_empty', 0):
+            return (0, 0)
+        return dataset.shape[::-1] # MATLAB writes column-major arrays, HDF5 sees them transposed
+
+    def load(self, name) -> NDArray:
+        """Read one variable completely."""
+        if self.is_hdf5:
+            if self.shape(name) == (0, 0):
+                return np.zeros((0, 0))
+            return self.file[name][()].T
+        return scipy.io.loadmat(self.path, variable_names=[name])[name]
+
+    def iter_rows(self, name, chunk_rows=1 << 20):
+        """
+        Yield a 2-D variable in chunks of rows.
+
+        For v7.3 files, only one chunk is in memory at a time. v5 files cannot be read partially, so the variable
+        is loaded once (still without the other variables of the file) and sliced.
+
+        Parameters:
+            name (str): Variable name.
+            chunk_rows (int): Number of rows per chunk.
+
+        Yields:
+            NDArray: Consecutive row blocks of shape (<= chunk_rows, columns).
+        """
+        num_rows = self.shape(name)[0]
+        if self.is_hdf5 and num_rows > 0:
+            dataset = self.file[name]
+            for start in range(0, num_rows, chunk_rows):
+                yield dataset[:, start:start + chunk_rows].T
+        else:
+            arr = self.load(name)
+            for start in range(0, num_rows, chunk_rows):
+                yield arr[start:start + chunk_rows]
+
+    def save_npy(self, name, out_path, chunk_rows=1 << 20, convert=None):
+        """
+        Write a variable to a .npy file chunk by chunk, so peak memory is bounded by chunk_rows for v7.3 files.
+
+        Parameters:
+            name (str): Variable name.
+            out_path (str): Path of the .npy file.
+            chunk_rows (int): Number of rows per chunk.
+            convert (callable): Applied to every chunk before it is written, e.g. to convert NTP time.
+                Must map n rows to n output rows.
+        """
+        num_rows = self.shape(name)[0]
+        out = None
+        start = 0
+        for chunk in self.iter_rows(name, chunk_rows):
+            if convert is not None:
+                chunk = convert(chunk)
+            if out is None:
+                out = np.lib.format.open_memmap(out_path, mode='w+', dtype=chunk.dtype, shape=(num_rows,) + chunk.shape[1:])
+            out[start:start + len(chunk)] = chunk
+            start += len(chunk)
+        if out is None: # empty variable
+            np.save(out_path, self.load(name) if convert is None else convert(self.load(name)))
+        else:
+            out.flush()
+            del out
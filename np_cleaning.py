@@ -0,0 +1,137 @@
+import argparse
+import json
+import os
+
+import numpy as np
+import scipy.signal
+
+# Sample frequency of the neural pace signal (Hz)
+NP_FREQ = 250
+# Samples further than spike_threshold robust standard deviations (1.4826 * MAD) from the channel median are spikes
+spike_threshold = 8.0
+# Samples masked on both sides of every detected spike
+spike_pad = 2
+# Rows cleaned at once, and rows of context on both sides of a chunk for the interpolation and the filter
+chunk_rows = 1 << 20
+overlap_rows = 10 * NP_FREQ
+# Rows sampled evenly over the recording to estimate the channel median and MAD
+stat_rows = 1 << 20
+
+
+def robust_stats(data, num_rows=stat_rows):
+    """
+    Per-channel median and robust standard deviation (1.4826 * MAD) from evenly spaced rows of the recording.
+    Non-finite samples are left out, so a single NaN does not turn every spike test False.
+    """
+    sample = np.asarray(data[::max(1, len(data) // num_rows)], dtype=np.float64)
+    sample = np.where(np.isfinite(sample), sample, np.nan)
+    median = np.nanmedian(sample, axis=0)
+    scale = 1.4826 * np.nanmedian(np.abs(sample - median), axis=0)
+    return median, np.where(scale > 0, scale, 1.0)
+
+
+def dilate(mask, pad):
+    """Extend every True run of a (rows, channels) mask by pad rows on both sides."""
+    if pad <= 0:
+        return mask
+    counts = np.cumsum(np.pad(mask.astype(np.int32), ((pad + 1, pad), (0, 0))), axis=0)
+    return counts[2 * pad + 1:] - counts[:-2 * pad - 1] > 0
+
+
+def clean_chunk(x, median, scale, threshold=spike_threshold, pad=spike_pad, sos=None):
+    """
+    Remove the spikes of a block of rows: threshold, dilate, and linearly interpolate every channel over the
+    masked samples from the unmasked ones. Non-finite samples are masked as well. Optionally band-pass filter
+    the result.
+
+    Returns:
+        tuple[NDArray, NDArray]: Cleaned float64 block and the boolean artifact mask, both (rows, channels).
+    """
+    x = np.array(x, dtype=np.float64)
+    mask = dilate(np.abs(x - median) > threshold * scale, pad) | ~np.isfinite(x)
+    rows = np.arange(len(x))
+    for c in range(x.shape[1]):
+        bad = mask[:, c]
+        if bad.any() and not bad.all():
+            x[bad, c] = np.interp(rows[bad], rows[~bad], x[~bad, c])
+    if sos is not None:
+        x = scipy.signal.sosfiltfilt(sos, x, axis=0)
+    return x, mask
+
+
+def clean_np(load_folder, threshold=spike_threshold, pad=spike_pad, band=None, chunk=chunk_rows, overlap=overlap_rows):
+    """
+    Remove large spikes from data_np.npy of an extracted walk folder, chunk by chunk, and write
+    data_np_clean.npy (float32) and data_np_artifact.npy (bool, True where a sample was replaced), both of the
+    shape of data_np.npy, plus data_np_clean.json with the parameters and the size and mtime of data_np.npy.
+    An output from the same data and parameters is skipped.
+
+    Every chunk is cleaned with overlap rows of context on both sides, so spikes and the filter response at
+    chunk edges are handled as in the whole recording. Only the core rows of a chunk are written.
+
+    Parameters:
+        load_folder (str): The RW{subject}-Walk{walk}-extracted/ folder.
+        threshold (float): Spike threshold in robust standard deviations from the channel median.
+        pad (int): Samples masked on both sides of every spike.
+        band (tuple): (low, high) cut-off frequencies (Hz) of an optional zero-phase band-pass filter.
+        chunk (int): Rows per chunk.
+        overlap (int): Rows of context on both sides of a chunk.
+
+    Returns:
+        dict: Content of data_np_clean.json, with 'artifact_ratio' per channel.
+    """
+    src = load_folder + 'data_np.npy'
+    stat = os.stat(src)
+    params = {'threshold': threshold, 'pad': pad, 'band': list(band) if band else None}
+    if os.path.exists(load_folder + 'data_np_clean.json'):
+        with open(load_folder + 'data_np_clean.json') as f:
+            meta = json.load(f)
+        if meta['src_size'] == stat.st_size and meta['src_mtime_ns'] == stat.st_mtime_ns and meta['params'] == params:
+            print(f"Cleaned np is up to date in {load_folder}data_np_clean.npy")
+            return meta
+
+    data = np.load(src, mmap_mode='r')
+    data = data.reshape(len(data), -1)
+    median, scale = robust_stats(data)
+    sos = None
+    if band:
+        sos = scipy.signal.butter(4, band, btype='bandpass', fs=NP_FREQ, output='sos')
+
+    clean = np.lib.format.open_memmap(load_folder + 'data_np_clean.npy', mode='w+', dtype=np.float32, shape=data.shape)
+    artifact = np.lib.format.open_memmap(load_folder + 'data_np_artifact.npy', mode='w+', dtype=bool, shape=data.shape)
+    for start in range(0, len(data), chunk):
+        end = min(len(data), start + chunk)
+        context_start, context_end = max(0, start - overlap), min(len(data), end + overlap)
+        x, mask = clean_chunk(data[context_start:context_end], median, scale, threshold, pad, sos)
+        clean[start:end] = x[start - context_start:end - context_start]
+        artifact[start:end] = mask[start - context_start:end - context_start]
+    clean.flush()
+    artifact.flush()
+    ratio = artifact.mean(axis=0).tolist() if len(artifact) else []
+    del clean, artifact
+
+    meta = {'params': params, 'artifact_ratio': ratio, 'src_size': stat.st_size, 'src_mtime_ns': stat.st_mtime_ns}
+    # The stats are written last so an interrupted run never validates a partial output
+    with open(load_folder + 'data_np_clean.json.tmp', 'w') as f:
+        json.dump(meta, f)
+    os.replace(load_folder + 'data_np_clean.json.tmp', load_folder + 'data_np_clean.json')
+    print(f"Cleaned np {data.shape}, artifact ratio per channel: {np.round(ratio, 6).tolist()}")
+    return meta
+
+
+def clean_walk_np(subject, walk, **kwargs):
+    """clean_np of RW{subject}-Walk{walk}-extracted/, keyword arguments as in clean_np."""
+    return clean_np(f'../RW{subject}/RW{subject}-Walk{walk}-extracted/', **kwargs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Remove large spikes from the neural pace signal of walks.")
+    parser.add_argument("--subject", type=int, default=1, help="Subject number (default: 1).")
+    parser.add_argument("--walks", type=int, nargs='+', default=[1], help="Walk numbers (default: 1).")
+    parser.add_argument("--threshold", type=float, default=spike_threshold, help="Spike threshold in robust standard deviations (default: %(default)s).")
+    parser.add_argument("--pad", type=int, default=spike_pad, help="Samples masked on both sides of every spike (default: %(default)s).")
+    parser.add_argument("--band", type=float, nargs=2, default=None, help="Optional band-pass filter, low and high cut-off (Hz).")
+    args = parser.parse_args()
+
+    for walk in args.walks:
+        clean_walk_np(args.subject, walk, threshold=args.threshold, pad=args.pad, band=args.band)
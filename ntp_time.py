@@ -0,0 +1,112 @@
+import numpy as np
+from numpy.typing import NDArray
+import pandas as pd
+
+# Format of every time string produced by extract_mat_data.py and the phone apps, e.g. 2023-05-10_14-22-33-123
+TIME_STR_FORMAT = '%Y-%m-%d_%H-%M-%S-%f'
+
+
+def parse_time_strings(time_strs) -> NDArray[np.int64]:
+    """
+    Parse a whole stream of time strings into int64 epoch nanoseconds in one vectorized call.
+
+    Parameters:
+        time_strs (array-like of str): Time strings in format '%Y-%m-%d_%H-%M-%S-%f'.
+
+    Returns:
+        NDArray[np.int64]: Nanoseconds since 1970-01-01, one per input string.
+    """
+    parsed = pd.to_datetime(pd.Series(np.asarray(time_strs), dtype=object), format=TIME_STR_FORMAT)
+    return parsed.to_numpy().astype('datetime64[ns]').astype(np.int64)
+
+
+def find_close_frames(time_label_ns, time_data_ns) -> NDArray[np.int64]:
+    """
+    Batched replacement of the linear find_close_frame scan.
+
+    For every label time, find the first sample of the stream whose time is >= the label time.
+    Like the original scan, a label after the last sample resolves to frame 0.
+
+    Parameters:
+        time_label_ns (NDArray): Label times in epoch nanoseconds.
+        time_data_ns (NDArray): Sorted sample times of one stream in epoch nanoseconds.
+
+    Returns:
+        NDArray[np.int64]: Frame index in the stream for each label time.
+    """
+    frames = np.searchsorted(time_data_ns, time_label_ns, side='left')
+    frames[frames >= len(time_data_ns)] = 0
+    return frames.astype(np.int64)
+
+
+# MATLAB datenum of 1970-01-01
+MATLAB_UNIX_EPOCH_DATENUM = 719529
+
+
+def matlab_datenum_to_datetime64(matlab_datenum) -> NDArray[np.datetime64]:
+    """
+    Vectorized replacement of matlab_datenum_to_formatted_string.
+
+    The result is truncated to milliseconds, the resolution of the time strings written by earlier versions
+    of extract_mat_data.py, so synchronization results stay identical across both formats.
+
+    Parameters:
+        matlab_datenum (array-like of float): MATLAB datenums in days, e.g. the .mat NTP seconds divided by 60*60*24.
+
+    Returns:
+        NDArray[np.datetime64]: datetime64[ns] timestamps, one per input datenum.
+    """
+    matlab_datenum = np.asarray(matlab_datenum, dtype=np.float64)
+    # Split whole days and day fraction like the scalar converter, datetime.timedelta rounds the fraction to microseconds
+    whole_days = np.floor(matlab_datenum)
+    time_us = (whole_days.astype(np.int64) - MATLAB_UNIX_EPOCH_DATENUM) * 86400000000 \
+        + np.round((matlab_datenum - whole_days) * 86400e6).astype(np.int64)
+    time_ms = np.floor_divide(time_us, 1000)
+    return (time_ms * 1000000).astype('datetime64[ns]')
+
+
+def format_time_ns(time_ns) -> NDArray[np.str_]:
+    """
+    Format epoch nanoseconds as time strings in format '%Y-%m-%d_%H-%M-%S-%f' (milliseconds).
+
+    Parameters:
+        time_ns (array-like of int): Nanoseconds since 1970-01-01.
+
+    Returns:
+        NDArray[np.str_]: Time strings, e.g. 2023-05-10_14-22-33-123.
+    """
+    iso = np.datetime_as_string(np.asarray(time_ns, dtype=np.int64).astype('datetime64[ns]').astype('datetime64[ms]'))
+    iso = np.char.replace(iso, 'T', '_')
+    iso = np.char.replace(iso, ':', '-')
+    return np.char.replace(iso, '.', '-')
+
+
+def load_time_array(path) -> NDArray[np.int64]:
+    """
+    Load a time_*.npy file as int64 epoch nanoseconds.
+
+    Reads both the numeric format written by extract_mat_data.extract_mat and the string format of older
+    extracted folders. Float arrays are converted by their magnitude: MATLAB datenums in days (below 1e7),
+    datenums in seconds as in the NTP columns of the .mat files (above 1e10), otherwise epoch seconds.
+
+    Parameters:
+        path (str): Path to the time_*.npy file.
+
+    Returns:
+        NDArray[np.int64]: Nanoseconds since 1970-01-01.
+    """
+    time_arr = np.load(path)
+    if time_arr.dtype.kind in 'US':
+        return parse_time_strings(time_arr)
+    if time_arr.dtype.kind == 'M':
+        return time_arr.astype('datetime64[ns]').astype(np.int64)
+    if time_arr.dtype.kind in 'iu':
+        return time_arr.astype(np.int64)
+    if time_arr.dtype.kind == 'f':
+        magnitude = np.nanmax(np.abs(time_arr)) if np.isfinite(time_arr).any() else 0
+        if magnitude < 1e7:
+            return matlab_datenum_to_datetime64(time_arr).astype(np.int64)
+        if magnitude > 1e10:
+            return matlab_datenum_to_datetime64(time_arr / 86400).astype(np.int64)
+        return np.round(time_arr * 1e9).astype(np.int64)
+    raise ValueError(f"Unsupported time array dtype {time_arr.dtype} in {path}")
@@ -0,0 +1,252 @@
+import numpy as np
+from numpy.typing import NDArray
+import os
+import json
+import pandas as pd
+from instrumentation import measure
+from xsens_workbook import XSENS_COM_SHEET, load_xsens_sheet, sheet_stem
+from ntp_time import parse_time_strings, load_time_array, format_time_ns
+
+
+def gps_buckets(time_ns, bucket_width=1):
+    """
+    Group GPS sample times into buckets of bucket_width seconds.
+
+    Returns:
+        tuple[NDArray, NDArray]: Time of the first sample of every non-empty bucket in epoch nanoseconds (sorted), as
+            the merged value was timestamped before, and the bucket of every sample.
+    """
+    time_ns = np.asarray(time_ns, dtype=np.int64)
+    width_ns = int(round(bucket_width * 1e9))
+    _, first, inverse = np.unique(np.floor_divide(time_ns, width_ns), return_index=True, return_inverse=True)
+    return time_ns[first], inverse
+
+
+def resample_gps(time_ns, data, bucket_width=1):
+    """
+    Average all GPS samples that fall into the same time bucket. GPS may sample multiple times in one
+    millisecond, so every stream is merged into at most one value per bucket before synchronizing.
+
+    Parameters:
+        time_ns (NDArray): Sample times in epoch nanoseconds.
+        data (NDArray): GPS samples, shape (num_samples, num_channels), e.g. latitude and longitude.
+        bucket_width (float): Width of the buckets (second). Default 1 merges samples of the same second.
+
+    Returns:
+        tuple[NDArray, NDArray]: Time of the first sample of every non-empty bucket in epoch nanoseconds (sorted)
+            and the mean of its samples, shape (num_buckets, num_channels).
+    """
+    data = np.asarray(data, dtype=np.float64).reshape(len(time_ns), -1)
+    bucket_time, inverse = gps_buckets(time_ns, bucket_width)
+    counts = np.bincount(inverse, minlength=len(bucket_time))
+    sums = np.stack([np.bincount(inverse, weights=data[:, c], minlength=len(bucket_time)) for c in range(data.shape[1])], axis=1)
+
+    return bucket_time, sums / counts[:, None]
+
+
+def read_phone_csv(csv_path):
+    """
+    Parse a phone csv (no header, NTP time string in the first column, samples in the others).
+
+    Returns:
+        dict: 'time' in epoch nanoseconds and 'data' of shape (num_samples, num_channels).
+    """
+    df = pd.read_csv(csv_path, header=None)
+    return {'time': parse_time_strings(df.iloc[:, 0]), 'data': np.ascontiguousarray(df.iloc[:, 1:].to_numpy())}
+
+
+def read_gps_csv(csv_path):
+    """
+    Parse a phone gps csv whose latitude and longitude columns are strings like "Lat: 34.07" and "Long: -118.44".
+
+    Returns:
+        dict: 'time' in epoch nanoseconds and 'data' of shape (num_samples, 2) holding latitude and longitude.
+    """
+    df = pd.read_csv(csv_path, header=None)
+    data_gps_1 = df.iloc[:, 1].str.extract(r'Lat: (\d+\.\d+)', expand=False)## delete the str of "Lat:"
+    data_gps_2 = df.iloc[:, 2].str.extract(r'Long: (-?\d+\.\d+)', expand=False)## delete the str of "Long:"
+    data_gps = np.stack((np.array(data_gps_1.astype(float)), np.array(data_gps_2.astype(float))), axis=1)
+    return {'time': parse_time_strings(df.iloc[:, 0]), 'data': data_gps}
+
+
+def read_xsens_csv(csv_path):
+    """
+    Parse data_xs_Center-of-Mass.csv. Its time is stored separately in time_xs.npy.
+
+    Returns:
+        dict: 'frame' (first column) and 'data' of shape (num_samples, num_channels).
+    """
+    df = pd.read_csv(csv_path)
+    return {'frame': df.iloc[:, 0].to_numpy(), 'data': np.ascontiguousarray(df.iloc[:, 1:].to_numpy())}
+
+
+def load_cached(csv_path, cache_folder, reader=read_phone_csv, mmap_mode=None):
+    """
+    Load a parsed csv stream from the columnar cache, or parse it with reader and cache the typed arrays.
+    The cache entry is only used while the size and mtime of the source csv match.
+
+    Parameters:
+        csv_path (str): Path to the source csv file.
+        cache_folder (str): Folder of the cache, one {name}.{key}.npy per array plus a {name}.json with the
+            source file stats. None disables the cache.
+        reader (callable): Parser returning a dict of arrays, e.g. read_phone_csv or read_gps_csv.
+        mmap_mode (str): If set (e.g. 'r'), cached arrays are memory-mapped instead of read into memory.
+
+    Returns:
+        dict: The arrays returned by reader.
+    """
+    if cache_folder is None:
+        return reader(csv_path)
+
+    stat = os.stat(csv_path)
+    cache_stem = os.path.join(cache_folder, os.path.splitext(os.path.basename(csv_path))[0])
+    if os.path.exists(cache_stem + '.json'):
+        with open(cache_stem + '.json') as f:
+            meta = json.load(f)
+        if meta['src_size'] == stat.st_size and meta['src_mtime_ns'] == stat.st_mtime_ns:
+            return {key: np.load(f'{cache_stem}.{key}.npy', mmap_mode=mmap_mode) for key in meta['keys']}
+
+    arrays = reader(csv_path)
+    if not os.path.exists(cache_folder):
+        os.makedirs(cache_folder)
+    for key, arr in arrays.items():
+        np.save(f'{cache_stem}.{key}.npy', arr)
+    # The stats are written last so an interrupted run never validates a partial cache entry
+    with open(cache_stem + '.json.tmp', 'w') as f:
+        json.dump({'src_size': stat.st_size, 'src_mtime_ns': stat.st_mtime_ns, 'keys': list(arrays)}, f)
+    os.replace(cache_stem + '.json.tmp', cache_stem + '.json')
+    return arrays
+
+
+# Source csv of every phone modality in the extracted folder
+PHONE_STREAM_FILES = {
+    'chestphone_acc': 'data_chest_phone_acc.csv',
+    'chestphone_gyro': 'data_chest_phone_gyro.csv',
+    'chestphone_mag': 'data_chest_phone_mag.csv',
+    'chestphone_light': 'data_chest_phone_light.csv',
+    'chestphone_gps': 'data_chest_phone_gps.csv',
+    'pupilphone_acc': 'data_pupil_phone_acc.csv',
+    'pupilphone_gyro': 'data_pupil_phone_gyro.csv',
+    'pupilphone_mag': 'data_pupil_phone_mag.csv',
+    'pupilphone_gps': 'data_pupil_phone_gps.csv',
+}
+
+
+def walk_input_files(load_folder, np_source='raw', videos=True):
+    """
+    Names of the files of an extracted walk folder that synchronize.py reads, e.g. for manifest.file_fingerprints.
+    Other files in the folder, such as the output of np_cleaning.py with np_source 'raw', are left out.
+
+    Parameters:
+        load_folder (str): The RW{subject}-Walk{walk}-extracted/ folder.
+        np_source (str): 'raw' or 'clean', see load_walk_streams.
+        videos (bool): Include the videos and their timestamps.
+
+    Returns:
+        list[str]: Names of the existing input files.
+    """
+    names = ['time_np.npy'] + (['data_np_clean.npy', 'data_np_artifact.npy'] if np_source == 'clean' else ['data_np.npy'])
+    # Xsens center of mass is read from the converted workbook sheet if present, as in load_walk_streams
+    stem = os.path.basename(sheet_stem(load_folder, XSENS_COM_SHEET))
+    if os.path.exists(load_folder + stem + '.json'):
+        names += ['time_xs.npy', stem + '.frame.npy', stem + '.data.npy']
+    else:
+        names += ['time_xs.npy', 'data_xs_Center-of-Mass.csv']
+    names += list(PHONE_STREAM_FILES.values())
+    if videos:
+        names += ['data_video_gopro.mp4', 'time_gopro.npy', 'data_video_pupil.mp4', 'time_pupil.npy']
+    return [name for name in names if os.path.isfile(load_folder + name)]
+
+
+def load_walk_streams(load_folder, cache_folder=None, mmap_mode=None, gps_bucket_width=1, skip_missing=False, metrics=None, np_source='raw'):
+    """
+    Load all sensor streams of one extracted walk folder with their NTP time.
+
+    Parameters:
+        load_folder (str): The RW{subject}-Walk{walk}-extracted/ folder.
+        cache_folder (str): Folder of the parsed csv cache, see load_cached. None disables the cache.
+        mmap_mode (str): If set (e.g. 'r'), data_np.npy and the cached streams are memory-mapped.
+        gps_bucket_width (float): GPS samples in the same bucket of this width (second) are averaged into one value.
+        skip_missing (bool): Leave out streams whose files are missing instead of raising FileNotFoundError.
+        metrics (instrumentation.StageMetrics): If given, loading and GPS merging are measured per modality.
+        np_source (str): 'raw' loads data_np.npy; 'clean' loads data_np_clean.npy of np_cleaning.clean_np and its
+            artifact mask as the 'np_artifact' stream.
+
+    Returns:
+        dict: {modality: (time in epoch nanoseconds, data)} for 'np', 'xs_CoM' and the phone modalities.
+    """
+    streams = {}
+    try:
+        ## load np data
+        with measure(metrics, 'load_stream', 'np'):
+            time_np = load_time_array(load_folder + 'time_np.npy')
+            if np_source == 'clean':
+                streams['np'] = (time_np, np.load(load_folder + 'data_np_clean.npy', mmap_mode=mmap_mode))
+                streams['np_artifact'] = (time_np, np.load(load_folder + 'data_np_artifact.npy', mmap_mode=mmap_mode))
+            else:
+                streams['np'] = (time_np, np.load(load_folder + 'data_np.npy', mmap_mode=mmap_mode))
+
+        # load xsense data: only center of mass currently, from the arrays converted from the workbook if present
+        with measure(metrics, 'load_stream', 'xs_CoM'):
+            xsense = load_xsens_sheet(load_folder, mmap_mode=mmap_mode)
+            if xsense is None:
+                xsense = load_cached(load_folder + 'data_xs_Center-of-Mass.csv', cache_folder, reader=read_xsens_csv, mmap_mode=mmap_mode)
+            data_xsense = xsense['data']
+            streams['xs_CoM'] = (load_time_array(load_folder + 'time_xs.npy'), data_xsense)
+    except FileNotFoundError as e:
+        if not skip_missing:
+            raise
+        print("Skip missing stream:", str(e))
+
+    ## load all of chestphone and pupilphone data
+    for modality, file_name in PHONE_STREAM_FILES.items():
+        reader = read_gps_csv if modality.endswith('gps') else read_phone_csv
+        try:
+            with measure(metrics, 'load_stream', modality):
+                stream = load_cached(load_folder + file_name, cache_folder, reader=reader, mmap_mode=mmap_mode)
+        except FileNotFoundError as e:
+            if not skip_missing:
+                raise
+            print("Skip missing stream:", str(e))
+            continue
+        streams[modality] = (stream['time'], stream['data'])
+
+    ## Merge gps data in the same time bucket (one second by default)
+    for modality in ['chestphone_gps', 'pupilphone_gps']:
+        if modality in streams:
+            with measure(metrics, 'resample_gps', modality):
+                streams[modality] = resample_gps(*streams[modality], bucket_width=gps_bucket_width)
+
+    for modality, (time_ns, data) in streams.items():
+        print(f"{modality}:", time_ns.shape, data.shape, format_time_ns(time_ns[[0, -1]]) if len(time_ns) else None)
+    return streams
+
+
+def load_walk_times(load_folder, cache_folder=None, gps_bucket_width=1):
+    """
+    Load only the NTP time of every sensor stream of one extracted walk folder. Cached phone streams are
+    memory-mapped so their data columns are never read. Missing streams are left out.
+
+    Parameters:
+        load_folder (str): The RW{subject}-Walk{walk}-extracted/ folder.
+        cache_folder (str): Folder of the parsed csv cache, see load_cached. None disables the cache.
+        gps_bucket_width (float): Width of the GPS buckets (second), see resample_gps.
+
+    Returns:
+        dict: {modality: time in epoch nanoseconds} for the modalities of load_walk_streams.
+    """
+    times = {}
+    for modality, file_name in [('np', 'time_np.npy'), ('xs_CoM', 'time_xs.npy')]:
+        if os.path.exists(load_folder + file_name):
+            times[modality] = load_time_array(load_folder + file_name)
+
+    for modality, file_name in PHONE_STREAM_FILES.items():
+        if not os.path.exists(load_folder + file_name):
+            continue
+        reader = read_gps_csv if modality.endswith('gps') else read_phone_csv
+        time_ns = load_cached(load_folder + file_name, cache_folder, reader=reader, mmap_mode='r')['time']
+        if modality.endswith('gps'):
+            # same bucket times as resample_gps, without averaging the samples
+            time_ns = gps_buckets(time_ns, gps_bucket_width)[0]
+        times[modality] = np.asarray(time_ns)
+    return times
@@ -0,0 +1,65 @@
+# Settings shared by synchronize.py and the tools that plan, index or decode its events without running it.
+# No imports beyond the standard library, so these tools stay free of moviepy and the pipeline setup.
+
+map_long_sample_freq = {
+    'chestphone_gps': 7,
+    'chestphone_light': 0.1,
+    'pupilphone_gps': 7
+} #unit: second
+
+# Events that are split out of each walk, all other labels are greped
+interested_labels = ["Doorway", "Talking", "Correct Turn", "Incorrect Turn", "Lost", "Stop", "Abnormal", "Pointing", "Outdoor", "Choice Point", "Stare", "New Context"]
+
+fps_for_frame = 60
+video_sync_modality_frame = 'GoProFrame'
+time_window = 2  # Unit: second
+gps_bucket_width = 1  # Unit: second. GPS samples in the same bucket are averaged into one value
+merge_successive_events = False  # merge successive rows of the same instant label (e.g. Doorway, Choice Point) into one event
+summary_folder = '../synchronized/'  # folder of the cross-walk reports
+
+
+def parse_index_set(values):
+    """
+    Expand command line subject or walk sets such as ["1-3", "5", "7,8"] into a sorted list of ints.
+    """
+    indices = set()
+    for value in values:
+        for part in value.split(','):
+            if not part:
+                continue
+            if '-' in part:
+                first, last = part.split('-')
+                indices.update(range(int(first), int(last) + 1))
+            else:
+                indices.add(int(part))
+    return sorted(indices)
+
+
+def expand_frame_window(start_frame, end_frame, time_window, fps, total_frames):
+    """
+    Expand [start_frame, end_frame) to time_window seconds with the event in the middle. Frames beyond the
+    video are clipped. Shared by both cutting modes so they produce the same boundaries.
+
+    Parameters:
+        start_frame (int): Starting frame index.
+        end_frame (int): Ending frame index.
+        time_window (int): Time window for downstream task input. If None, the frames are returned unchanged.
+        fps (int): Frame frequency of video clip (frame per second).
+        total_frames (int): Number of frames in the video.
+
+    Returns:
+        tuple[int, int]: Expanded starting and ending frame indices.
+    """
+    # Downstream task requires fixed length data for training, so here we directly extract the data with the required length.
+    # If the event (label) is longer than required length (i.e, time_window), do normal data extraction;
+    # else put the event in the middle, and expand the starting and ending frame to the required length
+    if time_window:
+        # print("original start_frame:", start_frame, "original end_frame:", end_frame)
+        frame_len = end_frame - start_frame
+        expand_frame = int(time_window*fps - frame_len)
+        if expand_frame > 0:
+            start_frame = max(0, start_frame - expand_frame // 2)
+            end_frame = min(total_frames, start_frame + frame_len + expand_frame)
+            # print("expanded start_frame:", start_frame, "expanded end_frame:", end_frame, "frame length: ", end_frame-start_frame)
+            # input("Press Enter to continue...")
+    return start_frame, end_frame
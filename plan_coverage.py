@@ -0,0 +1,204 @@
+import argparse
+import csv
+import os
+
+import numpy as np
+import pandas as pd
+
+from event_intervals import build_intervals, events_of
+from ntp_time import find_close_frames, matlab_datenum_to_datetime64, load_time_array
+from phone_streams import load_walk_times
+from pipeline_config import (gps_bucket_width, interested_labels, map_long_sample_freq, merge_successive_events, parse_index_set, summary_folder,
+                             time_window, video_sync_modality_frame)
+
+# Sample frequency passed to extract_modalities for every sensor modality. GPS is not expanded to the time window.
+MODALITY_FREQ = {
+    'np': 250, 'xs_CoM': 100,
+    'chestphone_acc': 100, 'chestphone_gyro': 50, 'chestphone_mag': 50, 'chestphone_light': 10, 'chestphone_gps': None,
+    'pupilphone_acc': 100, 'pupilphone_gyro': 50, 'pupilphone_mag': 50, 'pupilphone_gps': None,
+}
+
+# Columns of the coverage table, in the order of the processing records
+COVERAGE_COLUMNS = [('gopro', 'GoPro Video&Audio'), ('pupil', 'Pupil Video'), ('np', 'Neural Pace (NP)'), ('xs_CoM', 'Xsens'),
+                    ('chestphone_acc', 'chestphone acc'), ('chestphone_gyro', 'chestphone gyro'), ('chestphone_mag', 'chestphone mag'),
+                    ('chestphone_light', 'chestphone light'), ('chestphone_gps', 'chestphone gps'), ('pupilphone_acc', 'pupilphone acc'),
+                    ('pupilphone_gyro', 'pupilphone gyro'), ('pupilphone_mag', 'pupilphone mag'), ('pupilphone_gps', 'pupilphone gps')]
+
+
+def list_events(label, merge_successive=merge_successive_events):
+    """
+    Split a walk's label column into events with the rules of the synchronize.py main loop.
+
+    Parameters:
+        label (pd.Series): 'Event' column of the events csv.
+        merge_successive (bool): Merge successive rows of the same instant label, see event_intervals.build_intervals.
+
+    Returns:
+        tuple[list, dict]: [(start index, end index, label)] of the events, and {index: (label, grep reason)}.
+    """
+    intervals = build_intervals(pd.DataFrame({'Event': label}), interested_labels, merge_successive=merge_successive)
+    events = [(int(i['index']), int(i['end_index']), str(i['label'])) for i in events_of(intervals)]
+    greped_index = {int(i['index']): (str(i['label']), str(i['reason'])) for i in intervals if i['reason']}
+    return events, greped_index
+
+
+def plan_bounds(start_frame, end_frame, num_samples, time_window, modality_freq):
+    """
+    Vectorized version of the window expansion in extract_modalities.
+
+    Parameters:
+        start_frame (NDArray): First frame of every event.
+        end_frame (NDArray): End frame of every event.
+        num_samples (int): Length of the stream.
+        time_window (float): Time window (second). None keeps the frames unchanged.
+        modality_freq (float): Sample frequency of the stream.
+
+    Returns:
+        tuple[NDArray, NDArray]: Expanded start and end frames.
+    """
+    start_frame = np.asarray(start_frame, dtype=np.int64).copy()
+    end_frame = np.asarray(end_frame, dtype=np.int64).copy()
+    if time_window:
+        frame_len = end_frame - start_frame
+        expand_frame = np.trunc(time_window * modality_freq - frame_len).astype(np.int64)
+        expand = expand_frame > 0
+        start_frame[expand] = np.maximum(0, start_frame[expand] - expand_frame[expand] // 2)
+        end_frame[expand] = np.minimum(num_samples, start_frame[expand] + frame_len[expand] + expand_frame[expand])
+    return start_frame, end_frame
+
+
+def plan_walk(subject, walk, time_window=time_window, video_sync_modality_frame=video_sync_modality_frame,
+              gps_bucket_width=gps_bucket_width, use_cache=True, merge_successive=merge_successive_events):
+    """
+    Compute the boundaries of every event of one walk in every modality from the timestamps and labels only.
+    No sensor data or video is read. Only the phone csv cache is filled if it is missing or stale.
+
+    Parameters:
+        subject (int): Subject number.
+        walk (int): Walk number.
+        time_window (float): Time window for downstream task input (second).
+        video_sync_modality_frame (str): Column of the events csv used to cut both videos.
+        gps_bucket_width (float): Width of the GPS buckets (second).
+        use_cache (bool): Read phone timestamps from RW{subject}-Walk{walk}-cache/ when up to date.
+        merge_successive (bool): Merge successive rows of the same instant label, as synchronize_walk does.
+
+    Returns:
+        tuple[pd.DataFrame, dict]: One row per event with 'Index', 'Label', 'Duration', 'Extract' (gopro and np are
+            valid, so synchronize.py would save the event) and '{modality} Start' / '{modality} End' (-1 if missing),
+            and {index: (label, grep reason)} of the labels that are not events.
+    """
+    load_syncronized_folder = f'../RW{subject}/RW{subject}-Walk{walk}-extracted/'
+    cache_folder = f'../RW{subject}/RW{subject}-Walk{walk}-cache/' if use_cache else None
+
+    df = pd.read_csv(f'../label_RWNApp_Output_Jan2024/evnts_RWNApp_RW{subject}_Walk{walk}.csv')
+    time_label_ns = matlab_datenum_to_datetime64(df['NTP']/60/60/24).astype(np.int64)
+    events, greped_index = list_events(df['Event'], merge_successive=merge_successive)
+    start_index = np.array([e[0] for e in events], dtype=np.int64)
+    end_index = np.array([e[1] for e in events], dtype=np.int64)
+
+    plan = pd.DataFrame({'Index': start_index, 'Label': [e[2] for e in events],
+                         'Duration': pd.to_timedelta(time_label_ns[end_index] - time_label_ns[start_index])})
+    bounds = {}
+
+    ## both videos are cut with the frames of video_sync_modality_frame
+    video_frame = df[video_sync_modality_frame].to_numpy(dtype=np.int64)
+    for modality in ['gopro', 'pupil']:
+        start_frame, end_frame = video_frame[start_index], video_frame[end_index]
+        present = np.zeros(len(events), dtype=bool)
+        if os.path.exists(load_syncronized_folder + f'data_video_{modality}.mp4') and os.path.exists(load_syncronized_folder + f'time_{modality}.npy'):
+            num_frames = len(load_time_array(load_syncronized_folder + f'time_{modality}.npy'))
+            present = (end_frame > start_frame) & (end_frame < num_frames)
+        bounds[modality] = (start_frame, end_frame, present)
+
+    ## np is indexed with NPSample, all other streams with the first sample after the label time
+    times = load_walk_times(load_syncronized_folder, cache_folder, gps_bucket_width=gps_bucket_width)
+    for modality, modality_freq in MODALITY_FREQ.items():
+        if modality not in times:
+            bounds[modality] = (np.full(len(events), -1), np.full(len(events), -1), np.zeros(len(events), dtype=bool))
+            continue
+        time_ns = times[modality]
+        label_frames = df['NPSample'].to_numpy(dtype=np.int64) if modality == 'np' else find_close_frames(time_label_ns, time_ns)
+        window = None if modality_freq is None else time_window
+        start_frame, end_frame = plan_bounds(label_frames[start_index], label_frames[end_index], len(time_ns), window, modality_freq)
+        present = end_frame > start_frame
+        if modality == 'np':
+            # synchronize.py greps events whose NPSample rows are empty or reversed before expanding the window
+            present &= label_frames[end_index] > label_frames[start_index]
+        if modality in map_long_sample_freq:
+            # an event between two sparse samples keeps the next sample if it is close enough to the label
+            close = np.abs(time_ns[np.minimum(start_frame, len(time_ns) - 1)] - time_label_ns[start_index]) / 1e9 <= map_long_sample_freq[modality]
+            end_frame = np.where(present | ~close, end_frame, end_frame + 1)
+            present = present | close
+        bounds[modality] = (start_frame, end_frame, present)
+
+    plan['Extract'] = bounds['gopro'][2] & bounds['np'][2]
+    for modality, (start_frame, end_frame, present) in bounds.items():
+        plan[f'{modality} Start'] = np.where(present, start_frame, -1)
+        plan[f'{modality} End'] = np.where(present, end_frame, -1)
+    return plan, greped_index
+
+
+def coverage_row(plan):
+    """Number of events with data of every modality of the coverage table."""
+    return [len(plan)] + [int((plan[f'{modality} Start'] >= 0).sum()) for modality, _ in COVERAGE_COLUMNS]
+
+
+def write_coverage(plans, save_folder):
+    """
+    Write the event plans of all walks and the coverage matrix.
+
+    Parameters:
+        plans (dict): {(subject, walk): plan DataFrame from plan_walk}.
+        save_folder (str): Folder of plan_events.csv, plan_coverage.csv and plan_coverage.md.
+    """
+    if not os.path.exists(save_folder):
+        os.makedirs(save_folder)
+
+    file_events = os.path.join(save_folder, "plan_events.csv")
+    pd.concat([plan.assign(Subject=subject, Walk=walk) for (subject, walk), plan in sorted(plans.items())]
+              ).to_csv(file_events, index=False)
+    print(f"Planned events have been saved to {file_events}")
+
+    header = ['Subject', 'Walk', 'Events'] + [name for _, name in COVERAGE_COLUMNS]
+    rows = [[subject, walk] + coverage_row(plan) for (subject, walk), plan in sorted(plans.items())]
+
+    file_coverage = os.path.join(save_folder, "plan_coverage.csv")
+    with open(file_coverage, mode='w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+    # same layout as the tables of the processing records
+    file_md = os.path.join(save_folder, "plan_coverage.md")
+    with open(file_md, mode='w') as f:
+        f.write('| ' + ' | '.join(['RW'] + header[1:]) + ' |\n')
+        f.write('| ' + ' | '.join(['-----'] * (len(header) - 1)) + ' |\n')
+        for row in rows:
+            f.write('| ' + ' | '.join([f'RW{row[0]} Walk{row[1]}'] + [str(v) for v in row[2:]]) + ' |\n')
+    with open(file_md) as f:
+        print(f.read())
+    print(f"Coverage of all walks has been saved to {file_coverage} and {file_md}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Plan the events of many walks from timestamps and labels only and report modality coverage.")
+    parser.add_argument("--subjects", nargs='+', required=True, help="Subjects to plan, e.g. 1 2 or 1-3.")
+    parser.add_argument("--walks", nargs='+', required=True, help="Walks to plan for every subject, e.g. 1-7 or 1,3,4.")
+    parser.add_argument("--time-window", type=float, default=time_window, help="Time window for downstream task input (second).")
+    parser.add_argument("--video-sync-modality-frame", choices=['GoProFrame', 'PupilFrame'], default=video_sync_modality_frame, help="Column used to cut both videos.")
+    parser.add_argument("--gps-bucket-width", type=float, default=gps_bucket_width, help="Width of the GPS buckets (second).")
+    parser.add_argument("--merge-successive", action="store_true", help="Merge successive rows of the same instant label, as in synchronize.py.")
+    parser.add_argument("--no-cache", action="store_true", help="Parse the phone csv files instead of using the cache.")
+    parser.add_argument("--summary-folder", default=summary_folder, help="Folder of the plan and coverage reports.")
+    args = parser.parse_args()
+
+    plans = {}
+    for subject in parse_index_set(args.subjects):
+        for walk in parse_index_set(args.walks):
+            try:
+                plans[(subject, walk)], _ = plan_walk(subject, walk, time_window=args.time_window, video_sync_modality_frame=args.video_sync_modality_frame,
+                                                      gps_bucket_width=args.gps_bucket_width, use_cache=not args.no_cache,
+                                                      merge_successive=args.merge_successive or merge_successive_events)
+            except FileNotFoundError as e:
+                print(f"Skip sub: {subject}, walk: {walk}:", str(e))
+    write_coverage(plans, args.summary_folder)
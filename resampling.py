@@ -0,0 +1,147 @@
+import numpy as np
+from numpy.typing import NDArray
+
+from windowing import window_starts
+
+# Streams of slow or irregular samples that are held at the nearest sample instead of interpolated, and the
+# largest distance from a grid time to that sample (second): one missed fix of the 1 Hz GPS buckets, a few light readings
+hold_max_gap = {
+    'chestphone_gps': 2.0,
+    'chestphone_light': 1.0,
+    'pupilphone_gps': 2.0
+}
+HOLD_MODALITIES = list(hold_max_gap)
+# Grid points further than this from the bracketing samples of an interpolated stream are invalid (second)
+interp_max_gap = 0.5
+
+
+def uniform_grid(start_ns, end_ns, rate):
+    """Uniform sample times in [start_ns, end_ns) at rate Hz, in epoch nanoseconds."""
+    num = int(round((end_ns - start_ns) * rate / 1e9))
+    return int(start_ns) + np.round(np.arange(num) * (1e9 / rate)).astype(np.int64)
+
+
+def resample_stream(time_ns, data, grid_ns, method='linear', max_gap=interp_max_gap):
+    """
+    Map an irregularly sampled stream onto grid times, vectorized over samples and channels.
+
+    Parameters:
+        time_ns (NDArray): Sorted sample times in epoch nanoseconds.
+        data (NDArray): Samples, (samples,) or (samples, channels).
+        grid_ns (NDArray): Sorted grid times in epoch nanoseconds.
+        method (str): 'linear' interpolates between the samples around every grid time. 'nearest' holds the
+            value of the nearest sample, for GPS and light.
+        max_gap (float): 'linear': largest distance between the two samples around a grid time (second).
+            'nearest': largest distance between a grid time and its sample (second).
+
+    Returns:
+        tuple[NDArray, NDArray]: float32 values (grid, channels) and the bool validity of every grid time. Invalid
+            grid times (outside the stream or in a gap) are 0.
+    """
+    data = np.asarray(data).reshape(len(time_ns), -1)
+    values = np.zeros((len(grid_ns), data.shape[1]), dtype=np.float32)
+    if len(time_ns) == 0:
+        return values, np.zeros(len(grid_ns), dtype=bool)
+
+    # Only the samples around the grid are read, so memory-mapped streams stay on disk
+    first, last = np.searchsorted(time_ns, [grid_ns[0], grid_ns[-1]], side='right') if len(grid_ns) else (0, 0)
+    first, last = max(0, first - 1), min(len(time_ns), last + 1)
+    time_ns, data = time_ns[first:last], np.asarray(data[first:last], dtype=np.float64)
+    max_gap_ns = int(max_gap * 1e9)
+
+    # time_ns[left] <= grid time < time_ns[right]; of duplicate sample times the last one is used, as np.interp does
+    after = np.searchsorted(time_ns, grid_ns, side='right')
+    left, right = np.clip(after - 1, 0, len(time_ns) - 1), np.clip(after, 0, len(time_ns) - 1)
+    if method == 'nearest':
+        use_left = np.abs(grid_ns - time_ns[left]) <= np.abs(time_ns[right] - grid_ns)
+        nearest = np.where(use_left, left, right)
+        valid = np.abs(time_ns[nearest] - grid_ns) <= max_gap_ns
+        values[valid] = data[nearest[valid]]
+    elif method == 'linear':
+        span = (time_ns[right] - time_ns[left]).astype(np.float64)
+        exact = (after > 0) & (time_ns[left] == grid_ns)
+        inside = (after > 0) & (after < len(time_ns)) & (span <= max_gap_ns)
+        valid = exact | inside
+        weight = np.divide(grid_ns - time_ns[left], span, out=np.zeros(len(grid_ns)), where=span > 0)[:, None]
+        values[valid] = (data[left] * (1 - weight) + data[right] * weight)[valid]
+    else:
+        raise ValueError(f"Unknown method: {method}")
+    return values, valid
+
+
+def channel_layout(streams, modalities=None):
+    """{modality: (first column, end column)} of every modality in the resampled tensor, in the order of modalities."""
+    layout = {}
+    column = 0
+    for modality in modalities or list(streams):
+        time_ns, data = streams[modality]
+        num_channels = int(np.prod(data.shape[1:])) if np.ndim(data) > 1 else 1
+        layout[modality] = (column, column + num_channels)
+        column += num_channels
+    return layout
+
+
+def resample_window(streams, start_ns, end_ns, rate, modalities=None, max_gap=None):
+    """
+    Resample all modalities of [start_ns, end_ns) onto one uniform grid.
+
+    Parameters:
+        streams (dict): {modality: (time in epoch nanoseconds, data)}, e.g. from phone_streams.load_walk_streams.
+        start_ns (int): Start of the window in epoch nanoseconds.
+        end_ns (int): End of the window in epoch nanoseconds.
+        rate (float): Grid rate (Hz), shared by all modalities.
+        modalities (list[str]): Modalities and order of the tensor columns. Default: all streams.
+        max_gap (dict): {modality: max_gap of resample_stream (second)}. Interpolated streams default to
+            interp_max_gap, held streams to hold_max_gap.
+
+    Returns:
+        dict: 'grid' (grid times), 'data' (float32 tensor (grid, channels) of all modalities side by side, see
+            channel_layout), 'valid' (bool (grid, modalities)) and 'modalities'.
+    """
+    modalities = modalities or list(streams)
+    max_gap = max_gap or {}
+    grid_ns = uniform_grid(start_ns, end_ns, rate)
+    layout = channel_layout(streams, modalities)
+    data = np.zeros((len(grid_ns), max([end for _, end in layout.values()], default=0)), dtype=np.float32)
+    valid = np.zeros((len(grid_ns), len(modalities)), dtype=bool)
+    for m, modality in enumerate(modalities):
+        time_ns, stream = streams[modality]
+        if modality in HOLD_MODALITIES:
+            values, valid[:, m] = resample_stream(time_ns, stream, grid_ns, 'nearest', max_gap.get(modality, hold_max_gap[modality]))
+        else:
+            values, valid[:, m] = resample_stream(time_ns, stream, grid_ns, 'linear', max_gap.get(modality, interp_max_gap))
+        first, end = layout[modality]
+        data[:, first:end] = values
+    return {'grid': grid_ns, 'data': data, 'valid': valid, 'modalities': modalities}
+
+
+def iter_resampled_event_windows(streams, events, window, rate, stride=None, anchor='center', modalities=None, max_gap=None):
+    """
+    Like windowing.iter_event_windows, but every window is one dense tensor on a uniform grid of
+    round(window * rate) samples, so windows of all events and walks can be stacked into batches.
+
+    Parameters:
+        streams (dict): {modality: (time in epoch nanoseconds, data)}.
+        events (iterable): (index, label, start in epoch nanoseconds, end in epoch nanoseconds) per event.
+        window (float): Window length T (second).
+        rate (float): Grid rate (Hz).
+        stride (float): Step between windows of one long event (second). Default is window, i.e. no overlap.
+        anchor (str): 'center' or 'start', see windowing.window_starts.
+        modalities (list[str]): Modalities and order of the tensor columns. Default: all streams.
+        max_gap (dict): See resample_window.
+
+    Yields:
+        dict: 'index', 'label', 'window', 'start', 'end' and the 'grid', 'data' and 'valid' of resample_window.
+    """
+    window_ns = int(round(window * 1e9))
+    stride_ns = int(round((stride or window) * 1e9))
+    for index, label, event_start, event_end in events:
+        for num, window_start in enumerate(window_starts(int(event_start), int(event_end), window_ns, stride_ns, anchor)):
+            resampled = resample_window(streams, int(window_start), int(window_start) + window_ns, rate, modalities, max_gap)
+            yield {'index': index, 'label': label, 'window': num, 'start': int(window_start), 'end': int(window_start) + window_ns, **resampled}
+
+
+def stack_windows(windows) -> tuple[NDArray, NDArray]:
+    """Stack resampled windows of the same length into a (batch, grid, channels) tensor and a (batch, grid, modalities) mask."""
+    windows = list(windows)
+    return np.stack([w['data'] for w in windows]), np.stack([w['valid'] for w in windows])
@@ -0,0 +1,124 @@
+import argparse
+import csv
+import datetime
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import extract_mat_data
+import synchronize
+from np_cleaning import clean_walk_np
+from instrumentation import StageMetrics, measure
+from pipeline_config import parse_index_set, summary_folder
+
+
+def run_walk(subject, walk, stages, metrics=False, **sync_kwargs):
+    """
+    Run the selected stages for one (subject, walk) pair.
+
+    Parameters:
+        subject (int): Subject number.
+        walk (int): Walk number.
+        stages (list[str]): Stages to run, in order: 'extract' (Step 1), 'clean' (neural pace spike removal, see
+            np_cleaning.py) and/or 'sync' (Step 2 and 3).
+        metrics (bool): Record time, I/O and peak memory of all stages. They are saved with the 'sync' stage as
+            metrics.csv/.json next to index_stats.csv, otherwise as metrics_{stages}.csv/.json in the extracted folder.
+        sync_kwargs: Keyword arguments of synchronize.synchronize_walk, e.g. workers or output_format.
+
+    Returns:
+        tuple[dict, dict]: {modality: missing count} and {label: total time} of the walk. Empty if 'sync' is not run.
+    """
+    label_missing_cnt, label_total_time = {}, {}
+    walk_metrics = StageMetrics(enabled=metrics)
+    if 'extract' in stages:
+        with measure(walk_metrics, 'move_files'):
+            extract_mat_data.move_files(subject, walk)
+        extract_mat_data.extract_mat(subject, walk, metrics=walk_metrics)
+    if 'clean' in stages:
+        with measure(walk_metrics, 'clean_np', 'np'):
+            clean_walk_np(subject, walk)
+    if 'sync' in stages:
+        label_missing_cnt, label_total_time = synchronize.synchronize_walk(subject, walk, metrics=walk_metrics, **sync_kwargs)
+    else:
+        # without the sync stage the metrics are saved next to the extracted data, as extract_mat_data.py does
+        save_folder = f"{extract_mat_data.data_root}/RW{subject}/RW{subject}-Walk{walk}-extracted/" if 'extract' in stages else f'../RW{subject}/RW{subject}-Walk{walk}-extracted/'
+        walk_metrics.save(save_folder, name='metrics_' + '_'.join(stages), subject=subject, walk=walk)
+    return label_missing_cnt, label_total_time
+
+
+def write_summaries(results, save_folder):
+    """
+    Merge per-walk results into cross-walk summary reports.
+
+    Parameters:
+        results (dict): {(subject, walk): (label_missing_cnt, label_total_time, error)}.
+        save_folder (str): Folder of the summary csv files.
+    """
+    if not os.path.exists(save_folder):
+        os.makedirs(save_folder)
+
+    keys = sorted(results)
+    modalities = sorted({m for k in keys for m in results[k][0]})
+    labels = sorted({l for k in keys for l in results[k][1]})
+
+    file_miss = os.path.join(save_folder, "summary_missing_label_cnt.csv")
+    with open(file_miss, mode='w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Subject', 'Walk'] + modalities + ['Error'])
+        for subject, walk in keys:
+            missing_cnt, _, error = results[(subject, walk)]
+            writer.writerow([subject, walk] + [missing_cnt.get(m, 0) for m in modalities] + [error])
+        writer.writerow(['All', 'All'] + [sum(results[k][0].get(m, 0) for k in keys) for m in modalities] + [''])
+    print(f"Missing counts of all walks have been saved to {file_miss}")
+
+    file_label_time = os.path.join(save_folder, "summary_label_total_time.csv")
+    with open(file_label_time, mode='w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Subject', 'Walk'] + labels)
+        for subject, walk in keys:
+            total_time = results[(subject, walk)][1]
+            writer.writerow([subject, walk] + [str(total_time.get(l, datetime.timedelta())) for l in labels])
+        writer.writerow(['All', 'All'] + [str(sum((results[k][1].get(l, datetime.timedelta()) for k in keys), datetime.timedelta())) for l in labels])
+    print(f"Total time of each label in all walks has been saved to {file_label_time}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run extraction and synchronization over many subjects and walks in parallel.")
+    parser.add_argument("--subjects", nargs='+', required=True, help="Subjects to process, e.g. 1 2 or 1-3.")
+    parser.add_argument("--walks", nargs='+', required=True, help="Walks to process for every subject, e.g. 1-7 or 1,3,4.")
+    parser.add_argument("--stages", nargs='+', choices=['extract', 'clean', 'sync'], default=['extract', 'sync'], help="Stages to run (default: extract sync).")
+    parser.add_argument("--jobs", type=int, default=1, help="Number of walks processed in parallel (default: 1).")
+    parser.add_argument("--workers", type=int, default=1, help="Number of processes encoding video and audio clips per walk (default: 1).")
+    parser.add_argument("--video-cut-mode", choices=["reencode", "stream_copy"], default=synchronize.video_cut_mode, help="How event video clips are cut.")
+    parser.add_argument("--output-format", choices=["npy", "hdf5"], default=synchronize.output_format, help="Layout of the sensor windows.")
+    parser.add_argument("--mmap", action="store_true", help="Memory-map the neural pace, Xsens and cached phone streams.")
+    parser.add_argument("--summary-folder", default=summary_folder, help="Folder of the cross-walk summary reports.")
+    parser.add_argument("--metrics", action="store_true", help="Record time, I/O and peak memory per stage, modality and event of every walk.")
+    parser.add_argument("--calibrate-videos", action="store_true", help="Pick the video fps and sync column of every walk from its timestamps, or skip its videos.")
+    parser.add_argument("--np-source", choices=["raw", "clean"], default=synchronize.np_source, help="Slice the raw neural pace signal or the output of the 'clean' stage.")
+    parser.add_argument("--audio-source", choices=["video", "buffer"], default=synchronize.audio_source, help="Decode event audio from the video, or slice a per-walk PCM buffer.")
+    parser.add_argument("--audio-sample-rate", type=int, default=synchronize.audio_sample_rate, help="Sample rate of the event wav files with --audio-source buffer (default: %(default)s).")
+    parser.add_argument("--gps-bucket-width", type=float, default=synchronize.gps_bucket_width, help="GPS samples in the same bucket of this width (second) are averaged (default: %(default)s).")
+    parser.add_argument("--no-cache", action="store_true", help="Re-parse the phone and Xsens csv files instead of using the stream cache.")
+    parser.add_argument("--merge-successive", action="store_true", help="Merge successive rows of the same instant label (e.g. Doorway) into one event.")
+    args = parser.parse_args()
+
+    walk_keys = [(s, w) for s in parse_index_set(args.subjects) for w in parse_index_set(args.walks)]
+    results = {}
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = {key: pool.submit(run_walk, *key, args.stages, metrics=args.metrics, workers=args.workers, video_cut_mode=args.video_cut_mode,
+                                    output_format=args.output_format, use_mmap=args.mmap, calibrate=args.calibrate_videos or synchronize.calibrate_videos,
+                                    audio_source=args.audio_source, audio_sample_rate=args.audio_sample_rate, np_source=args.np_source,
+                                    gps_bucket_width=args.gps_bucket_width, use_cache=not args.no_cache,
+                                    merge_successive=args.merge_successive or synchronize.merge_successive_events)
+                   for key in walk_keys}
+        for (subject, walk), future in futures.items():
+            try:
+                label_missing_cnt, label_total_time = future.result()
+                results[(subject, walk)] = (label_missing_cnt, label_total_time, '')
+                print(f"Done sub: {subject}, walk: {walk}")
+            except Exception as e:
+                results[(subject, walk)] = ({}, {}, str(e))
+                print(f"Failed sub: {subject}, walk: {walk}:", str(e))
+
+    if 'sync' in args.stages:
+        write_summaries(results, args.summary_folder)
@@ -0,0 +1,114 @@
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+# ioctl request of Linux to share the extents of one file with another (copy-on-write clone, btrfs/XFS)
+FICLONE = 0x40049409
+
+# Staging modes tried in order by 'auto'. Symlinks are only made on request, since they tie the extracted
+# folder to the raw data drive.
+AUTO_MODES = ['reflink', 'hardlink', 'copy']
+
+
+def is_staged(src, dst):
+    """Whether dst already holds src: same size and the same modification time (to the second)."""
+    if not os.path.exists(dst):
+        return False
+    src_stat, dst_stat = os.stat(src), os.stat(dst)
+    return src_stat.st_size == dst_stat.st_size and int(src_stat.st_mtime) == int(dst_stat.st_mtime)
+
+
+def reflink(src, dst):
+    import fcntl  # not available on Windows, where this raises ImportError and the next mode is used
+    with open(src, 'rb') as f_src, open(dst, 'wb') as f_dst:
+        try:
+            fcntl.ioctl(f_dst.fileno(), FICLONE, f_src.fileno())
+        except OSError:
+            f_dst.close()
+            os.remove(dst)
+            raise
+    shutil.copystat(src, dst)
+
+
+def copy_chunked(src, dst, chunk_bytes=64 << 20, workers=4):
+    """
+    Copy a file with several threads, each copying a range of chunks through its own file handles.
+    The copy is written to {dst}.part and renamed when complete; the modification time of src is kept.
+    """
+    size = os.path.getsize(src)
+    part = dst + '.part'
+    with open(part, 'wb') as f:
+        f.truncate(size)
+
+    def copy_range(start):
+        with open(src, 'rb') as f_src, open(part, 'r+b') as f_dst:
+            f_src.seek(start)
+            f_dst.seek(start)
+            f_dst.write(f_src.read(min(chunk_bytes, size - start)))
+
+    if size <= chunk_bytes or workers <= 1:
+        shutil.copyfile(src, part)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(copy_range, range(0, size, chunk_bytes)))
+    shutil.copystat(src, part)
+    os.replace(part, dst)
+
+
+def stage_file(src, dst, mode='auto', chunk_workers=4):
+    """
+    Make src available as dst without copying its bytes where the filesystem allows it.
+
+    Parameters:
+        src (str): Source file.
+        dst (str): Destination path. Replaced if it exists but does not match src.
+        mode (str): 'reflink', 'hardlink', 'symlink', 'copy', or 'auto' (reflink, then hardlink, then copy).
+        chunk_workers (int): Threads of a chunked copy.
+
+    Returns:
+        str: How the file was staged: 'skipped' (already up to date) or the mode used.
+    """
+    if is_staged(src, dst):
+        return 'skipped'
+    if os.path.lexists(dst):
+        os.remove(dst)
+
+    for attempt in (AUTO_MODES if mode == 'auto' else [mode]):
+        try:
+            if attempt == 'reflink':
+                reflink(src, dst)
+            elif attempt == 'hardlink':
+                os.link(src, dst)
+            elif attempt == 'symlink':
+                os.symlink(os.path.abspath(src), dst)
+            elif attempt == 'copy':
+                copy_chunked(src, dst, workers=chunk_workers)
+            else:
+                raise ValueError(f"Unknown staging mode: {mode}")
+            return attempt
+        except (OSError, ImportError):
+            # e.g. links across drives or a filesystem without reflinks
+            if mode != 'auto' or attempt == AUTO_MODES[-1]:
+                raise
+    raise AssertionError("unreachable")
+
+
+def stage_files(pairs, mode='auto', workers=4):
+    """
+    Stage many files in parallel.
+
+    Parameters:
+        pairs (dict): {destination: source}.
+        mode (str): See stage_file.
+        workers (int): Number of files staged at once (and threads of every chunked copy).
+
+    Returns:
+        dict: {destination: how it was staged}.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {dst: pool.submit(stage_file, src, dst, mode, workers) for dst, src in pairs.items()}
+        results = {}
+        for dst, future in futures.items():
+            results[dst] = future.result()
+            print(f"{results[dst].capitalize()}: {pairs[dst]} -> {dst}")
+    return results
@@ -6,20 +6,36 @@ import os
 import pandas as pd
 from moviepy.editor import VideoFileClip
 import csv
-
-map_long_sample_freq = {
-    'chestphone_gps': 7,
-    'chestphone_light': 0.1,
-    'pupilphone_gps': 7
-} #unit: second
+import argparse
+from concurrent.futures import ProcessPoolExecutor, Future
+from contextlib import ExitStack
+from ntp_time import find_close_frames, matlab_datenum_to_datetime64, format_time_ns, load_time_array
+from phone_streams import load_walk_streams, walk_input_files
+from walk_container import WalkContainerWriter, CONTAINER_NAME
+from event_reader import SENSOR_MODALITIES
+from instrumentation import StageMetrics, measure
+from manifest import load_manifest, save_manifest, file_fingerprints, event_input_hash, is_event_current
+from video_cut import build_keyframe_index, stream_copy_cut, cut_audio, probe_video, video_stream_params
+from audio_buffer import AUDIO_SAMPLE_RATE, audio_stem, decode_audio, load_audio, write_event_audio
+from video_calibration import calibrate_walk, save_calibration
+from event_intervals import build_intervals, REASON_BEFORE_WALK, REASON_AFTER_WALK
+# settings shared with the planning and indexing tools, see pipeline_config.py
+from pipeline_config import (map_long_sample_freq, interested_labels, fps_for_frame, video_sync_modality_frame, time_window,
+                             gps_bucket_width, merge_successive_events, expand_frame_window)
 
 subject = 1
 walks = [1]
-fps_for_frame = 60
-video_sync_modality_frame = 'GoProFrame'
-time_window = 2  # Unit: second
-
-def extract_video_noaudio_subset(video_path, start_frame, end_frame, output_path, time_window = None, fps=None):
+calibrate_videos = False  # pick fps_for_frame and video_sync_modality_frame per walk with video_calibration.calibrate_walk
+skip_videos = False  # do not cut the videos, e.g. when no frame column matches the labels
+output_format = 'npy'  # 'npy': one {index}_{modality}.npy per event and modality; 'hdf5': all sensor windows of a walk in one sensor_windows.h5
+output_container = None  # WalkContainerWriter of the walk being synchronized with output_format 'hdf5'
+stage_metrics = None  # instrumentation.StageMetrics of the walk being synchronized, None if not measured
+video_cut_mode = 'reencode'  # 'reencode': decode and re-encode every clip with moviepy; 'stream_copy': copy complete GOPs, re-encode only the edges
+audio_source = 'video'  # 'video': decode the audio of every event from the GoPro video; 'buffer': decode the walk once into a PCM buffer and slice it
+audio_sample_rate = AUDIO_SAMPLE_RATE  # sample rate of the event wav files with audio_source 'buffer'
+np_source = 'raw'  # 'raw': slice data_np.npy; 'clean': slice data_np_clean.npy of np_cleaning.py and save its artifact mask as {index}_np_artifact.npy
+
+def extract_video_noaudio_subset(video_path, start_frame, end_frame, output_path, time_window = None, fps=None, keyframes=None, stream_params=None):
     """
     Extract a subset of frames from a video file without including audio.
 
@@ -32,26 +48,23 @@ def extract_video_noaudio_subset(video_path, start_frame, end_frame, output_path
             end_frame is longer than time window, do nothing; if shorter, expand it to time window.
             Default is None, and the code won't do anything special.
         fps (int): Frame frequency of video clip (frame per second). Use video_clip.fps if not set.
+        keyframes (tuple): (keyframe times, frame times, duration) of the video from video_cut.build_keyframe_index.
+            If set, copy the complete GOPs of the clip instead of re-encoding it. fps must be set as well.
+        stream_params (dict): video_cut.video_stream_params of the video, probed once per walk with the keyframes.
     """
+    if keyframes is not None:
+        keyframe_times, frame_times, duration = keyframes
+        start_frame, end_frame = expand_frame_window(start_frame, end_frame, time_window, fps, int(duration * fps))
+        stream_copy_cut(video_path, start_frame / fps, end_frame / fps, output_path, keyframe_times, frame_times, audio=False, params=stream_params)
+        return
+
     # Load video clip
     video_clip = VideoFileClip(video_path)
     if fps is None:
         fps = video_clip.fps
 
     # print("Extracting video...")
-    # Downstream task requires fixed length data for training, so here we directly extract the data with the required length.
-    # If the event (label) is longer than required length (i.e, time_window), do normal data extraction;
-    # else put the event in the middle, and expand the starting and ending frame to the required length
-    if time_window:
-        # print("original start_frame:", start_frame, "original end_frame:", end_frame)
-        frame_len = end_frame - start_frame
-        expand_frame = int(time_window*fps - frame_len)
-        if expand_frame > 0:
-            total_frames = int(video_clip.duration * fps)
-            start_frame = max(0, start_frame - expand_frame // 2)
-            end_frame = min(total_frames, start_frame + frame_len + expand_frame)
-            # print("expanded start_frame:", start_frame, "expanded end_frame:", end_frame, "frame length: ", end_frame-start_frame)
-            # input("Press Enter to continue...")
+    start_frame, end_frame = expand_frame_window(start_frame, end_frame, time_window, fps, int(video_clip.duration * fps))
 
     # Extract subset of frames
     subset_clip = video_clip.subclip(start_frame / fps, end_frame / fps)
@@ -63,7 +76,7 @@ def extract_video_noaudio_subset(video_path, start_frame, end_frame, output_path
     video_clip.close()
 
 def extract_video_audio_subset(video_path, start_frame, end_frame, output_video_path, 
-                               output_audio_path, time_window = None, fps=None):
+                               output_audio_path, time_window = None, fps=None, keyframes=None, stream_params=None):
     """
     Extract a subset of frames from a video file and save the video and audio separately.
 
@@ -72,11 +85,15 @@ def extract_video_audio_subset(video_path, start_frame, end_frame, output_video_
         start_frame (int): Starting frame index.
         end_frame (int): Ending frame index.
         output_video_path (str): Path to save the output video file.
-        output_audio_path (str): Path to save the output audio file.
+        output_audio_path (str): Path to save the output audio file. None only writes the video, e.g. when the
+            audio is sliced from audio_buffer instead.
         time_window (int): Time window for downstream task input. If the piece from start_frame to 
             end_frame is longer than time window, do nothing; if shorter, expand it to time window.
             Default is None, and the code won't do anything special.
         fps (int): Frame frequency of video clip (frame per second). Use video_clip.fps if not set.
+        keyframes (tuple): (keyframe times, frame times, duration) of the video from video_cut.build_keyframe_index.
+            If set, copy the complete GOPs of the clip instead of re-encoding it. fps must be set as well.
+        stream_params (dict): video_cut.video_stream_params of the video, probed once per walk with the keyframes.
     """
     # Validate input parameters
     if not os.path.isfile(video_path):
@@ -88,25 +105,21 @@ def extract_video_audio_subset(video_path, start_frame, end_frame, output_video_
         raise ValueError("End frame must be greater than start frame")
         # return "End frame must be greater than start frame"
 
+    if keyframes is not None:
+        keyframe_times, frame_times, duration = keyframes
+        start_frame, end_frame = expand_frame_window(start_frame, end_frame, time_window, fps, int(duration * fps))
+        stream_copy_cut(video_path, start_frame / fps, end_frame / fps, output_video_path, keyframe_times, frame_times, audio=True, params=stream_params)
+        if output_audio_path is not None:
+            cut_audio(video_path, start_frame / fps, end_frame / fps, output_audio_path)
+        return
+
     # Load video clip
     video_clip = VideoFileClip(video_path)
     if fps is None:
         fps = video_clip.fps
 
     # print("Extracting video...")
-    # Downstream task requires fixed length data for training, so here we directly extract the data with the required length.
-    # If the event (label) is longer than required length (i.e, time_window), do normal data extraction;
-    # else put the event in the middle, and expand the starting and ending frame to the required length
-    if time_window:
-        # print("original start_frame:", start_frame, "original end_frame:", end_frame)
-        frame_len = end_frame - start_frame
-        expand_frame = int(time_window*fps - frame_len)
-        if expand_frame > 0:
-            total_frames = int(video_clip.duration * fps)
-            start_frame = max(0, start_frame - expand_frame // 2)
-            end_frame = min(total_frames, start_frame + frame_len + expand_frame)
-            # print("expanded start_frame:", start_frame, "expanded end_frame:", end_frame, "frame length: ", end_frame-start_frame)
-            # input("Press Enter to continue...")
+    start_frame, end_frame = expand_frame_window(start_frame, end_frame, time_window, fps, int(video_clip.duration * fps))
 
     # Calculate time in seconds for subclipping
     start_time = start_frame / fps
@@ -121,6 +134,10 @@ def extract_video_audio_subset(video_path, start_frame, end_frame, output_video_
     # Close the video clip
     subset_clip.close()
 
+    if output_audio_path is None:
+        video_clip.close()
+        return
+
     # Extract audio
     audio_clip = video_clip.audio
 
@@ -137,20 +154,6 @@ def extract_video_audio_subset(video_path, start_frame, end_frame, output_video_
     video_clip.close()
 
 
-def matlab_datenum_to_formatted_string(matlab_datenum):
-
-    # Convert MATLAB datenum to Python datenum by subtracting the MATLAB epoch
-    python_datenum = matlab_datenum
-
-    # Convert Python datenum to datetime
-    python_datetime = datetime.datetime.fromordinal(int(python_datenum)) + datetime.timedelta(days=python_datenum % 1) - datetime.timedelta(days=366)
-
-    # Format datetime string
-    formatted_string = python_datetime.strftime("%Y-%m-%d_%H-%M-%S-%f")[:-3]
-
-    return formatted_string
-
-
 def calculate_duration(datetime_str1, datetime_str2):
     """
     Calculate the duration between two datetime strings.
@@ -173,51 +176,35 @@ def calculate_duration(datetime_str1, datetime_str2):
     return duration
 
 
-def find_close_frame(time_label, time_data_array):
-
-    frame_index_data = 0
-    time_label_num = datetime.datetime.strptime(time_label, '%Y-%m-%d_%H-%M-%S-%f')
-
-    for temp_index in range(time_data_array.shape[0]):
-
-        temp_time_data = datetime.datetime.strptime(time_data_array[temp_index], '%Y-%m-%d_%H-%M-%S-%f')
-
-        if temp_time_data >= time_label_num:
-
-            frame_index_data = temp_index
-            # print("syncronze frame: ", frame_index_data, time_label, time_data_array[temp_index])
-            break
-
-    return frame_index_data
-
-def calculate_time_diff(time_str1, time_str2):
-    '''Calculate the difference between time_str1 and time_str2. Both input times are str in format: '%Y-%m-%d_%H-%M-%S-%f' '''
-    time1 = datetime.datetime.strptime(time_str1, '%Y-%m-%d_%H-%M-%S-%f')
-    time2 = datetime.datetime.strptime(time_str2, '%Y-%m-%d_%H-%M-%S-%f')
-
-    return abs(time2 - time1).total_seconds()
+def save_window(save_syncronized_splt_folder, index, modality, window):
+    """
+    Save the window of one modality of one event, as {index}_{modality}.npy or into the walk container
+    if output_container is open.
+    """
+    with measure(stage_metrics, 'save_window', modality, index):
+        if output_container is not None:
+            output_container.write(index, modality, window)
+        else:
+            np.save(save_syncronized_splt_folder + '{}_{}.npy'.format(index, modality), window)
 
 def extract_modalities(
         start_frame_index : int,
         end_frame_index : int,
-        time_arr : NDArray,
+        time_arr : NDArray, # frame of this modality for every label row: NPSample for np, find_close_frames() output otherwise
         data_arr : NDArray,
         modality : str, # all events except for gopro. Gopro is processed outside this function.
-        time_label,
+        time_label, # label times in epoch nanoseconds
         save_syncronized_splt_folder : str,
         time_window = None,
         modality_freq = None,
         do_extract : bool = True, # whether to extract and save the np file. Default is True. If setting to False, this function only returns whether the modality is missing or not.
+        time_data : NDArray = None, # sample times of the modality in epoch nanoseconds, needed by gps and light
     ):
     global label_missing_cnt, modalit_missing_time
-    if modality == 'np':
-        start_frame = time_arr[start_frame_index]
-        end_frame = time_arr[end_frame_index]
-    else:
-        if time_label == None:
-            raise ValueError("time_label can be unset only if modality is neural pace")
-        start_frame = find_close_frame(time_label[start_frame_index], time_arr)
-        end_frame = find_close_frame(time_label[end_frame_index], time_arr)
+    if modality not in ['np', 'np_artifact'] and time_label is None:
+        raise ValueError("time_label can be unset only if modality is neural pace")
+    start_frame = time_arr[start_frame_index]
+    end_frame = time_arr[end_frame_index]
 
     # Downstream task requires fixed length data for training, so here we directly extract the data with the required length.
     # If the event (label) is longer than required length (i.e, time_window), do normal data extraction;
@@ -237,18 +224,18 @@ def extract_modalities(
 
     # print("time_{}: ".format(modality), time_arr[start_frame], time_arr[end_frame], calculate_duration(time_arr[start_frame], time_arr[end_frame]))
     
-    if modality in ['chestphone_acc', 'chestphone_gyro', 'chestphone_mag', 'pupilphone_acc', 'pupilphone_gyro', 'pupilphone_mag', 'xs_CoM', 'np']:
+    if modality in ['chestphone_acc', 'chestphone_gyro', 'chestphone_mag', 'pupilphone_acc', 'pupilphone_gyro', 'pupilphone_mag', 'xs_CoM', 'np', 'np_artifact']:
         if end_frame <= start_frame:
             label_missing_cnt[modality] = label_missing_cnt.get(modality, 0) + 1
             return False
         else:
             if do_extract:
-                output_path = save_syncronized_splt_folder + '{}_{}.npy'.format(start_frame_index, modality)
-                np.save(output_path, data_arr[start_frame:end_frame])
+                # The slice is a view (of the memory-mapped file with use_mmap), it is written to disk without a copy
+                save_window(save_syncronized_splt_folder, start_frame_index, modality, data_arr[start_frame:end_frame])
             return True
     elif modality in ['chestphone_gps', 'chestphone_light', 'pupilphone_gps']:
         if end_frame <= start_frame:
-            if calculate_time_diff(time_label[start_frame_index], time_arr[start_frame]) > map_long_sample_freq[modality]:
+            if abs(int(time_data[start_frame]) - int(time_label[start_frame_index])) / 1e9 > map_long_sample_freq[modality]:
                 label_missing_cnt[modality] = label_missing_cnt.get(modality, 0) + 1
                 return False
             else:
@@ -256,24 +243,97 @@ def extract_modalities(
 
         # If end_frame > start_frame or time_diff <= sample_freq, return true
         if do_extract:
-            output_path = save_syncronized_splt_folder + '{}_{}.npy'.format(start_frame_index, modality)
-            np.save(output_path, data_arr[start_frame:end_frame])
+            save_window(save_syncronized_splt_folder, start_frame_index, modality, data_arr[start_frame:end_frame])
         
         return True 
 
 
-for walk in walks:
+def reset_output_container():
+    # extract_modalities writes to the module level container only while a walk is synchronized
+    global output_container
+    output_container = None
+
+
+def submit_job(pool, fn, *args, **kwargs):
+    """
+    Queue fn(*args, **kwargs) to the process pool. Without a pool, run it right away in this process so that
+    exceptions are raised at the call site as before.
+
+    Returns:
+        concurrent.futures.Future: Future holding the result of fn.
+    """
+    if pool is not None:
+        return pool.submit(fn, *args, **kwargs)
+    future = Future()
+    future.set_result(fn(*args, **kwargs))
+    return future
+
+
+def synchronize_walk(subject, walk, fps_for_frame=fps_for_frame, video_sync_modality_frame=video_sync_modality_frame,
+                     time_window=time_window, video_cut_mode=video_cut_mode, workers=1, gps_bucket_width=gps_bucket_width,
+                     use_cache=True, use_mmap=False, output_format=output_format, metrics=None,
+                     calibrate=calibrate_videos, skip_videos=skip_videos, audio_source=audio_source, audio_sample_rate=audio_sample_rate,
+                     np_source=np_source, merge_successive=merge_successive_events, events=None):
+    """
+    Synchronize all sensor data of one walk and split them into events.
+
+    Parameters:
+        subject (int): Subject number.
+        walk (int): Walk number.
+        fps_for_frame (int): Frame frequency used to convert video frame indices to seconds.
+        video_sync_modality_frame (str): Column of the events csv used to cut both videos ('GoProFrame' or 'PupilFrame').
+        time_window (int): Time window for downstream task input (second).
+        video_cut_mode (str): 'reencode' or 'stream_copy', see the module level setting.
+        workers (int): Number of processes encoding video and audio clips. 1 encodes in the main process.
+        gps_bucket_width (float): GPS samples in the same bucket of this width (second) are averaged into one value.
+        use_cache (bool): Load parsed phone and Xsens csv streams from RW{subject}-Walk{walk}-cache/ when up to date.
+        use_mmap (bool): Memory-map data_np.npy and the cached streams instead of reading them into memory.
+            Event windows are then views of the files and are written to disk without an intermediate copy.
+        output_format (str): 'npy' or 'hdf5', see the module level setting. Videos and audio are always separate files.
+        metrics (instrumentation.StageMetrics): If given, time, I/O and peak memory of every stage, modality and event
+            are recorded and saved as metrics.csv and metrics.json next to index_stats.csv.
+        calibrate (bool): Replace fps_for_frame, video_sync_modality_frame and skip_videos by the result of
+            video_calibration.calibrate_walk, which is saved as video_calibration.json next to index_stats.csv.
+        skip_videos (bool): Do not cut the videos. The events are still extracted from the other modalities.
+        audio_source (str): 'video' or 'buffer', see the module level setting. The buffer is kept in
+            RW{subject}-Walk{walk}-cache/ and reused while the GoPro video is unchanged.
+        audio_sample_rate (int): Sample rate of the event wav files with audio_source 'buffer'.
+        np_source (str): 'raw' or 'clean', see the module level setting. 'clean' needs np_cleaning.py to have run.
+        merge_successive (bool): Merge successive rows of the same instant label into one event, see
+            event_intervals.build_intervals.
+        events (NDArray): Only extract these events, e.g. the result of an event_index.EventIndex query. Events are
+            matched on their start row ('index'), and on 'subject' and 'walk' if present. Files, container windows
+            and statistics of the other events are carried over from the last run.
+
+    Returns:
+        tuple[dict, dict]: {modality: missing count} and {label: total time} of the walk.
+    """
+    global label_missing_cnt, output_container, stage_metrics
+    stage_metrics = metrics
     # fre_np = 250, fre_gopro = 60, fre_pupil = 60
     # Load all data and timestamp: Neural-Pace (NP) signal, GoPro videos, Pupil videos, Xsens, phone (acc, gyro, mag, GPS, light, audio)
     load_syncronized_folder = f'../RW{subject}/RW{subject}-Walk{walk}-extracted/'
+    cache_folder = f'../RW{subject}/RW{subject}-Walk{walk}-cache/' if use_cache else None
+    mmap_mode = 'r' if use_mmap else None
     save_syncronized_splt_folder = f'../synchronized/RW{subject}/RW{subject}-Walk{walk}-self-syncronize-split/'
 
     if not os.path.exists(save_syncronized_splt_folder):
         # Create the directory
         os.makedirs(save_syncronized_splt_folder)
 
+    ## fit the frame columns against the video timestamps and headers before anything is decoded
+    if calibrate:
+        with measure(metrics, 'calibrate_videos'):
+            calibration = calibrate_walk(subject, walk)
+        save_calibration(save_syncronized_splt_folder, calibration)
+        skip_videos = calibration['skip_videos']
+        if not skip_videos:
+            fps_for_frame, video_sync_modality_frame = calibration['fps_for_frame'], calibration['video_sync_modality_frame']
+        print("Video calibration:", "skip videos" if skip_videos else f"{video_sync_modality_frame} with fps={fps_for_frame}")
+
     # Event Description PupilFrame  GoProFrame  NPSample    NTP
-    df = pd.read_csv(f'../label_RWNApp_Output_Jan2024/evnts_RWNApp_RW{subject}_Walk{walk}.csv')
+    with measure(metrics, 'load_labels'):
+        df = pd.read_csv(f'../label_RWNApp_Output_Jan2024/evnts_RWNApp_RW{subject}_Walk{walk}.csv')
     label = df['Event']
     ntp_label = df['NTP']
     # PupilFrame = df['PupilFrame']
@@ -281,7 +341,8 @@ for walk in walks:
     NPSample = df['NPSample']
 
     # convert matlab NTP time to datetime timestamp
-    time_label = [matlab_datenum_to_formatted_string(md) for md in ntp_label/60/60/24]
+    time_label_ns = matlab_datenum_to_datetime64(ntp_label/60/60/24).astype(np.int64)
+    time_label = format_time_ns(time_label_ns)
     # np.save(save_folder + "time_label", time_label)
     num_of_label = len(time_label)
 
@@ -289,117 +350,47 @@ for walk in walks:
     # fre_np = 250, fre_gopro = 60, fre_pupil = 60
 
     ''''''''''''''' Load modalities data '''''''''''''''
-    ## load np data
-    data_np = np.load(load_syncronized_folder + 'data_np.npy')
-    time_np = np.load(load_syncronized_folder + 'time_np.npy')
+    ## load np, xsense and phone data, parsed csv streams are cached as typed arrays next to the extracted folder
+    streams = load_walk_streams(load_syncronized_folder, cache_folder, mmap_mode=mmap_mode, gps_bucket_width=gps_bucket_width, metrics=metrics, np_source=np_source)
+    time_np, data_np = streams['np']
 
     ## load Gopro video
     data_gopro = load_syncronized_folder + 'data_video_gopro.mp4'
-    time_gopro = np.load(load_syncronized_folder + 'time_gopro.npy')
+    with measure(metrics, 'load_stream', 'gopro'):
+        time_gopro = load_time_array(load_syncronized_folder + 'time_gopro.npy')
 
     ## load Pupil video
     data_pupil = load_syncronized_folder + 'data_video_pupil.mp4'
-    time_pupil = np.load(load_syncronized_folder + 'time_pupil.npy')
-
-    # load xsense data: only center of mass currently
-    df_xsense = pd.read_csv(load_syncronized_folder + 'data_xs_Center-of-Mass.csv')
-    time_xsense = np.load(load_syncronized_folder + 'time_xs.npy')
-    # frame_xsense = df_xsense['Frame']
-    data_xsense = df_xsense.iloc[:, 1:]
-    print("xs:", time_xsense.shape, data_xsense.shape, time_xsense[0], time_xsense[-1])
-
-    ## load all of chestphone data
-    df = pd.read_csv(load_syncronized_folder + "data_chest_phone_acc.csv", header=None)
-    time_chestphone_acc = df.iloc[:, 0]
-    data_chestphone_acc = df.iloc[:, 1:]
-    print("chest acc:", time_chestphone_acc.shape, time_chestphone_acc.iloc[0], data_chestphone_acc.shape, data_chestphone_acc.iloc[0])
-
-    df = pd.read_csv(load_syncronized_folder + "data_chest_phone_gyro.csv", header=None)
-    time_chestphone_gyro = df.iloc[:, 0]
-    data_chestphone_gyro = df.iloc[:, 1:]
-    print("chest gyro:", time_chestphone_gyro.shape, time_chestphone_gyro.iloc[0], data_chestphone_gyro.shape, data_chestphone_gyro.iloc[0])
-
-    df = pd.read_csv(load_syncronized_folder + "data_chest_phone_mag.csv", header=None)
-    time_chestphone_mag = df.iloc[:, 0]
-    data_chestphone_mag = df.iloc[:, 1:]
-    print("chest mag:", time_chestphone_mag.shape, time_chestphone_mag.iloc[0], data_chestphone_mag.shape, data_chestphone_mag.iloc[0])
-
-    df = pd.read_csv(load_syncronized_folder + "data_chest_phone_light.csv", header=None)
-    time_chestphone_light = df.iloc[:, 0]
-    data_chestphone_light = df.iloc[:, 1:]
-    print("chest light:", time_chestphone_light.shape, time_chestphone_light.iloc[0], data_chestphone_light.shape, data_chestphone_light.iloc[0])
-
-    df = pd.read_csv(load_syncronized_folder + "data_chest_phone_gps.csv", header=None)
-    time_chestphone_gps = df.iloc[:, 0]
-    data_chestphone_gps_1 = df.iloc[:, 1].str.extract(r'Lat: (\d+\.\d+)', expand=False)## delete the str of "Lat:"
-    data_chestphone_gps_1 = np.array(data_chestphone_gps_1.astype(float))
-    data_chestphone_gps_2 = df.iloc[:, 2].str.extract(r'Long: (-?\d+\.\d+)', expand=False)## delete the str of "Long:"
-    data_chestphone_gps_2 = np.array(data_chestphone_gps_2.astype(float))
-    data_chestphone_gps = np.stack((data_chestphone_gps_1, data_chestphone_gps_2), axis=1)
-    print("chest gps:", time_chestphone_gps.shape, time_chestphone_gps[0], data_chestphone_gps.shape, data_chestphone_gps[0])
-
-    ## load all of pupilphone data
-    df = pd.read_csv(load_syncronized_folder + "data_pupil_phone_acc.csv", header=None)
-    time_pupilphone_acc = df.iloc[:, 0]
-    data_pupilphone_acc = df.iloc[:, 1:]
-    print("pupil acc:", time_pupilphone_acc.shape, time_pupilphone_acc.iloc[0], data_pupilphone_acc.shape, data_pupilphone_acc.iloc[0])
-
-    df = pd.read_csv(load_syncronized_folder + "data_pupil_phone_gyro.csv", header=None)
-    time_pupilphone_gyro = df.iloc[:, 0]
-    data_pupilphone_gyro = df.iloc[:, 1:]
-    print("pupil gyro:", time_pupilphone_gyro.shape, time_pupilphone_gyro.iloc[0], data_pupilphone_gyro.shape, data_pupilphone_gyro.iloc[0])
-
-    df = pd.read_csv(load_syncronized_folder + "data_pupil_phone_mag.csv", header=None)
-    time_pupilphone_mag = df.iloc[:, 0]
-    data_pupilphone_mag = df.iloc[:, 1:]
-    print("pupil mag:", time_pupilphone_mag.shape, time_pupilphone_mag.iloc[0], data_pupilphone_mag.shape, time_pupilphone_mag.iloc[0])
-
-    df = pd.read_csv(load_syncronized_folder + "data_pupil_phone_gps.csv", header=None)
-    time_pupilphone_gps = df.iloc[:, 0]
-    data_pupilphone_gps_1 = df.iloc[:, 1].str.extract(r'Lat: (\d+\.\d+)', expand=False)## delete the str of "Lat:"
-    data_pupilphone_gps_1 = np.array(data_pupilphone_gps_1.astype(float))
-    data_pupilphone_gps_2 = df.iloc[:, 2].str.extract(r'Long: (-?\d+\.\d+)', expand=False)## delete the str of "Long:"
-    data_pupilphone_gps_2 = np.array(data_pupilphone_gps_2.astype(float))
-    data_pupilphone_gps = np.stack((data_pupilphone_gps_1, data_pupilphone_gps_2), axis=1)
-    print("pupil gps:", time_pupilphone_gps.shape, time_pupilphone_gps[0], data_pupilphone_gps.shape, data_pupilphone_gps[0])
-
-    ## Merge gps data and time in the same second - Chest phone
-    time = time_chestphone_gps[0]
-    gps_datas = []
-    gps_times = []
-    gps_data = []
-    for idx in range(len(time_chestphone_gps)):
-        if time_chestphone_gps[idx][:19] == time[:19]:
-            gps_data.append(data_chestphone_gps[idx])
-        else:
-            gps_datas.append(np.mean(gps_data, axis=0))
-            # print(idx, gps_datas)
-            gps_times.append(time)
-            gps_data.clear()
-            time = time_chestphone_gps[idx]
-            gps_data.append(data_chestphone_gps[idx])
-
-    time_chestphone_gps = pd.Series(gps_times)
-    data_chestphone_gps = np.array(gps_datas)
-
-    ## Merge gps data and time in the same second - Pupil phone
-    time = time_pupilphone_gps[0]
-    gps_datas = []
-    gps_times = []
-    gps_data = []
-    for idx in range(len(time_pupilphone_gps)):
-        if time_pupilphone_gps[idx][:19] == time[:19]:
-            gps_data.append(data_pupilphone_gps[idx])
-        else:
-            gps_datas.append(np.mean(gps_data, axis=0))
-            # print(idx, gps_datas)
-            gps_times.append(time)
-            gps_data.clear()
-            time = time_pupilphone_gps[idx]
-            gps_data.append(data_pupilphone_gps[idx])
-
-    time_pupilphone_gps = pd.Series(gps_times)
-    data_pupilphone_gps = np.array(gps_datas)
+    with measure(metrics, 'load_stream', 'pupil'):
+        time_pupil = load_time_array(load_syncronized_folder + 'time_pupil.npy')
+
+    ## decode the GoPro audio once per walk, event wav files are slices of the buffer
+    if audio_source == 'buffer' and not skip_videos:
+        with measure(metrics, 'decode_audio', 'gopro_audio'):
+            stem = audio_stem(f'../RW{subject}/RW{subject}-Walk{walk}-cache/', 'gopro', audio_sample_rate)
+            os.makedirs(os.path.dirname(stem), exist_ok=True)
+            decode_audio(data_gopro, stem, audio_sample_rate)
+            audio_samples, audio_meta = load_audio(stem)
+            # clips are expanded within the video duration as in extract_video_audio_subset
+            gopro_duration = probe_video(data_gopro)[0]
+
+    ## build keyframe index and probe the stream parameters of both videos once per walk for stream copy cutting
+    video_keyframes = {}
+    video_params = {}
+    if video_cut_mode == 'stream_copy' and not skip_videos:
+        with measure(metrics, 'keyframe_index', 'gopro'):
+            video_keyframes[data_gopro] = build_keyframe_index(data_gopro)
+            video_params[data_gopro] = video_stream_params(data_gopro)
+        with measure(metrics, 'keyframe_index', 'pupil'):
+            video_keyframes[data_pupil] = build_keyframe_index(data_pupil)
+            video_params[data_pupil] = video_stream_params(data_pupil)
+
+    ## Resolve the frame of every label row in one batched search per stream
+    label_frames = {}
+    for modality, (time_ns, _) in streams.items():
+        if modality not in ['np', 'np_artifact']:
+            with measure(metrics, 'boundary_search', modality):
+                label_frames[modality] = find_close_frames(time_label_ns, time_ns)
     ''''''''''''''''''''''''''''''''''''''''''''''''''''''''
 
     # Split Frames
@@ -408,84 +399,136 @@ for walk in walks:
     greped_index = {} # {greped_index: (greped_label, grep reason, time label)} indexs that got filtered
     label_total_time = {} # {label: datetime.timedelta} total time in one walk of each label
     label_missing_cnt = {} # {label: missing times}
+    pending_events = [] # [(index, label, duration, num of modalities, missing modalities, video jobs, input hash, files)] in event order
+    event_stats = {} # {str(index): {'row': index_stats row, 'grep': grep reason, 'missing': {modality: missing count}}} of every event
+    stats_rows = {} # {index: index_stats row} written in this run
+    ## Events whose label rows, input files and parameters are unchanged since the last run are not extracted again
+    manifest = load_manifest(save_syncronized_splt_folder)
+    previous_events = dict(manifest['events'])
+    previous_stats = manifest.get('stats', {})
+    recorded_events = set() # str(index) of events recorded in this run
+    sync_params = {'time_window': time_window, 'fps_for_frame': fps_for_frame, 'video_sync_modality_frame': video_sync_modality_frame,
+                   'skip_videos': skip_videos, 'audio_source': audio_source, 'audio_sample_rate': audio_sample_rate, 'np_source': np_source, 'merge_successive': merge_successive, 'gps_bucket_width': gps_bucket_width, 'video_cut_mode': video_cut_mode, 'output_format': output_format}
+    # only the files the events are read from, with the np source and videos in use
+    with measure(metrics, 'fingerprint_inputs'):
+        input_fingerprints = file_fingerprints(load_syncronized_folder, walk_input_files(load_syncronized_folder, np_source, videos=not skip_videos),
+                                               manifest.get('inputs'))
+    manifest['inputs'] = input_fingerprints
 
     ''''''''''''''' Split data of each modality '''''''''''''''
-    ## Start at "Walk Beg"
-    walk_beg_index = 0
-    func_extract_label = lambda index : label[index][:-4] if (label[index].endswith("Beg") or label[index].endswith("End")) else label[index]
-    while label[walk_beg_index] != "Walk Beg":
-        greped_index[walk_beg_index] = (func_extract_label(walk_beg_index), "Event before Walk Beg", time_label[walk_beg_index])
-        walk_beg_index += 1
+    ## Pair the Beg and End rows into events in one pass, label rows that are not events carry their grep reason
+    with measure(metrics, 'build_intervals'):
+        intervals = build_intervals(df, interested_labels, frame_column=video_sync_modality_frame, merge_successive=merge_successive)
+    selected = None
+    if events is not None:
+        if 'subject' in events.dtype.names:
+            events = events[(events['subject'] == subject) & (events['walk'] == walk)]
+        selected = set(events['index'].tolist())
 
     file_stats = save_syncronized_splt_folder + "index_stats.csv"
 
-    with open(file_stats, mode='a+', newline='') as f:
+    # Rewritten in place on every run, rows of reused events are recomputed from the labels and rows of events left
+    # out of a subset run are carried over from the last run.
+    # The worker pool and the container are closed even if the loop fails, so the container keeps its offsets.
+    with open(file_stats, mode='w', newline='') as f, ExitStack() as outputs:
+        pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+        if pool is not None:
+            outputs.callback(pool.shutdown, cancel_futures=True)
+        if output_format == 'hdf5':
+            # a subset run copies the windows of the other events from the last container
+            keep_events = None if selected is None else {int(index) for index in previous_events if int(index) not in selected}
+            output_container = outputs.enter_context(WalkContainerWriter(save_syncronized_splt_folder + CONTAINER_NAME, keep_events=keep_events))
+            outputs.callback(reset_output_container)
         writer = csv.writer(f)
         # Write the header row
         writer.writerow(["Index", "Label", "Duration", "Num of Modalities", "Missing Modalities"])
-        
-        temp_index = walk_beg_index + 1
-        while temp_index < num_of_label:
-            ## End at "Walk End"
-            if label[temp_index] == "Walk End":
-                break
-            
-            try:
-                ## skip "xxx End" events
-                if label[temp_index].endswith("End"):
-                    continue
-                
-                start_frame_index = temp_index
-                end_frame_index = start_frame_index + 1
 
-                cut_label = func_extract_label(start_frame_index)
-
-                ## grep not interested labels
-                if cut_label not in ["Doorway", "Talking", "Correct Turn", "Incorrect Turn", "Lost", "Stop", "Abnormal", "Pointing", "Outdoor", "Choice Point", "Stare", "New Context"]:
-                    greped_index[start_frame_index] = (cut_label, "Not intereted event", time_label[start_frame_index])
-                    print("Greped: ", "Not intereted event")
+        def record_finished_events(block):
+            # Record finished events from the head of the queue so the manifest stays usable after a crash
+            while pending_events and (block or all(job.done() for job in pending_events[0][5])):
+                start_frame_index, cut_label, dura, modality_num, missing_modality, video_jobs, input_hash, files = pending_events.pop(0)
+                try:
+                    for job in video_jobs:
+                        job.result()
+                except Exception as e:
+                    greped_index[start_frame_index] = (cut_label, str(e), time_label[start_frame_index])
+                    print("Exception:", str(e))
                     continue
+                label_total_time[cut_label] = label_total_time.get(cut_label, datetime.timedelta()) + dura
+                stats_rows[start_frame_index] = [start_frame_index, cut_label, str(dura), modality_num, ", ".join(missing_modality)]
+                writer.writerow(stats_rows[start_frame_index])
+                if files is None:
+                    # carried over from the last run, its files and manifest entry are unchanged
+                    continue
+                for name in set(previous_events.get(str(start_frame_index), {'files': []})['files']) - set(files):
+                    if os.path.exists(save_syncronized_splt_folder + name):
+                        os.remove(save_syncronized_splt_folder + name)
+                manifest['events'][str(start_frame_index)] = {'inputs': input_hash, 'params': sync_params, 'files': files}
+                recorded_events.add(str(start_frame_index))
+                save_manifest(save_syncronized_splt_folder, manifest)
+
+        for interval in intervals:
+            start_frame_index = int(interval['index'])
+            cut_label = str(interval['label'])
+            if interval['reason']:
+                greped_index[start_frame_index] = (cut_label, str(interval['reason']), time_label[start_frame_index])
+                if interval['reason'] not in [REASON_BEFORE_WALK, REASON_AFTER_WALK]:
+                    print("Greped: ", interval['reason'])
+                continue
+            end_frame_index = int(interval['end_index'])
+            if selected is not None and start_frame_index not in selected:
+                # files of an earlier run stay in the manifest, its statistics are counted again
+                if str(start_frame_index) in previous_events:
+                    recorded_events.add(str(start_frame_index))
+                stats = previous_stats.get(str(start_frame_index))
+                if stats is not None:
+                    event_stats[str(start_frame_index)] = stats
+                    for modality, cnt in stats['missing'].items():
+                        label_missing_cnt[modality] = label_missing_cnt.get(modality, 0) + cnt
+                    if stats['grep'] is not None:
+                        greped_index[start_frame_index] = (cut_label, stats['grep'], time_label[start_frame_index])
+                    if stats['row'] is not None:
+                        _, _, dura, modality_num, missing_modality = stats['row']
+                        pending_events.append((start_frame_index, cut_label, pd.Timedelta(dura).to_pytimedelta(), modality_num,
+                                               missing_modality.split(", ") if missing_modality else [], [], None, None))
+                continue
+            missing_before = dict(label_missing_cnt)
 
-                ## Find end_frame_index
-                if label[start_frame_index].endswith("Beg"):
-                    while end_frame_index < num_of_label:
-                        if label[end_frame_index].endswith("End") and func_extract_label(end_frame_index) == cut_label:
-                            break
-                        end_frame_index += 1
-                    if end_frame_index >= num_of_label:
-                        raise ValueError(f"Corresponding End event missing: {start_frame_index} {cut_label}")
-                # else: # merge successive identical label
-                #     while func_extract_label(end_frame_index) == cut_label and end_frame_index < num_of_label:
-                #         end_frame_index += 1
-                #     temp_index = end_frame_index - 1 # align with the "+1" later
-                ########################
-
+            try:
                 modality_num = 0
                 missing_modality = []
                 do_extract = True
 
+                input_hash = event_input_hash(df.iloc[[start_frame_index, end_frame_index]], input_fingerprints, sync_params)
+                reuse = is_event_current(previous_events.get(str(start_frame_index)), input_hash, save_syncronized_splt_folder)
+                # the container is rebuilt on every run, so its windows are always written
+                save_sensors = not reuse or output_format == 'hdf5'
+                if reuse:
+                    print("Unchanged since the last run, reusing its files")
+
                 print("Frame ", start_frame_index, ":")
                 print("label: ", label[start_frame_index])
-                print("End frame index:", end_frame_index)
+                print("End frame index:", end_frame_index, "depth:", interval['depth'])
                 # input("Press to continue......")
                 print("time_label: ", time_label[start_frame_index], time_label[end_frame_index], calculate_duration(time_label[start_frame_index], time_label[end_frame_index]))
 
                 ############### grep invalid data. If one of gopro/pupil/np frame is missing, grep all data ###############
-                start_frame_gopro = GoProFrame[start_frame_index]
-                end_frame_gopro = GoProFrame[end_frame_index]
-                dura_gopro = calculate_duration(time_gopro[start_frame_gopro], time_gopro[end_frame_gopro])
-                # print("time_gopro: ", time_gopro[start_frame_gopro], time_gopro[end_frame_gopro], calculate_duration(time_gopro[start_frame_gopro], time_gopro[end_frame_gopro]))
-
-                if end_frame_gopro <= start_frame_gopro:
-                    label_missing_cnt['gopro'] = label_missing_cnt.get('gopro', 0) + 1
-                    greped_index[start_frame_index] = (cut_label, 'gopro', time_label[start_frame_index])
-                    print("Greped: ", "gopro")
-                    do_extract = False
-                    # raise ValueError("End frame must be greater than start frame:gopro")
+                if not skip_videos:
+                    start_frame_gopro = int(interval['start_frame'])
+                    end_frame_gopro = int(interval['end_frame'])
+                    dura_gopro = datetime.timedelta(microseconds=int(time_gopro[end_frame_gopro] - time_gopro[start_frame_gopro]) // 1000)
+                    # print("time_gopro: ", time_gopro[start_frame_gopro], time_gopro[end_frame_gopro], calculate_duration(time_gopro[start_frame_gopro], time_gopro[end_frame_gopro]))
+
+                    if end_frame_gopro <= start_frame_gopro:
+                        label_missing_cnt['gopro'] = label_missing_cnt.get('gopro', 0) + 1
+                        greped_index[start_frame_index] = (cut_label, 'gopro', time_label[start_frame_index])
+                        print("Greped: ", "gopro")
+                        do_extract = False
+                        # raise ValueError("End frame must be greater than start frame:gopro")
 
                 ############### sample np signals ###############
-                start_frame_np = NPSample[start_frame_index]
-                end_frame_np = NPSample[end_frame_index]
+                start_frame_np = int(interval['start_np'])
+                end_frame_np = int(interval['end_np'])
                 # print("time_np: ", time_np[start_frame_np], time_np[end_frame_np-1], calculate_duration(time_np[start_frame_np], time_np[end_frame_np-1]), data_np[start_frame_np:end_frame_np].shape) # the extracted end_frame_np is started from 1, so need to subtract 1 when apply to time_np. data_np slice won't include end_frame_np. Other modalities don't have this problem.
                 if end_frame_np <= start_frame_np:
                     label_missing_cnt['np'] = label_missing_cnt.get('np', 0) + 1
@@ -500,146 +543,171 @@ for walk in walks:
                                        modality='np',
                                        time_window=time_window,
                                        modality_freq=250,
-                                       do_extract=do_extract)
+                                       do_extract=do_extract and save_sensors)
                     modality_num += 1
+                    if 'np_artifact' in streams:
+                        # samples of the window replaced by np_cleaning.py, same rows as the np window
+                        extract_modalities(start_frame_index=start_frame_index, end_frame_index=end_frame_index,
+                                           time_arr=NPSample, data_arr=streams['np_artifact'][1],
+                                           time_label=None,
+                                           save_syncronized_splt_folder=save_syncronized_splt_folder,
+                                           modality='np_artifact',
+                                           time_window=time_window,
+                                           modality_freq=250,
+                                           do_extract=do_extract and save_sensors)
 
                 ############### sample gopro videos ###############
-                if do_extract:
+                # Video and audio are queued to the worker pool; the event is recorded once its jobs finish
+                video_jobs = []
+                if do_extract and not reuse and not skip_videos:
                     output_path = save_syncronized_splt_folder + '{}_gopro.mp4'.format(start_frame_index)
                     output_path_audio = save_syncronized_splt_folder + '{}_gopro_audio.wav'.format(start_frame_index)
-                    extract_video_audio_subset(data_gopro, start_frame_gopro, end_frame_gopro, output_path, output_path_audio, time_window=time_window, fps=fps_for_frame)
-                    modality_num += 2 # will extract two modalities
+                    if audio_source == 'buffer':
+                        with measure(metrics, 'audio_slice', 'gopro_audio', start_frame_index):
+                            audio_start, audio_end = expand_frame_window(start_frame_gopro, end_frame_gopro, time_window, fps_for_frame, int(gopro_duration * fps_for_frame))
+                            write_event_audio(audio_samples, audio_meta, audio_start / fps_for_frame, audio_end / fps_for_frame, output_path_audio)
+                        output_path_audio = None
+                    # with workers > 1 only the submission is measured, the encoding runs in the worker processes
+                    with measure(metrics, 'video_cut', 'gopro', start_frame_index):
+                        video_jobs.append(submit_job(pool, extract_video_audio_subset, data_gopro, start_frame_gopro, end_frame_gopro, output_path, output_path_audio, time_window=time_window, fps=fps_for_frame, keyframes=video_keyframes.get(data_gopro), stream_params=video_params.get(data_gopro)))
                 
                     output_path = save_syncronized_splt_folder + '{}_pupil.mp4'.format(start_frame_index)
-                    extract_video_noaudio_subset(data_pupil, start_frame_gopro, end_frame_gopro, output_path, time_window=time_window, fps=fps_for_frame)
-                    modality_num += 1
+                    with measure(metrics, 'video_cut', 'pupil', start_frame_index):
+                        video_jobs.append(submit_job(pool, extract_video_noaudio_subset, data_pupil, start_frame_gopro, end_frame_gopro, output_path, time_window=time_window, fps=fps_for_frame, keyframes=video_keyframes.get(data_pupil), stream_params=video_params.get(data_pupil)))
+                if skip_videos:
+                    missing_modality.extend(['gopro', 'gopro_audio', 'pupil'])
+                elif do_extract:
+                    modality_num += 3 # gopro, gopro audio and pupil
 
                 ############### sample other data ###############
                 if extract_modalities(start_frame_index, end_frame_index,
-                                      time_chestphone_acc, data_chestphone_acc,
-                                      time_label=time_label,
+                                      label_frames['chestphone_acc'], streams['chestphone_acc'][1],
+                                      time_label=time_label_ns,
                                       save_syncronized_splt_folder=save_syncronized_splt_folder,
                                       modality='chestphone_acc',
                                       time_window=time_window,
                                       modality_freq=100,
-                                      do_extract=do_extract
+                                      do_extract=do_extract and save_sensors
                                     ):
                     modality_num += 1
                 else:
                     missing_modality.append('chestphone_acc')
                 
                 if extract_modalities(start_frame_index, end_frame_index,
-                                      time_chestphone_gyro, data_chestphone_gyro,
-                                      time_label=time_label,
+                                      label_frames['chestphone_gyro'], streams['chestphone_gyro'][1],
+                                      time_label=time_label_ns,
                                       save_syncronized_splt_folder=save_syncronized_splt_folder,
                                       modality='chestphone_gyro',
                                       time_window=time_window,
                                       modality_freq=50,
-                                      do_extract=do_extract
+                                      do_extract=do_extract and save_sensors
                                     ):
                     modality_num += 1
                 else:
                     missing_modality.append('chestphone_gyro')
                 
                 if extract_modalities(start_frame_index, end_frame_index,
-                                      time_chestphone_mag, data_chestphone_mag,
-                                      time_label=time_label,
+                                      label_frames['chestphone_mag'], streams['chestphone_mag'][1],
+                                      time_label=time_label_ns,
                                       save_syncronized_splt_folder=save_syncronized_splt_folder,
                                       modality='chestphone_mag',
                                       time_window=time_window,
                                       modality_freq=50,
-                                      do_extract=do_extract
+                                      do_extract=do_extract and save_sensors
                                     ):
                     modality_num += 1
                 else:
                     missing_modality.append('chestphone_mag')
                 
                 if extract_modalities(start_frame_index, end_frame_index,
-                                      time_chestphone_gps, data_chestphone_gps,
-                                      time_label=time_label,
+                                      label_frames['chestphone_gps'], streams['chestphone_gps'][1],
+                                      time_label=time_label_ns,
                                       save_syncronized_splt_folder=save_syncronized_splt_folder,
                                       modality='chestphone_gps',
                                       time_window=None,
                                       modality_freq=None,
-                                      do_extract=do_extract
+                                      do_extract=do_extract and save_sensors,
+                                      time_data=streams['chestphone_gps'][0]
                                     ):
                     modality_num += 1
                 else:
                     missing_modality.append('chestphone_gps')
                 
                 if extract_modalities(start_frame_index, end_frame_index,
-                                      time_chestphone_light, data_chestphone_light,
-                                      time_label=time_label,
+                                      label_frames['chestphone_light'], streams['chestphone_light'][1],
+                                      time_label=time_label_ns,
                                       save_syncronized_splt_folder=save_syncronized_splt_folder,
                                       modality='chestphone_light',
                                       time_window=time_window,
                                       modality_freq=10,
-                                      do_extract=do_extract
+                                      do_extract=do_extract and save_sensors,
+                                      time_data=streams['chestphone_light'][0]
                                     ):
                     modality_num += 1
                 else:
                     missing_modality.append('chestphone_light')
                 
                 if extract_modalities(start_frame_index, end_frame_index,
-                                      time_pupilphone_acc, data_pupilphone_acc,
-                                      time_label=time_label,
+                                      label_frames['pupilphone_acc'], streams['pupilphone_acc'][1],
+                                      time_label=time_label_ns,
                                       save_syncronized_splt_folder=save_syncronized_splt_folder,
                                       modality='pupilphone_acc',
                                       time_window=time_window,
                                       modality_freq=100,
-                                      do_extract=do_extract
+                                      do_extract=do_extract and save_sensors
                                     ):
                     modality_num += 1
                 else:
                     missing_modality.append('pupilphone_acc')
                 
                 if extract_modalities(start_frame_index, end_frame_index,
-                                      time_pupilphone_gyro, data_pupilphone_gyro,
-                                      time_label=time_label,
+                                      label_frames['pupilphone_gyro'], streams['pupilphone_gyro'][1],
+                                      time_label=time_label_ns,
                                       save_syncronized_splt_folder=save_syncronized_splt_folder,
                                       modality='pupilphone_gyro',
                                       time_window=time_window,
                                       modality_freq=50,
-                                      do_extract=do_extract
+                                      do_extract=do_extract and save_sensors
                                     ):
                     modality_num += 1
                 else:
                     missing_modality.append('pupilphone_gyro')
                 
                 if extract_modalities(start_frame_index, end_frame_index,
-                                      time_pupilphone_mag, data_pupilphone_mag,
-                                      time_label=time_label,
+                                      label_frames['pupilphone_mag'], streams['pupilphone_mag'][1],
+                                      time_label=time_label_ns,
                                       save_syncronized_splt_folder=save_syncronized_splt_folder,
                                       modality='pupilphone_mag',
                                       time_window=time_window,
                                       modality_freq=50,
-                                      do_extract=do_extract
+                                      do_extract=do_extract and save_sensors
                                     ):
                     modality_num += 1
                 else:
                     missing_modality.append('pupilphone_mag')
                 
                 if extract_modalities(start_frame_index, end_frame_index,
-                                      time_pupilphone_gps, data_pupilphone_gps,
-                                      time_label=time_label,
+                                      label_frames['pupilphone_gps'], streams['pupilphone_gps'][1],
+                                      time_label=time_label_ns,
                                       save_syncronized_splt_folder=save_syncronized_splt_folder,
                                       modality='pupilphone_gps',
                                       time_window=None,
                                       modality_freq=None,
-                                      do_extract=do_extract
+                                      do_extract=do_extract and save_sensors,
+                                      time_data=streams['pupilphone_gps'][0]
                                     ):
                     modality_num += 1
                 else:
                     missing_modality.append('pupilphone_gps')
                 
                 if extract_modalities(start_frame_index, end_frame_index,
-                                      time_xsense, data_xsense,
+                                      label_frames['xs_CoM'], streams['xs_CoM'][1],
                                       modality='xs_CoM',
-                                      time_label=time_label,
+                                      time_label=time_label_ns,
                                       save_syncronized_splt_folder=save_syncronized_splt_folder,
                                       time_window=time_window,
                                       modality_freq=100,
-                                      do_extract=do_extract
+                                      do_extract=do_extract and save_sensors
                                     ):
                     modality_num += 1
                 else:
@@ -648,18 +716,38 @@ for walk in walks:
                 ############### record label time ###############
                 if do_extract:
                     dura = calculate_duration(time_label[start_frame_index], time_label[end_frame_index])
-                    label_total_time[cut_label] = label_total_time.get(cut_label, datetime.timedelta()) + dura
-                    writer.writerow([start_frame_index, cut_label, dura, modality_num, ", ".join(missing_modality)])
+                    files = [] if skip_videos else ['{}_gopro.mp4'.format(start_frame_index), '{}_gopro_audio.wav'.format(start_frame_index), '{}_pupil.mp4'.format(start_frame_index)]
+                    if output_format == 'npy':
+                        files += ['{}_{}.npy'.format(start_frame_index, m) for m in SENSOR_MODALITIES if m not in missing_modality]
+                        if 'np_artifact' in streams and 'np' not in missing_modality:
+                            files.append('{}_np_artifact.npy'.format(start_frame_index))
+                    pending_events.append((start_frame_index, cut_label, dura, modality_num, missing_modality, video_jobs, input_hash, files))
+                record_finished_events(block=False)
             except Exception as e:
                 greped_index[start_frame_index] = (cut_label, str(e), time_label[start_frame_index])
                 print("Exception:", str(e))
                 # raise Exception(e)
-            finally:
-                temp_index += 1
+            event_stats[str(start_frame_index)] = {'missing': {modality: cnt - missing_before.get(modality, 0) for modality, cnt in label_missing_cnt.items()
+                                                              if cnt != missing_before.get(modality, 0)}}
+
+        ## wait for the remaining video jobs and record the events in event order
+        with measure(metrics, 'wait_video_jobs'):
+            record_finished_events(block=True)
+
+    ## statistics of the events of this run, to carry them over in later runs on a subset of events
+    for index, stats in event_stats.items():
+        if 'row' not in stats:
+            stats['row'] = stats_rows.get(int(index))
+            stats['grep'] = greped_index[int(index)][1] if int(index) in greped_index else None
+    manifest['stats'] = event_stats
+
+    ## drop files of events that are no longer produced, e.g. after a label was removed or became invalid
+    for index in set(manifest['events']) - recorded_events:
+        for name in manifest['events'].pop(index)['files']:
+            if os.path.exists(save_syncronized_splt_folder + name):
+                os.remove(save_syncronized_splt_folder + name)
+    save_manifest(save_syncronized_splt_folder, manifest)
 
-    assert (temp_index == num_of_label or label[temp_index] == "Walk End"), f"Unexpected exit: temp_index={temp_index}"
-    for i in range(temp_index, num_of_label):
-        greped_index[i] = (func_extract_label(i), "Event after Walk End", time_label[i])
     ''''''''''''''''''''''''''''''''''''''''''''''''''''''
 
 
@@ -687,9 +775,9 @@ for walk in walks:
         # Write the header row
         writer.writerow(['Index', 'Label', 'Grep Reason', 'Time Label'])
         # Write the dictionary entries
-        for index, value in greped_index.items():
-            i_label, reason, time_label = value
-            writer.writerow([index, i_label, reason, time_label])
+        for index, value in sorted(greped_index.items()):
+            i_label, reason, i_time_label = value
+            writer.writerow([index, i_label, reason, i_time_label])
     print(f"Greped label has been saved to {file_greped}")
 
     print("Writing counts of label......")
@@ -702,4 +790,37 @@ for walk in walks:
             writer.writerow([i_label, cnt])
     print(f"Counts of missing labels have been saved to {file_miss}")
 
-    ''''''''''''''''''''''''''''''''''''''''''''''''''''''
\ No newline at end of file
+    ''''''''''''''''''''''''''''''''''''''''''''''''''''''
+
+    if metrics is not None:
+        metrics.save(save_syncronized_splt_folder, subject=subject, walk=walk, params=sync_params)
+        stage_metrics = None
+
+    return label_missing_cnt, label_total_time
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Synchronize sensor data with NTP timestamps and split them into events.")
+    parser.add_argument("--subject", type=int, default=subject, help="Subject number (default: %(default)s).")
+    parser.add_argument("--walks", type=int, nargs='+', default=walks, help="Walk numbers (default: %(default)s).")
+    parser.add_argument("--workers", type=int, default=1, help="Number of processes encoding video and audio clips (default: 1).")
+    parser.add_argument("--video-cut-mode", choices=["reencode", "stream_copy"], default=video_cut_mode, help="How event video clips are cut.")
+    parser.add_argument("--gps-bucket-width", type=float, default=gps_bucket_width, help="GPS samples in the same bucket of this width (second) are averaged (default: %(default)s).")
+    parser.add_argument("--no-cache", action="store_true", help="Re-parse the phone and Xsens csv files instead of using the stream cache.")
+    parser.add_argument("--output-format", choices=["npy", "hdf5"], default=output_format, help="Layout of the sensor windows (default: %(default)s).")
+    parser.add_argument("--mmap", action="store_true", help="Memory-map the neural pace, Xsens and cached phone streams.")
+    parser.add_argument("--metrics", action="store_true", help="Record time, I/O and peak memory per stage into metrics.csv/.json next to index_stats.csv.")
+    parser.add_argument("--calibrate-videos", action="store_true", help="Pick the video fps and sync column of every walk from its timestamps, or skip its videos.")
+    parser.add_argument("--audio-source", choices=["video", "buffer"], default=audio_source, help="Decode event audio from the video, or slice a per-walk PCM buffer (default: %(default)s).")
+    parser.add_argument("--np-source", choices=["raw", "clean"], default=np_source, help="Slice the raw neural pace signal or the output of np_cleaning.py (default: %(default)s).")
+    parser.add_argument("--audio-sample-rate", type=int, default=audio_sample_rate, help="Sample rate of the event wav files with --audio-source buffer (default: %(default)s).")
+    parser.add_argument("--merge-successive", action="store_true", help="Merge successive rows of the same instant label (e.g. Doorway) into one event.")
+    args = parser.parse_args()
+
+    for walk in args.walks:
+        synchronize_walk(args.subject, walk, workers=args.workers, video_cut_mode=args.video_cut_mode,
+                         gps_bucket_width=args.gps_bucket_width, use_cache=not args.no_cache,
+                         use_mmap=args.mmap, output_format=args.output_format,
+                         metrics=StageMetrics() if args.metrics else None, calibrate=args.calibrate_videos or calibrate_videos,
+                         audio_source=args.audio_source, audio_sample_rate=args.audio_sample_rate, np_source=args.np_source,
+                         merge_successive=args.merge_successive or merge_successive_events)
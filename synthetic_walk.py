@@ -0,0 +1,191 @@
+import argparse
+import os
+import subprocess
+
+import numpy as np
+import pandas as pd
+import scipy.io
+
+from ntp_time import MATLAB_UNIX_EPOCH_DATENUM, format_time_ns
+from pipeline_config import interested_labels
+from video_cut import FFMPEG_BINARY
+
+# Sample frequency of every generated stream (Hz)
+SAMPLE_FREQ = {'np': 250, 'xs': 100, 'video': 60, 'acc': 100, 'gyro': 50, 'mag': 50, 'light': 10, 'gps': 3}
+
+# Name pattern of the raw phone exports, as matched by extract_mat_data.move_files
+PHONE_FILES = {'acc': 'accelData_{}.csv', 'gyro': 'gyroData_{}.csv', 'mag': 'magData_{}.csv', 'light': 'ambientData_{}.csv', 'gps': 'gpsData_{}.csv'}
+
+# Columns of the Xsens "Center of Mass" sheet
+XSENS_COM_COLUMNS = ['Frame'] + [f'CoM {q} {a}' for q in ['pos', 'vel', 'acc'] for a in 'xyz']
+
+
+def to_ntp(time_ns):
+    """Epoch nanoseconds to the NTP unit of the RWNApp output (MATLAB datenum in seconds)."""
+    return np.asarray(time_ns, dtype=np.int64) / 1e9 + MATLAB_UNIX_EPOCH_DATENUM * 86400
+
+
+def sample_times(start_ns, duration, freq, rng=None):
+    """
+    Sample times of a stream in epoch nanoseconds, rounded to milliseconds like the NTP strings of the phones.
+    With rng, the samples are jittered to mimic the irregular phone sampling.
+    """
+    num = int(duration * freq)
+    offset = np.arange(num) / freq
+    if rng is not None:
+        offset = np.sort(offset + rng.uniform(0, 1 / freq, num))
+    return start_ns + (np.round(offset * 1e3) * 1e6).astype(np.int64)
+
+
+def generate_events(duration, num_events, rng):
+    """
+    Random event table between "Walk Beg" and "Walk End": instant events, Beg/End pairs, nested long events
+    and a few labels that are not of interest.
+
+    Returns:
+        list: (event, time in second from the start of the walk) sorted by time.
+    """
+    walk_beg, walk_end = 1.0, duration - 1.0
+    events = [('Clapper', 0.5), ('Walk Beg', walk_beg), ('Walk End', walk_end), ('Clapper', duration - 0.5)]
+    instant = ['Doorway', 'Choice Point', 'Pointing']
+    for _ in range(num_events):
+        start = rng.uniform(walk_beg + 0.1, walk_end - 0.2)
+        kind = rng.uniform()
+        if kind < 0.4:
+            events.append((str(rng.choice(instant)), start))
+        elif kind < 0.9:
+            label = str(rng.choice([l for l in interested_labels if l not in instant]))
+            end = min(start + rng.exponential(3 if label != 'New Context' else 20), walk_end - 0.1)
+            events.extend([(f'{label} Beg', start), (f'{label} End', end)])
+        else:
+            events.append(('Notes', start))
+    return sorted(events, key=lambda e: e[1])
+
+
+def write_mat_v73(path, variables):
+    """
+    Write variables as a MATLAB v7.3 (HDF5) .mat file: a 512 byte MATLAB header followed by one transposed
+    dataset per variable, as MATLAB stores column-major arrays. Requires h5py.
+    """
+    import h5py  # optional dependency, only needed for v7.3 files
+    matlab_class = {np.dtype(np.float64): b'double', np.dtype(np.int16): b'int16'}
+    with h5py.File(path, 'w', userblock_size=512) as f:
+        for name, arr in variables.items():
+            f.create_dataset(name, data=arr.T, chunks=True, compression='gzip')
+            f[name].attrs['MATLAB_class'] = matlab_class[arr.dtype]
+    header = b'MATLAB 7.3 MAT-file, Platform: GLNXA64, Created by: synthetic_walk.py HDF5 schema 1.00 .'.ljust(116)
+    with open(path, 'r+b') as f:
+        f.write(header + b'\x00' * 8 + b'\x00\x02' + b'IM')
+
+
+def write_video(path, duration, fps, size, audio):
+    """Encode a test pattern video (with a sine tone if audio) with ffmpeg."""
+    cmd = [FFMPEG_BINARY, '-y', '-v', 'error', '-f', 'lavfi', '-i', f'testsrc=size={size}:rate={fps}:duration={duration}']
+    if audio:
+        cmd += ['-f', 'lavfi', '-i', f'sine=duration={duration}', '-c:a', 'aac', '-shortest']
+    cmd += ['-c:v', 'libx264', '-g', str(fps), '-pix_fmt', 'yuv420p', path]
+    subprocess.run(cmd, check=True)
+
+
+def generate_walk(root, subject=1, walk=1, duration=60.0, num_events=20, video_size='64x48', with_video=True, mat_version='5', seed=0):
+    """
+    Write a synthetic walk in the layout of the raw dataset under root:
+        - mat_RWNApp_Output_Jan2024/RWNApp_RW{subject}_Walk{walk}.mat with d_np, d_xs and ntp_np/ntp_xs/ntp_gp/ntp_pupil
+        - RW{subject}/Original/Walk{walk}/ChestPhone and PupilPhone csv exports (GPS as "Lat:"/"Long:" strings)
+        - RW{subject}/Original/Walk{walk}/Xsens/RW_{subject}_w{walk}.xlsx with a "Center of Mass" sheet
+        - RW{subject}/Synced/Walk{walk}_complete/GoPro/*CleanedAudio.mp4 and Pupil/*.mp4
+        - label_RWNApp_Output_Jan2024/evnts_RWNApp_RW{subject}_Walk{walk}.csv
+
+    Parameters:
+        root (str): Root folder, used as extract_mat_data.data_root.
+        subject (int): Subject number.
+        walk (int): Walk number.
+        duration (float): Length of the walk (second).
+        num_events (int): Number of random events.
+        video_size (str): Resolution of the test videos, e.g. '64x48'.
+        with_video (bool): Encode the test videos. Needs ffmpeg.
+        mat_version (str): '5' (scipy.io.savemat) or '7.3' (HDF5, needs h5py).
+        seed (int): Seed of the random generator.
+    """
+    rng = np.random.default_rng(seed)
+    start_ns = 1683727200 * 10**9 + (subject * 100 + walk) * 3600 * 10**9
+    original_folder = os.path.join(root, f'RW{subject}', 'Original', f'Walk{walk}')
+    synced_folder = os.path.join(root, f'RW{subject}', 'Synced', f'Walk{walk}_complete')
+    mat_folder = os.path.join(root, 'mat_RWNApp_Output_Jan2024')
+    label_folder = os.path.join(root, 'label_RWNApp_Output_Jan2024')
+    for folder in [os.path.join(original_folder, 'ChestPhone'), os.path.join(original_folder, 'PupilPhone'),
+                   os.path.join(original_folder, 'Xsens'), os.path.join(synced_folder, 'GoPro'), os.path.join(synced_folder, 'Pupil'),
+                   mat_folder, label_folder]:
+        os.makedirs(folder, exist_ok=True)
+
+    ## RWNApp .mat: neural pace, xsens and NTP time of both videos
+    time_np = sample_times(start_ns, duration, SAMPLE_FREQ['np'])
+    time_xs = sample_times(start_ns, duration, SAMPLE_FREQ['xs'])
+    time_video = sample_times(start_ns, duration, SAMPLE_FREQ['video'])
+    data_np = rng.normal(0, 200, (len(time_np), 4)).astype(np.int16)
+    spikes = rng.choice(len(time_np), size=max(1, len(time_np) // 5000), replace=False)
+    data_np[spikes] = rng.choice([-1, 1], size=(len(spikes), 4)) * 32000  # large spikes as in the real recordings
+    mat_variables = {
+        'd_np': data_np, 'd_xs': rng.normal(size=(len(time_xs), 3)),
+        'ntp_np': to_ntp(time_np)[:, None], 'ntp_xs': to_ntp(time_xs)[:, None],
+        'ntp_gp': to_ntp(time_video)[:, None], 'ntp_pupil': to_ntp(time_video)[:, None],
+    }
+    mat_path = os.path.join(mat_folder, f'RWNApp_RW{subject}_Walk{walk}.mat')
+    if mat_version == '7.3':
+        write_mat_v73(mat_path, mat_variables)
+    else:
+        scipy.io.savemat(mat_path, mat_variables)
+
+    ## phone csv exports: NTP time string and samples, no header
+    for phone in ['ChestPhone', 'PupilPhone']:
+        for modality, file_name in PHONE_FILES.items():
+            if phone == 'PupilPhone' and modality == 'light':
+                continue
+            time_ns = sample_times(start_ns, duration, SAMPLE_FREQ[modality], rng)
+            if modality == 'gps':
+                df = pd.DataFrame({'time': format_time_ns(time_ns),
+                                   'lat': [f'Lat: {v:.6f}' for v in 34.07 + np.cumsum(rng.normal(0, 1e-5, len(time_ns)))],
+                                   'long': [f'Long: {v:.6f}' for v in -118.44 + np.cumsum(rng.normal(0, 1e-5, len(time_ns)))]})
+            else:
+                df = pd.DataFrame(rng.normal(size=(len(time_ns), 1 if modality == 'light' else 3)))
+                df.insert(0, 'time', format_time_ns(time_ns))
+            df.to_csv(os.path.join(original_folder, phone, file_name.format(walk)), header=False, index=False)
+
+    ## xsens workbook, the "Center of Mass" sheet plus another sheet like the real exports
+    com = pd.DataFrame(rng.normal(size=(len(time_xs), len(XSENS_COM_COLUMNS) - 1)), columns=XSENS_COM_COLUMNS[1:])
+    com.insert(0, 'Frame', np.arange(len(time_xs)))
+    with pd.ExcelWriter(os.path.join(original_folder, 'Xsens', f'RW_{subject}_w{walk}.xlsx')) as writer:
+        com.to_excel(writer, sheet_name='Center of Mass', index=False)
+        com.iloc[:, :4].rename(columns=lambda c: c.replace('CoM pos', 'Pelvis')).to_excel(writer, sheet_name='Joint Angles ZXY', index=False)
+
+    ## videos
+    if with_video:
+        write_video(os.path.join(synced_folder, 'GoPro', f'RW{subject}_Walk{walk}_CleanedAudio.mp4'), duration, SAMPLE_FREQ['video'], video_size, audio=True)
+        write_video(os.path.join(synced_folder, 'Pupil', f'RW{subject}_Walk{walk}_world.mp4'), duration, SAMPLE_FREQ['video'], video_size, audio=False)
+
+    ## events csv
+    rows = []
+    for event, t in generate_events(duration, num_events, rng):
+        event_ns = start_ns + int(round(t * 1e3)) * 10**6
+        rows.append({'Event': event, 'Description': '', 'PupilFrame': int(t * SAMPLE_FREQ['video']), 'GoProFrame': int(t * SAMPLE_FREQ['video']),
+                     'NPSample': int(t * SAMPLE_FREQ['np']), 'NTP': to_ntp(event_ns)})
+    pd.DataFrame(rows).to_csv(os.path.join(label_folder, f'evnts_RWNApp_RW{subject}_Walk{walk}.csv'), index=False)
+    print(f"Generated sub: {subject}, walk: {walk} ({duration} s, {len(rows)} labels) in {root}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic walks in the layout of the raw dataset.")
+    parser.add_argument("--root", required=True, help="Root folder of the synthetic dataset.")
+    parser.add_argument("--subject", type=int, default=1, help="Subject number (default: 1).")
+    parser.add_argument("--walks", type=int, nargs='+', default=[1], help="Walk numbers (default: 1).")
+    parser.add_argument("--duration", type=float, default=60, help="Length of every walk (second).")
+    parser.add_argument("--events", type=int, default=20, help="Number of random events per walk.")
+    parser.add_argument("--video-size", default='64x48', help="Resolution of the test videos.")
+    parser.add_argument("--no-video", action="store_true", help="Do not encode the test videos.")
+    parser.add_argument("--mat-version", choices=['5', '7.3'], default='5', help="Format of the RWNApp .mat file.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random generator.")
+    args = parser.parse_args()
+
+    for walk in args.walks:
+        generate_walk(args.root, args.subject, walk, duration=args.duration, num_events=args.events,
+                      video_size=args.video_size, with_video=not args.no_video, mat_version=args.mat_version, seed=args.seed + walk)
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from event_index import EventIndex, event_dtype
+
+LABELS = ['Stop', 'Doorway', 'Outdoor']
+# sizes around and between powers of two, the implicit tree has nodes past the last event
+SIZES = [0, 1, 2, 3, 5, 7, 8, 9, 13, 31, 32, 33, 100, 257]
+
+
+def random_events(num, seed):
+    """Events with random, partly tied and zero length intervals, in random order."""
+    rng = np.random.default_rng(seed)
+    events = np.zeros(num, dtype=event_dtype('U8'))
+    events['subject'], events['walk'], events['index'] = 1, 1, np.arange(num)
+    events['label'] = [LABELS[i] for i in rng.integers(0, len(LABELS), num)]
+    events['start_ns'] = rng.integers(0, 1000, num)
+    events['end_ns'] = events['start_ns'] + rng.choice([0, 1, 5, 50, 400], num)
+    return events
+
+
+def random_queries(seed, count=60):
+    rng = np.random.default_rng(seed + 1000)
+    start = rng.integers(-50, 1500, count)
+    return list(zip(start.tolist(), (start + rng.integers(0, 300, count)).tolist()))
+
+
+@pytest.mark.parametrize('num', SIZES)
+@pytest.mark.parametrize('labels', [None, 'Stop', ['Doorway', 'Outdoor']])
+def test_queries_match_brute_force(num, labels):
+    index = EventIndex(random_events(num, num))
+    subset = index.select(labels).events
+    start, end = subset['start_ns'], subset['end_ns']
+    for query_start, query_end in random_queries(num):
+        overlap = index.overlap(query_start, query_end, labels)
+        assert np.array_equal(overlap, subset[(start < query_end) & (query_start < end)])
+
+        within = index.within(query_start, query_end, labels)
+        assert np.array_equal(within, subset[(start >= query_start) & (end <= query_end)])
+
+        containing = index.containing(query_start, labels=labels)
+        assert np.array_equal(containing, subset[(start <= query_start) & (query_start < end)])
+        containing = index.containing(query_start, query_end, labels)
+        assert np.array_equal(containing, subset[(start <= query_start) & (query_start < end) & (end >= query_end)])
+
+        nearest = index.nearest(query_start, labels)
+        if len(subset) == 0:
+            assert len(nearest) == 0
+            continue
+        distance = np.where((start <= query_start) & (query_start < end), 0,
+                            np.where(end <= query_start, query_start - end, start - query_start))
+        assert len(nearest) == 1
+        found = nearest[0]
+        found_distance = 0 if found['start_ns'] <= query_start < found['end_ns'] else \
+            (query_start - found['end_ns'] if found['end_ns'] <= query_start else found['start_ns'] - query_start)
+        assert found_distance == distance.min()
+        if distance.min() == 0:
+            # the first containing event in start order
+            assert found == subset[distance == 0][0]
+
+
+def test_events_sorted_by_start():
+    index = EventIndex(random_events(100, 0))
+    assert np.all(np.diff(index.events['start_ns']) >= 0)
+    assert len(index) == 100
+
+
+def test_empty_index():
+    index = EventIndex(np.zeros(0, dtype=event_dtype()))
+    assert len(index.overlap(0, 10)) == 0
+    assert len(index.within(0, 10)) == 0
+    assert len(index.containing(5)) == 0
+    assert len(index.nearest(5)) == 0
+    assert len(index.inside('Outdoor', 'Stop')) == 0
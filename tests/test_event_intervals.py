@@ -0,0 +1,100 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from ntp_time import matlab_datenum_to_datetime64
+from event_intervals import REASON_AFTER_WALK, REASON_BEFORE_WALK, REASON_END_MISSING, REASON_NOT_INTERESTED, build_intervals, events_of
+
+INTERESTED = ["Doorway", "Talking", "Correct Turn", "Incorrect Turn", "Lost", "Stop", "Abnormal", "Pointing", "Outdoor", "Choice Point", "Stare", "New Context"]
+FIXTURE = os.path.join(os.path.dirname(__file__), 'data', 'evnts_fixture.csv')
+
+
+def baseline_pairing(names, interested):
+    """
+    The forward scan of the original synchronize.py main loop.
+
+    Returns:
+        tuple[list, dict]: [(start row, end row, label)] of the events and {row: grep reason} of the other rows.
+    """
+    cut = lambda name: name[:-4] if name.endswith("Beg") or name.endswith("End") else name
+    num = len(names)
+    events, greped = [], {}
+    row = 0
+    while names[row] != "Walk Beg":
+        greped[row] = REASON_BEFORE_WALK
+        row += 1
+    row += 1
+    while row < num and names[row] != "Walk End":
+        if not names[row].endswith("End"):
+            label = cut(names[row])
+            end = row + 1
+            if label not in interested:
+                greped[row] = REASON_NOT_INTERESTED
+            else:
+                if names[row].endswith("Beg"):
+                    while end < num and not (names[end].endswith("End") and cut(names[end]) == label):
+                        end += 1
+                # the original loop failed on the label time of a missing end row
+                if end >= num:
+                    greped[row] = REASON_END_MISSING
+                else:
+                    events.append((row, end, label))
+        row += 1
+    for i in range(row, num):
+        greped[i] = REASON_AFTER_WALK
+    return events, greped
+
+
+def assert_matches_baseline(names):
+    intervals = build_intervals(pd.DataFrame({'Event': names}), INTERESTED)
+    events, greped = baseline_pairing(names, INTERESTED)
+    assert [(int(i['index']), int(i['end_index']), str(i['label'])) for i in events_of(intervals)] == events
+    reasons = {int(i['index']): str(i['reason']) for i in intervals if i['reason']}
+    assert reasons.keys() == greped.keys()
+    for row, reason in greped.items():
+        assert reasons[row].startswith(reason)
+
+
+def test_fixture_matches_baseline():
+    assert_matches_baseline(list(pd.read_csv(FIXTURE)['Event']))
+
+
+def test_fixture_columns():
+    df = pd.read_csv(FIXTURE)
+    intervals = events_of(build_intervals(df, INTERESTED, frame_column='PupilFrame'))
+    start, end = intervals['index'], intervals['end_index']
+    assert np.array_equal(intervals['start_frame'], df['PupilFrame'].to_numpy()[start])
+    assert np.array_equal(intervals['end_frame'], df['PupilFrame'].to_numpy()[end])
+    assert np.array_equal(intervals['start_np'], df['NPSample'].to_numpy()[start])
+    assert np.array_equal(intervals['end_np'], df['NPSample'].to_numpy()[end])
+    time_ns = matlab_datenum_to_datetime64(df['NTP']/60/60/24).astype(np.int64)
+    assert np.array_equal(intervals['start_ns'], time_ns[start]) and np.array_equal(intervals['end_ns'], time_ns[end])
+
+
+def test_fixture_nesting_depth():
+    intervals = events_of(build_intervals(pd.read_csv(FIXTURE), INTERESTED))
+    depth = dict(zip(intervals['index'].tolist(), intervals['depth'].tolist()))
+    # Stop Beg and Doorway inside Outdoor, Choice Point inside Outdoor and both Talking
+    assert depth[3] == 0 and depth[4] == 1 and depth[6] == 1 and depth[11] == 3
+
+
+def test_merge_successive():
+    names = list(pd.read_csv(FIXTURE)['Event'])
+    events = events_of(build_intervals(pd.DataFrame({'Event': names}), INTERESTED, merge_successive=True))
+    pairs = [(int(i['index']), int(i['end_index']), str(i['label'])) for i in events]
+    assert (6, 9, 'Doorway') in pairs and (20, 22, 'Correct Turn') in pairs
+    assert not any(start in (7, 8, 21) for start, _, _ in pairs)
+    # runs of Beg rows are not merged
+    assert (9, 12, 'Talking') in pairs and (10, 12, 'Talking') in pairs
+
+
+@pytest.mark.parametrize('seed', range(50))
+def test_random_labels_match_baseline(seed):
+    rng = np.random.default_rng(seed)
+    options = ["Doorway", "Stop Beg", "Stop End", "Outdoor Beg", "Outdoor End", "Talking Beg", "Talking End", "Lost", "Foo", "Bar Beg", "Bar End"]
+    body = [options[i] for i in rng.integers(0, len(options), rng.integers(0, 40))]
+    before = [options[i] for i in rng.integers(0, len(options), rng.integers(0, 3))]
+    after = ["Walk End"] + [options[i] for i in rng.integers(0, len(options), rng.integers(0, 3))] if rng.random() < 0.8 else []
+    assert_matches_baseline(before + ["Walk Beg"] + body + after)
@@ -0,0 +1,47 @@
+import os
+
+import numpy as np
+import pytest
+
+h5py = pytest.importorskip('h5py')
+
+from event_reader import EventReader
+from walk_container import CONTAINER_NAME, WalkContainerWriter
+
+
+def write_walk(root, subject, walk, num_events):
+    folder = os.path.join(root, f'RW{subject}', f'RW{subject}-Walk{walk}-self-syncronize-split')
+    os.makedirs(folder)
+    with open(os.path.join(folder, 'index_stats.csv'), 'w') as f:
+        f.write("Index,Label,Duration,Num of Modalities,Missing Modalities\n")
+        for index in range(num_events):
+            f.write(f'{index},Doorway,0:00:01,2,"{"chestphone_acc" if index % 4 == 3 else ""}"\n')
+    with WalkContainerWriter(os.path.join(folder, CONTAINER_NAME)) as writer:
+        for index in range(num_events):
+            writer.write(index, 'np', np.full((index + 1, 4), subject * 1000 + walk * 100 + index, dtype=np.float32))
+            if index % 4 != 3:
+                writer.write(index, 'chestphone_acc', np.full((3, 3), index, dtype=np.float32))
+
+
+def test_iter_events_reads_container(tmp_path):
+    write_walk(str(tmp_path), 1, 1, 30)
+    write_walk(str(tmp_path), 1, 2, 7)
+    reader = EventReader(root=str(tmp_path), cache_size=8, prefetch=4, workers=4)
+    try:
+        keys = []
+        for (subject, walk, index), sample in reader.iter_events(modalities=['np', 'chestphone_acc'], walks=[(1, 1), (1, 2)]):
+            keys.append((subject, walk, index))
+            assert np.all(sample['np'] == subject * 1000 + walk * 100 + index) and len(sample['np']) == index + 1
+            assert sample['missing'] == (['chestphone_acc'] if index % 4 == 3 else [])
+        assert keys == [(1, 1, i) for i in range(30)] + [(1, 2, i) for i in range(7)]
+    finally:
+        reader.close()
+
+
+def test_iter_events_needs_keys_or_walks(tmp_path):
+    reader = EventReader(root=str(tmp_path))
+    try:
+        with pytest.raises(ValueError):
+            next(reader.iter_events())
+    finally:
+        reader.close()
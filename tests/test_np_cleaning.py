@@ -0,0 +1,16 @@
+import numpy as np
+
+from np_cleaning import clean_chunk, robust_stats
+
+
+def test_non_finite_samples_do_not_disable_spike_removal():
+    rng = np.random.default_rng(0)
+    x = rng.normal(size=(5000, 2))
+    x[100, 0], x[200, 1], x[300, 0] = np.nan, np.inf, 50.0
+    median, scale = robust_stats(x)
+    assert np.all(np.isfinite(median)) and np.all(np.isfinite(scale))
+
+    cleaned, mask = clean_chunk(x, median, scale)
+    assert mask[100, 0] and mask[200, 1] and mask[300, 0]
+    assert np.all(np.isfinite(cleaned))
+    assert abs(cleaned[300, 0]) < 5
@@ -0,0 +1,22 @@
+import numpy as np
+
+from ntp_time import MATLAB_UNIX_EPOCH_DATENUM, load_time_array
+
+# 2023-05-10 14:00:00.250 and one second later
+TIME_NS = np.datetime64('2023-05-10T14:00:00.250', 'ns').astype(np.int64) + np.array([0, 1_000_000_000])
+
+
+def test_int_and_string_arrays(tmp_path):
+    np.save(tmp_path / 'int.npy', TIME_NS)
+    np.save(tmp_path / 'str.npy', np.array(['2023-05-10_14-00-00-250', '2023-05-10_14-00-01-250']))
+    assert np.array_equal(load_time_array(tmp_path / 'int.npy'), TIME_NS)
+    assert np.array_equal(load_time_array(tmp_path / 'str.npy'), TIME_NS)
+
+
+def test_float_arrays(tmp_path):
+    datenum_days = TIME_NS / 86400e9 + MATLAB_UNIX_EPOCH_DATENUM
+    formats = {'days': datenum_days, 'datenum_seconds': datenum_days * 86400, 'epoch_seconds': TIME_NS / 1e9}
+    for name, values in formats.items():
+        np.save(tmp_path / f'{name}.npy', values)
+        # datenums are truncated to milliseconds like extract_mat_data does, the float error can cost one
+        assert np.all(np.abs(load_time_array(tmp_path / f'{name}.npy') - TIME_NS) <= 1_000_000), name
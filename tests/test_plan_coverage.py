@@ -0,0 +1,38 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from plan_coverage import plan_bounds, plan_walk
+
+
+def write_walk(root, np_samples):
+    """Events csv, NP and GoPro timestamps of walk RW1-Walk1 under root, with one NPSample per label row."""
+    os.makedirs(root / 'RW1' / 'RW1-Walk1-extracted')
+    os.makedirs(root / 'label_RWNApp_Output_Jan2024')
+    os.makedirs(root / 'run')
+    names = ['Walk Beg', 'Doorway', 'Stop Beg', 'Stop End', 'Talking Beg', 'Talking End', 'Walk End']
+    pd.DataFrame({'Event': names, 'PupilFrame': 60 * np.arange(1, 8), 'GoProFrame': 60 * np.arange(1, 8), 'NPSample': np_samples,
+                  'NTP': 63851032801.0 + np.arange(7)}).to_csv(root / 'label_RWNApp_Output_Jan2024' / 'evnts_RWNApp_RW1_Walk1.csv', index=False)
+    start_ns = np.datetime64('2023-05-10T14:00:00', 'ns').astype(np.int64)
+    folder = root / 'RW1' / 'RW1-Walk1-extracted'
+    np.save(folder / 'time_np.npy', start_ns + np.arange(250 * 10) * 4_000_000)
+    np.save(folder / 'time_gopro.npy', start_ns + np.arange(60 * 10) * 16_666_667)
+    open(folder / 'data_video_gopro.mp4', 'wb').close()
+
+
+def test_plan_bounds_expands_empty_window():
+    assert [int(f[0]) for f in plan_bounds([1000], [1000], 2500, 3, 250)] == [625, 1375]
+
+
+def test_np_missing_before_expansion(tmp_path, monkeypatch):
+    # Stop has an empty and Talking a reversed NPSample span, both are expanded to a non-empty window
+    write_walk(tmp_path, [250, 500, 750, 750, 1250, 1000, 1750])
+    monkeypatch.chdir(tmp_path / 'run')
+    plan, _ = plan_walk(1, 1, use_cache=False)
+    plan = plan.set_index('Label')
+    assert plan.loc['Doorway', 'Extract'] and plan.loc['Doorway', 'np Start'] >= 0
+    for label in ['Stop', 'Talking']:
+        assert not plan.loc[label, 'Extract']
+        assert plan.loc[label, 'np Start'] == -1 and plan.loc[label, 'np End'] == -1
+        assert plan.loc[label, 'gopro Start'] >= 0
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+h5py = pytest.importorskip('h5py')
+
+from walk_container import CONTAINER_NAME, WalkContainerWriter, load_offsets, read_window
+
+
+def test_windows_round_trip(tmp_path):
+    rng = np.random.default_rng(0)
+    windows = {(index, modality): rng.normal(size=(int(rng.integers(1, 50)), 3)).astype(np.float32)
+               for index in range(20) for modality in ['np', 'chestphone_acc']}
+    with WalkContainerWriter(str(tmp_path / CONTAINER_NAME), chunk_rows=16) as writer:
+        for (index, modality), arr in windows.items():
+            writer.write(index, modality, arr)
+
+    with h5py.File(tmp_path / CONTAINER_NAME, 'r') as f:
+        offsets = load_offsets(f)
+        assert len(offsets) == len(windows)
+        for (index, modality), arr in windows.items():
+            assert np.array_equal(read_window(f, index, modality, offsets), arr)
+        assert read_window(f, 20, 'np', offsets) is None
+        assert read_window(f, 3, 'xs_CoM') is None
+
+
+def test_keep_events_copies_previous_windows(tmp_path):
+    path = str(tmp_path / CONTAINER_NAME)
+    with WalkContainerWriter(path) as writer:
+        for index in range(5):
+            writer.write(index, 'np', np.full((index + 1, 2), index))
+    with WalkContainerWriter(path, keep_events={1, 3}) as writer:
+        writer.write(2, 'np', np.zeros((7, 2)))
+
+    with h5py.File(path, 'r') as f:
+        offsets = load_offsets(f)
+        assert sorted(offsets) == [(1, 'np'), (2, 'np'), (3, 'np')]
+        assert np.array_equal(read_window(f, 3, 'np', offsets), np.full((4, 2), 3))
+        assert read_window(f, 2, 'np', offsets).shape == (7, 2)
@@ -0,0 +1,142 @@
+import argparse
+import csv
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from ntp_time import matlab_datenum_to_datetime64, load_time_array
+from pipeline_config import parse_index_set, summary_folder
+from video_cut import probe_video
+
+# Frame rates tried for the frame columns of the events csv, in the order of the processing records
+CANDIDATE_FPS = [60, 30, 120]
+# Frame columns of the events csv and the timestamps of the frames they index
+SYNC_COLUMNS = {'GoProFrame': 'gopro', 'PupilFrame': 'pupil'}
+# Largest median distance (second) between a label and the video time its frame is cut at
+calibration_tolerance = 0.5
+# Written to the self-syncronize-split folder of every calibrated walk
+CALIBRATION_NAME = 'video_calibration.json'
+
+
+def fit_candidate(frame, time_label_ns, time_start_ns, fps, durations):
+    """
+    Check how well frame / fps reproduces the label times in the video timeline.
+
+    Parameters:
+        frame (NDArray): Frame column of the label rows.
+        time_label_ns (NDArray): Label times (epoch nanoseconds).
+        time_start_ns (int): Time of frame 0 of the column (epoch nanoseconds).
+        fps (float): Candidate frame rate of the column.
+        durations (dict): {video: duration in seconds} of the videos cut with the column.
+
+    Returns:
+        dict: 'Error' (median absolute difference between frame / fps and the label time since frame 0, second) and
+            'Beyond Video' (number of label rows whose frame / fps is past the end of the shortest video).
+    """
+    elapsed = (time_label_ns - time_start_ns) / 1e9
+    residual = frame / fps - elapsed
+    shortest = min(durations.values()) if durations else np.inf
+    return {'Error': float(np.median(np.abs(residual))), 'Beyond Video': int(np.sum(frame / fps > shortest + 1 / fps))}
+
+
+def calibrate_walk(subject, walk, candidate_fps=CANDIDATE_FPS, tolerance=calibration_tolerance):
+    """
+    Pick fps_for_frame and video_sync_modality_frame of a walk from the events csv, time_gopro, time_pupil and the
+    headers of both videos, before any frame is decoded.
+
+    Every frame column is checked against its own timestamps (time_gopro[GoProFrame] should be the label time)
+    and, for every candidate fps, frame / fps is compared with the label time since frame 0 of the column. A
+    candidate is consistent if the median difference is within tolerance and no label falls past the end of
+    either video. The consistent candidate with the smallest difference wins; without one, the videos of the
+    walk should be skipped.
+
+    Parameters:
+        subject (int): Subject number.
+        walk (int): Walk number.
+        candidate_fps (list[float]): Frame rates tried for the frame columns.
+        tolerance (float): Largest accepted median difference (second).
+
+    Returns:
+        dict: 'fps_for_frame', 'video_sync_modality_frame', 'skip_videos', 'videos' ({video: duration, frames, fps and
+            timestamp span}) and 'candidates' (one dict per column and fps with the fit results).
+    """
+    load_syncronized_folder = f'../RW{subject}/RW{subject}-Walk{walk}-extracted/'
+    df = pd.read_csv(f'../label_RWNApp_Output_Jan2024/evnts_RWNApp_RW{subject}_Walk{walk}.csv')
+    time_label_ns = matlab_datenum_to_datetime64(df['NTP']/60/60/24).astype(np.int64)
+
+    ## video headers and timestamps, both videos are cut with the same column
+    videos, times = {}, {}
+    for video in SYNC_COLUMNS.values():
+        video_path = load_syncronized_folder + f'data_video_{video}.mp4'
+        time_path = load_syncronized_folder + f'time_{video}.npy'
+        if os.path.exists(time_path):
+            times[video] = load_time_array(time_path)
+        if os.path.exists(video_path):
+            duration, num_frames, fps, _ = probe_video(video_path)
+            videos[video] = {'Duration': duration, 'Frames': num_frames, 'Video fps': fps,
+                             'Timestamps': len(times[video]) if video in times else 0,
+                             'Timestamp Span': (times[video][-1] - times[video][0]) / 1e9 if video in times and len(times[video]) else 0.0}
+    durations = {video: info['Duration'] for video, info in videos.items()}
+
+    candidates = []
+    for column, video in SYNC_COLUMNS.items():
+        if column not in df or video not in times or len(times[video]) == 0 or len(videos) < len(SYNC_COLUMNS):
+            continue
+        frame = df[column].to_numpy(dtype=np.float64)
+        valid = np.isfinite(frame) & (frame > 0)
+        frame, label_ns = frame[valid], time_label_ns[valid]
+        if len(frame) < 2:
+            continue
+        ## the column against its own timestamps, and the rate the frames advance at per label second
+        in_range = frame < len(times[video])
+        index_error = float(np.median(np.abs(times[video][frame[in_range].astype(np.int64)] - label_ns[in_range]) / 1e9)) if in_range.any() else np.inf
+        fitted_fps = float(np.polyfit((label_ns - label_ns[0]) / 1e9, frame, 1)[0])
+        for fps in candidate_fps:
+            fit = fit_candidate(frame, label_ns, times[video][0], fps, durations)
+            candidates.append({'Column': column, 'fps': fps, 'Fitted fps': round(fitted_fps, 3),
+                               'Timestamp Error': round(index_error, 6), 'Error': round(fit['Error'], 6), 'Beyond Video': fit['Beyond Video'],
+                               'Consistent': fit['Error'] <= tolerance and fit['Beyond Video'] == 0})
+
+    consistent = [c for c in candidates if c['Consistent']]
+    best = min(consistent, key=lambda c: c['Error']) if consistent else None
+    return {'fps_for_frame': best['fps'] if best else None, 'video_sync_modality_frame': best['Column'] if best else None,
+            'skip_videos': best is None, 'videos': videos, 'candidates': candidates}
+
+
+def save_calibration(save_folder, calibration):
+    with open(os.path.join(save_folder, CALIBRATION_NAME), 'w') as f:
+        json.dump(calibration, f, indent=1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pick the video frame rate and sync column of walks from timestamps and video headers only.")
+    parser.add_argument("--subjects", nargs='+', required=True, help="Subjects to calibrate, e.g. 1 2 or 1-3.")
+    parser.add_argument("--walks", nargs='+', required=True, help="Walks to calibrate for every subject, e.g. 1-7 or 1,3,4.")
+    parser.add_argument("--fps", type=float, nargs='+', default=CANDIDATE_FPS, help="Candidate frame rates (default: %(default)s).")
+    parser.add_argument("--tolerance", type=float, default=calibration_tolerance, help="Largest median difference to the label times (second, default: %(default)s).")
+    parser.add_argument("--summary-folder", default=summary_folder, help="Folder of video_calibration.csv.")
+    args = parser.parse_args()
+
+    rows = []
+    for subject in parse_index_set(args.subjects):
+        for walk in parse_index_set(args.walks):
+            try:
+                calibration = calibrate_walk(subject, walk, candidate_fps=args.fps, tolerance=args.tolerance)
+            except FileNotFoundError as e:
+                print(f"Skip sub: {subject}, walk: {walk}:", str(e))
+                continue
+            for candidate in calibration['candidates']:
+                rows.append({'Subject': subject, 'Walk': walk, **candidate})
+            choice = "skip videos" if calibration['skip_videos'] else f"{calibration['video_sync_modality_frame']} with fps={calibration['fps_for_frame']}"
+            print(f"sub: {subject}, walk: {walk}: {choice}")
+
+    if not os.path.exists(args.summary_folder):
+        os.makedirs(args.summary_folder)
+    file_calibration = os.path.join(args.summary_folder, "video_calibration.csv")
+    with open(file_calibration, mode='w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=['Subject', 'Walk', 'Column', 'fps', 'Fitted fps', 'Timestamp Error', 'Error', 'Beyond Video', 'Consistent'])
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f"Calibration of all walks has been saved to {file_calibration}")
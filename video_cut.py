@@ -0,0 +1,359 @@
+import json
+import re
+import struct
+import numpy as np
+from numpy.typing import NDArray
+import os
+import shutil
+import subprocess
+import tempfile
+
+
+def find_ffmpeg():
+    """
+    The ffmpeg build moviepy uses: FFMPEG_BINARY if set, otherwise the binary shipped with imageio-ffmpeg
+    (installed with moviepy), so every cutting mode works wherever the reencode mode does.
+    """
+    binary = os.environ.get("FFMPEG_BINARY", "ffmpeg-imageio")
+    if binary == "auto-detect" and shutil.which("ffmpeg"):
+        return "ffmpeg"
+    if binary in ("ffmpeg-imageio", "auto-detect"):
+        try:
+            import imageio_ffmpeg  # dependency of moviepy
+            return imageio_ffmpeg.get_ffmpeg_exe()
+        except ImportError:
+            return "ffmpeg"
+    return binary
+
+
+def find_ffprobe(ffmpeg_binary):
+    """FFPROBE_BINARY if set, otherwise ffprobe next to ffmpeg_binary or on the PATH. None if there is none."""
+    if "FFPROBE_BINARY" in os.environ:
+        return os.environ["FFPROBE_BINARY"]
+    sibling = os.path.join(os.path.dirname(ffmpeg_binary), "ffprobe")
+    if os.path.dirname(ffmpeg_binary) and os.path.isfile(sibling):
+        return sibling
+    return shutil.which("ffprobe")
+
+
+# libx264 profile of every H.264 profile name reported by ffprobe and ffmpeg, for re-encoding the edges of a stream copy cut
+X264_PROFILES = {'Constrained Baseline': 'baseline', 'Baseline': 'baseline', 'Main': 'main', 'High': 'high',
+                 'High 10': 'high10', 'High 4:2:2': 'high422', 'High 4:4:4 Predictive': 'high444'}
+
+# Same environment variables and fallback as moviepy, so all cutting modes use the same ffmpeg build.
+# Without ffprobe (imageio-ffmpeg ships ffmpeg only), the headers are read with ffmpeg instead.
+FFMPEG_BINARY = find_ffmpeg()
+FFPROBE_BINARY = find_ffprobe(FFMPEG_BINARY)
+# Debugging only: decode every stream copy cut completely and probe its re-encoded edges before keeping it
+STREAM_COPY_VERIFY = os.environ.get("STREAM_COPY_VERIFY", "0") == "1"
+
+
+def _run(cmd):
+    subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+
+def build_keyframe_index(video_path):
+    """
+    Read the keyframe times, frame times and the duration of a video from its packet headers, without
+    decoding any frame.
+
+    Parameters:
+        video_path (str): Path to the input video file.
+
+    Returns:
+        tuple[NDArray, NDArray, float]: Sorted keyframe times and frame times in seconds, and the duration of
+            the video in seconds.
+    """
+    if not os.path.isfile(video_path):
+        raise FileNotFoundError(f"Video file not found at {video_path}")
+    if FFPROBE_BINARY is None:
+        return _ffmpeg_keyframe_index(video_path)
+
+    out = subprocess.run([FFPROBE_BINARY, "-v", "error", "-select_streams", "v:0",
+                          "-show_entries", "packet=pts_time,flags", "-of", "csv=p=0", video_path],
+                         check=True, capture_output=True, text=True).stdout
+    keyframes = []
+    frames = []
+    for line in out.splitlines():
+        pts_time, _, flags = line.partition(",")
+        if pts_time in ("", "N/A"):
+            continue
+        frames.append(float(pts_time))
+        if "K" in flags:
+            keyframes.append(float(pts_time))
+
+    out = subprocess.run([FFPROBE_BINARY, "-v", "error", "-show_entries", "format=duration",
+                          "-of", "csv=p=0", video_path],
+                         check=True, capture_output=True, text=True).stdout
+    duration = float(out.strip())
+
+    return np.unique(np.array(keyframes, dtype=np.float64)), np.sort(np.array(frames, dtype=np.float64)), duration
+
+
+def _ffmpeg_keyframe_index(video_path):
+    # The framecrc muxer lists every copied packet with its pts; ", F=0x.." follows packets whose flags are not
+    # exactly the keyframe flag. -copyts keeps the stream timestamps as ffprobe reports them.
+    out = subprocess.run([FFMPEG_BINARY, "-v", "error", "-copyts", "-i", video_path, "-map", "0:v:0", "-c", "copy", "-f", "framecrc", "-"],
+                         check=True, capture_output=True, text=True).stdout
+    time_base = 1.0
+    keyframes = []
+    frames = []
+    for line in out.splitlines():
+        if line.startswith("#tb 0:"):
+            num, den = line.split(":")[1].strip().split("/")
+            time_base = float(num) / float(den)
+        elif line and not line.startswith("#"):
+            fields = [field.strip() for field in line.split(",")]
+            flags = int(fields[6][2:], 16) if len(fields) > 6 and fields[6].startswith("F=") else 1
+            frames.append(int(fields[2]) * time_base)
+            if flags & 1:
+                keyframes.append(frames[-1])
+    duration = probe_video(video_path)[0]
+    return np.unique(np.array(keyframes, dtype=np.float64)), np.sort(np.array(frames, dtype=np.float64)), duration
+
+
+def probe_video(video_path):
+    """
+    Read the duration, frame count, frame rate and size of the first video stream from the container headers,
+    without decoding any frame. Uses ffprobe, or the header summary printed by ffmpeg (as moviepy does)
+    if ffprobe is not installed.
+
+    Parameters:
+        video_path (str): Path to the video file.
+
+    Returns:
+        tuple[float, int, float, tuple]: Duration in seconds, number of frames, frames per second and (width, height).
+    """
+    if not os.path.isfile(video_path):
+        raise FileNotFoundError(f"Video file not found at {video_path}")
+    if FFPROBE_BINARY is None:
+        from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+        infos = ffmpeg_parse_infos(video_path)
+        return infos['duration'], infos['video_nframes'], infos['video_fps'], tuple(infos['video_size'])
+    out = subprocess.run([FFPROBE_BINARY, "-v", "error", "-select_streams", "v:0",
+                          "-show_entries", "stream=nb_frames,avg_frame_rate,width,height:format=duration", "-of", "json", video_path],
+                         check=True, capture_output=True, text=True).stdout
+
+    info = json.loads(out)
+    stream = info['streams'][0]
+    num, den = stream['avg_frame_rate'].split('/')
+    fps = float(num) / float(den) if float(den) else 0.0
+    duration = float(info['format']['duration'])
+    num_frames = int(stream['nb_frames']) if stream.get('nb_frames', 'N/A') != 'N/A' else int(round(duration * fps))
+    return duration, num_frames, fps, (int(stream['width']), int(stream['height']))
+
+
+def video_stream_params(video_path):
+    """
+    Codec, profile, level, pixel format, size and time scale of the first video stream, from the headers. These must
+    match between the copied GOPs and the re-encoded edges of a stream copy cut.
+
+    Returns:
+        dict: 'codec', 'profile', 'level' (e.g. 40 for 4.0, None if unknown), 'pix_fmt', 'size' and 'timescale'.
+    """
+    if FFPROBE_BINARY is not None:
+        out = subprocess.run([FFPROBE_BINARY, "-v", "error", "-select_streams", "v:0", "-show_entries",
+                              "stream=codec_name,profile,level,pix_fmt,width,height,time_base", "-of", "json", video_path],
+                             check=True, capture_output=True, text=True).stdout
+        stream = json.loads(out)['streams'][0]
+        level = stream.get('level')
+        return {'codec': stream['codec_name'], 'profile': stream.get('profile'), 'level': level if level and level > 0 else None,
+                'pix_fmt': stream.get('pix_fmt'), 'size': (int(stream['width']), int(stream['height'])),
+                'timescale': int(stream['time_base'].split('/')[1])}
+
+    ## the stream summary ffmpeg prints, e.g. "Video: h264 (High) (avc1 / 0x31637661), yuv420p(progressive), 64x48 [...], 15360 tbn"
+    header = subprocess.run([FFMPEG_BINARY, "-hide_banner", "-i", video_path], capture_output=True, text=True).stderr
+    line = next(line for line in header.splitlines() if re.search(r"Stream #\S+.*: Video: ", line))
+    codec, profile, pix_fmt = re.search(r"Video: (\w+)(?: \(([^/()]+)\))?[^,]*, (\w+)", line).groups()
+    width, height = re.search(r", (\d+)x(\d+)", line).groups()
+    timescale, kilo = re.search(r"([\d.]+)(k?) tbn", line).groups()
+    level = None
+    if codec == 'h264':
+        ## level_idc is the third byte of the first sequence parameter set
+        annexb = subprocess.run([FFMPEG_BINARY, "-v", "error", "-i", video_path, "-map", "0:v:0", "-c", "copy", "-frames:v", "1",
+                                 "-bsf:v", "h264_mp4toannexb", "-f", "h264", "-"], check=True, capture_output=True).stdout
+        sps = re.search(rb"\x00\x00\x01[\x27\x47\x67]", annexb)
+        level = annexb[sps.end() + 2] if sps and sps.end() + 2 < len(annexb) else None
+    return {'codec': codec, 'profile': profile, 'level': level, 'pix_fmt': pix_fmt, 'size': (int(width), int(height)),
+            'timescale': int(float(timescale) * (1000 if kilo else 1))}
+
+
+def mp4_video_frame_count(video_path):
+    """
+    Number of samples of the first video track of an mp4 file, read from its sample size box (moov/trak/mdia/minf/
+    stbl/stsz) without running ffmpeg or decoding.
+
+    Returns:
+        int: Number of video frames, or -1 if the file has no video track.
+    """
+    def boxes(data, offset, end):
+        while offset + 8 <= end:
+            size, kind = struct.unpack('>I4s', data[offset:offset + 8])
+            header = 8
+            if size == 1:
+                size, header = struct.unpack('>Q', data[offset + 8:offset + 16])[0], 16
+            elif size == 0:
+                size = end - offset
+            yield kind, offset + header, offset + size
+            offset += size
+
+    with open(video_path, 'rb') as f:
+        ## only the moov box is read, the media data is skipped
+        file_size = os.fstat(f.fileno()).st_size
+        offset = 0
+        while offset + 8 <= file_size:
+            f.seek(offset)
+            size, kind = struct.unpack('>I4s', f.read(8))
+            header = 8
+            if size == 1:
+                size, header = struct.unpack('>Q', f.read(8))[0], 16
+            elif size == 0:
+                size = file_size - offset
+            if kind == b'moov':
+                moov = f.read(size - header)
+                break
+            offset += size
+        else:
+            return -1
+
+    for kind, start, end in boxes(moov, 0, len(moov)):
+        if kind != b'trak':
+            continue
+        mdia = {k: (s, e) for k, s, e in boxes(moov, start, end)}.get(b'mdia')
+        if mdia is None:
+            continue
+        children = {k: (s, e) for k, s, e in boxes(moov, *mdia)}
+        if b'hdlr' not in children or moov[children[b'hdlr'][0] + 8:children[b'hdlr'][0] + 12] != b'vide' or b'minf' not in children:
+            continue
+        stbl = {k: (s, e) for k, s, e in boxes(moov, *children[b'minf'])}.get(b'stbl')
+        stsz = {k: (s, e) for k, s, e in boxes(moov, *stbl)}.get(b'stsz') if stbl else None
+        if stsz is not None:
+            return struct.unpack('>I', moov[stsz[0] + 8:stsz[0] + 12])[0]
+    return -1
+
+
+def count_decoded_frames(video_path):
+    """
+    Decode the first video stream of a file completely.
+
+    Returns:
+        int: Number of decoded frames, or -1 if the stream does not decode without errors.
+    """
+    result = subprocess.run([FFMPEG_BINARY, "-v", "error", "-xerror", "-i", video_path, "-map", "0:v:0", "-f", "framecrc", "-"],
+                            capture_output=True, text=True)
+    if result.returncode != 0 or result.stderr.strip():
+        return -1
+    return sum(1 for line in result.stdout.splitlines() if line and not line.startswith("#"))
+
+
+def _encode_segment(video_path, start_time, end_time, output_path, audio=False, params=None, num_frames=None):
+    cmd = [FFMPEG_BINARY, "-y", "-v", "error", "-ss", f"{start_time:.6f}", "-i", video_path,
+           "-t", f"{end_time - start_time:.6f}", "-c:v", "libx264"]
+    cmd += ["-frames:v", str(num_frames)] if num_frames is not None else []
+    if params is None:
+        cmd += ["-pix_fmt", "yuv420p"]
+    else:
+        # an edge of a stream copy cut: same profile, level, pixel format, frame times and time scale as the copied GOPs
+        cmd += ["-pix_fmt", params['pix_fmt'], "-profile:v", X264_PROFILES[params['profile']], "-fps_mode", "passthrough",
+                "-video_track_timescale", str(params['timescale'])]
+        cmd += ["-level", f"{params['level'] / 10:g}"] if params['level'] else []
+    cmd += ["-c:a", "aac"] if audio else ["-an"]
+    _run(cmd + [output_path])
+
+
+def _copy_segment(video_path, start_time, num_frames, output_path):
+    # start_time is a keyframe, so input seeking lands on it exactly and the packets can be copied as they are.
+    # The segment is bounded by packet count, -t would let reordered B-frames past the next keyframe slip in.
+    _run([FFMPEG_BINARY, "-y", "-v", "error", "-ss", f"{start_time:.6f}", "-i", video_path,
+          "-frames:v", str(num_frames), "-map", "0:v:0", "-c", "copy", "-an",
+          "-avoid_negative_ts", "make_zero", output_path])
+
+
+def stream_copy_cut(video_path, start_time, end_time, output_path, keyframes : NDArray, frame_times : NDArray, audio=False,
+                    params=None, verify=STREAM_COPY_VERIFY):
+    """
+    Cut [start_time, end_time) out of a video, copying all complete GOPs and re-encoding only the partial
+    GOPs at both edges with the profile, level, pixel format and time scale of the source.
+
+    The joined video is checked before it is kept: its header must list as many frames as the source has in
+    [start_time, end_time), i.e. as many as the reencode path writes. With verify, the edges must also have the
+    stream parameters of the source and the cut must decode without errors. Otherwise, and for sources that are
+    not H.264, the whole cut is re-encoded.
+
+    Parameters:
+        video_path (str): Path to the input video file.
+        start_time (float): Start of the cut in seconds.
+        end_time (float): End of the cut in seconds.
+        output_path (str): Path to save the output video file.
+        keyframes (NDArray): Keyframe times in seconds from build_keyframe_index.
+        frame_times (NDArray): Frame times in seconds from build_keyframe_index.
+        audio (bool): Whether to keep the audio track. Audio is always re-encoded for the exact cut range.
+        params (dict): video_stream_params of the source, probed once per video. Probed here if None.
+        verify (bool): Decode the cut and probe its edges, see STREAM_COPY_VERIFY. Slow, for debugging.
+    """
+    inner = keyframes[(keyframes >= start_time) & (keyframes < end_time)]
+    # Fewer than two keyframes means no complete GOP inside the cut, nothing to copy
+    if len(inner) < 2:
+        _encode_segment(video_path, start_time, end_time, output_path, audio=audio)
+        return
+    params = params or video_stream_params(video_path)
+    if params['codec'] != 'h264' or params['profile'] not in X264_PROFILES:
+        _encode_segment(video_path, start_time, end_time, output_path, audio=audio)
+        return
+
+    first_key, last_key = inner[0], inner[-1]
+    # frames of the source in the head, the copied GOPs and the tail, as the reencode path counts them
+    first_frame, first_key_frame, last_key_frame, end_frame = np.searchsorted(frame_times, [start_time - 1e-6, first_key - 1e-6, last_key - 1e-6, end_time - 1e-6])
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(output_path))) as tmp_dir:
+        segments = []
+        edges = []
+        if first_key > start_time:
+            segments.append(os.path.join(tmp_dir, "head.mp4"))
+            _encode_segment(video_path, start_time, first_key, segments[-1], params=params, num_frames=first_key_frame - first_frame)
+            edges.append(segments[-1])
+        segments.append(os.path.join(tmp_dir, "middle.mp4"))
+        _copy_segment(video_path, first_key, last_key_frame - first_key_frame, segments[-1])
+        if end_time > last_key:
+            segments.append(os.path.join(tmp_dir, "tail.mp4"))
+            _encode_segment(video_path, last_key, end_time, segments[-1], params=params, num_frames=end_frame - last_key_frame)
+            edges.append(segments[-1])
+
+        list_path = os.path.join(tmp_dir, "segments.txt")
+        with open(list_path, "w") as f:
+            for segment in segments:
+                f.write("file '{}'\n".format(segment.replace("'", "'\\''")))
+
+        video_only_path = os.path.join(tmp_dir, "video.mp4") if audio else output_path
+        _run([FFMPEG_BINARY, "-y", "-v", "error", "-f", "concat", "-safe", "0", "-i", list_path,
+              "-c", "copy", video_only_path])
+
+        expected_frames = end_frame - first_frame
+        matches = mp4_video_frame_count(video_only_path) == expected_frames
+        if matches and verify:
+            matches = all(video_stream_params(edge) == params for edge in edges) and count_decoded_frames(video_only_path) == expected_frames
+        if not matches:
+            print(f"Stream copy of {video_path} [{start_time:.3f}, {end_time:.3f}) does not match the source, re-encoding it")
+            _encode_segment(video_path, start_time, end_time, output_path, audio=audio)
+            return
+
+        if audio:
+            _run([FFMPEG_BINARY, "-y", "-v", "error", "-i", video_only_path,
+                  "-ss", f"{start_time:.6f}", "-t", f"{end_time - start_time:.6f}", "-i", video_path,
+                  "-map", "0:v:0", "-map", "1:a:0?", "-c:v", "copy", "-c:a", "aac", output_path])
+
+
+def cut_audio(video_path, start_time, end_time, output_audio_path, sample_rate=44100):
+    """
+    Decode [start_time, end_time) of the audio track of a video into a 16-bit PCM wav file.
+
+    Parameters:
+        video_path (str): Path to the input video file.
+        start_time (float): Start of the cut in seconds.
+        end_time (float): End of the cut in seconds.
+        output_audio_path (str): Path to save the output audio file.
+        sample_rate (int): Sample rate of the wav file. Default matches moviepy's write_audiofile.
+    """
+    _run([FFMPEG_BINARY, "-y", "-v", "error", "-ss", f"{start_time:.6f}", "-i", video_path,
+          "-t", f"{end_time - start_time:.6f}", "-vn", "-acodec", "pcm_s16le", "-ar", str(sample_rate),
+          output_audio_path])
@@ -0,0 +1,167 @@
+import argparse
+import json
+import os
+import subprocess
+
+import numpy as np
+import pandas as pd
+
+from event_intervals import build_intervals, events_of
+from pipeline_config import expand_frame_window, fps_for_frame, interested_labels, merge_successive_events, time_window, video_sync_modality_frame
+from video_cut import FFMPEG_BINARY, probe_video
+
+# Channels per pixel of the supported ffmpeg pixel formats
+PIXEL_CHANNELS = {'rgb24': 3, 'gray': 1}
+
+
+def frames_stem(cache_folder, video, size=None, fps=None, pix_fmt='rgb24'):
+    """Path prefix of a decoded video, e.g. {cache_folder}frames_pupil_224x224_30fps_rgb24."""
+    name = f'frames_{video}_{size or "native"}_{f"{fps:g}" if fps else "native"}fps_{pix_fmt}'
+    return os.path.join(cache_folder, name)
+
+
+def decode_video_frames(video_path, stem, size=None, fps=None, pix_fmt='rgb24'):
+    """
+    Decode a whole video once into a raw uint8 array {stem}.u8 of shape (frames, height, width, channels), with
+    {stem}.json holding the shape, frame rate and the size and mtime of the video. ffmpeg writes the frames to
+    the file itself, so they never pass through Python. A video decoded with the same settings before is skipped.
+
+    Frame i of the array is the video at i / fps seconds: the fps filter drops or repeats frames to a constant rate.
+
+    Parameters:
+        video_path (str): Path to the video, e.g. data_video_pupil.mp4.
+        stem (str): Path prefix of the output, see frames_stem.
+        size (str): Target 'widthxheight', e.g. '224x224'. None keeps the size of the video.
+        fps (float): Target frame rate. None keeps the average frame rate of the video.
+        pix_fmt (str): 'rgb24' or 'gray'.
+
+    Returns:
+        dict: Content of {stem}.json.
+    """
+    stat = os.stat(video_path)
+    if os.path.exists(stem + '.json') and os.path.exists(stem + '.u8'):
+        with open(stem + '.json') as f:
+            meta = json.load(f)
+        if meta['src_size'] == stat.st_size and meta['src_mtime_ns'] == stat.st_mtime_ns:
+            print(f"Frames of {video_path} are up to date in {stem}.u8")
+            return meta
+
+    _, _, video_fps, video_size = probe_video(video_path)
+    width, height = (int(v) for v in size.split('x')) if size else video_size
+    fps = fps or video_fps
+    channels = PIXEL_CHANNELS[pix_fmt]
+
+    subprocess.run([FFMPEG_BINARY, '-y', '-v', 'error', '-i', video_path, '-an',
+                    '-vf', f'fps={fps},scale={width}:{height}', '-f', 'rawvideo', '-pix_fmt', pix_fmt, stem + '.u8.tmp'],
+                   check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    os.replace(stem + '.u8.tmp', stem + '.u8')
+
+    num_frames = os.path.getsize(stem + '.u8') // (height * width * channels)
+    meta = {'shape': [num_frames, height, width, channels], 'fps': fps, 'pix_fmt': pix_fmt,
+            'src_size': stat.st_size, 'src_mtime_ns': stat.st_mtime_ns}
+    # The stats are written last so an interrupted run never validates a partial decode
+    with open(stem + '.json.tmp', 'w') as f:
+        json.dump(meta, f)
+    os.replace(stem + '.json.tmp', stem + '.json')
+    print(f"Decoded {video_path}: {meta['shape']} at {fps} fps to {stem}.u8")
+    return meta
+
+
+def load_video_frames(stem):
+    """
+    Memory-map a video decoded by decode_video_frames.
+
+    Returns:
+        tuple[np.memmap, dict]: Frames of shape (frames, height, width, channels) and the content of {stem}.json.
+    """
+    with open(stem + '.json') as f:
+        meta = json.load(f)
+    return np.memmap(stem + '.u8', dtype=np.uint8, mode='r', shape=tuple(meta['shape'])), meta
+
+
+def frame_range(start_frame, end_frame, meta, fps_for_frame=fps_for_frame, time_window=None):
+    """
+    Rows of a decoded video covering the frames [start_frame, end_frame) of the events csv, expanded to
+    time_window with the same rule as the clips of synchronize.py.
+
+    Parameters:
+        start_frame (int): Starting frame index from GoProFrame or PupilFrame.
+        end_frame (int): Ending frame index.
+        meta (dict): Content of {stem}.json from load_video_frames.
+        fps_for_frame (float): Frame rate of the frame columns, see synchronize.fps_for_frame.
+        time_window (float): Time window for downstream task input (second). None keeps the event length.
+
+    Returns:
+        tuple[int, int]: Start and end row of the frame array.
+    """
+    num_frames, fps = meta['shape'][0], meta['fps']
+    start_frame, end_frame = expand_frame_window(start_frame, end_frame, time_window, fps_for_frame, int(num_frames / fps * fps_for_frame))
+    return int(start_frame * fps / fps_for_frame), min(num_frames, int(end_frame * fps / fps_for_frame))
+
+
+def decode_walk_videos(subject, walk, size=None, fps=None, pix_fmt='rgb24'):
+    """
+    Decode the GoPro and Pupil videos of a walk once into RW{subject}-Walk{walk}-cache/.
+
+    Returns:
+        dict: {video: stem} of the decoded videos, see load_video_frames.
+    """
+    load_syncronized_folder = f'../RW{subject}/RW{subject}-Walk{walk}-extracted/'
+    cache_folder = f'../RW{subject}/RW{subject}-Walk{walk}-cache/'
+    if not os.path.exists(cache_folder):
+        os.makedirs(cache_folder)
+
+    stems = {}
+    for video in ['gopro', 'pupil']:
+        video_path = load_syncronized_folder + f'data_video_{video}.mp4'
+        if os.path.exists(video_path):
+            stems[video] = frames_stem(cache_folder, video, size, fps, pix_fmt)
+            decode_video_frames(video_path, stems[video], size, fps, pix_fmt)
+    return stems
+
+
+def iter_event_frames(subject, walk, stems, fps_for_frame=fps_for_frame, video_sync_modality_frame=video_sync_modality_frame, time_window=time_window):
+    """
+    Serve the frames of every event of a walk as slices of the decoded videos, without decoding anything.
+
+    Parameters:
+        subject (int): Subject number.
+        walk (int): Walk number.
+        stems (dict): {video: stem} from decode_walk_videos.
+        fps_for_frame (float): Frame rate of the frame columns.
+        video_sync_modality_frame (str): Column of the events csv used for both videos ('GoProFrame' or 'PupilFrame').
+        time_window (float): Time window for downstream task input (second).
+
+    Yields:
+        tuple[int, str, dict]: Event index, label and {video: frames}, memory-mapped views of shape
+            (frames, height, width, channels). Events whose frames are missing (empty cells of the frame column) or
+            not increasing are skipped, as in synchronize.py.
+    """
+    df = pd.read_csv(f'../label_RWNApp_Output_Jan2024/evnts_RWNApp_RW{subject}_Walk{walk}.csv')
+    videos = {video: load_video_frames(stem) for video, stem in stems.items()}
+    # missing frames are -1
+    events = events_of(build_intervals(df, interested_labels, frame_column=video_sync_modality_frame, merge_successive=merge_successive_events))
+    for event in events:
+        start_frame, end_frame = int(event['start_frame']), int(event['end_frame'])
+        if start_frame < 0 or end_frame <= start_frame:
+            continue
+        event_frames = {}
+        for video, (frames, meta) in videos.items():
+            start, end = frame_range(start_frame, end_frame, meta, fps_for_frame, time_window)
+            event_frames[video] = frames[start:end]
+        yield int(event['index']), str(event['label']), event_frames
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Decode the GoPro and Pupil videos of walks once into memory-mapped frame arrays.")
+    parser.add_argument("--subject", type=int, default=1, help="Subject number (default: 1).")
+    parser.add_argument("--walks", type=int, nargs='+', default=[1], help="Walk numbers (default: 1).")
+    parser.add_argument("--size", default=None, help="Target 'widthxheight', e.g. 224x224 (default: size of the video).")
+    parser.add_argument("--fps", type=float, default=None, help="Target frame rate (default: frame rate of the video).")
+    parser.add_argument("--pix-fmt", choices=list(PIXEL_CHANNELS), default='rgb24', help="Pixel format of the arrays (default: %(default)s).")
+    args = parser.parse_args()
+
+    for walk in args.walks:
+        stems = decode_walk_videos(args.subject, walk, size=args.size, fps=args.fps, pix_fmt=args.pix_fmt)
+        num_events = sum(1 for _ in iter_event_frames(args.subject, walk, stems))
+        print(f"sub: {args.subject}, walk: {walk}: {num_events} events served from {', '.join(stems.values())}")
@@ -0,0 +1,104 @@
+import os
+
+import numpy as np
+from numpy.typing import NDArray
+
+# Name of the per-walk container inside the self-syncronize-split folder
+CONTAINER_NAME = 'sensor_windows.h5'
+
+# One row per saved window: rows [start, stop) of /data/{modality} belong to event `index`
+OFFSET_DTYPE = np.dtype([('index', np.int64), ('modality', 'S32'), ('start', np.int64), ('stop', np.int64)])
+
+
+class WalkContainerWriter:
+    """
+    Append the sensor windows of all events of one walk into a single chunked HDF5 file, with one
+    resizable dataset per modality (/data/{modality}) and an event offset table (/offsets).
+    The offset of every window is appended together with the window, so the windows written before an
+    interrupted run stay readable. Requires h5py.
+
+    Parameters:
+        path (str): Container file, rewritten from scratch.
+        chunk_rows (int): Rows per chunk of the modality datasets.
+        keep_events (set[int]): Events whose windows are copied over from the existing container first, e.g. the
+            events left out of a run on a subset of events. None starts empty.
+    """
+
+    def __init__(self, path, chunk_rows=4096, keep_events=None):
+        import h5py  # optional dependency, only needed for the container output format
+        previous = path + '.previous'
+        # a leftover previous container means the last copy was interrupted, the container next to it is partial
+        if keep_events is not None and os.path.exists(path) and not os.path.exists(previous):
+            os.replace(path, previous)
+        self.file = h5py.File(path, 'w')
+        self.chunk_rows = chunk_rows
+        self.offsets = self.file.create_dataset('offsets', shape=(0,), maxshape=(None,), dtype=OFFSET_DTYPE, chunks=(1024,))
+        if keep_events is not None and os.path.exists(previous):
+            with h5py.File(previous, 'r') as f:
+                for index, modality, start, stop in f['offsets'][()]:
+                    if int(index) in keep_events:
+                        self.write(int(index), modality.decode(), f[f'data/{modality.decode()}'][start:stop])
+        if os.path.exists(previous):
+            os.remove(previous)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def write(self, index, modality, arr : NDArray):
+        """
+        Append the window of one event.
+
+        Parameters:
+            index (int): Event index (row of the events csv).
+            modality (str): Modality name, e.g. 'np' or 'chestphone_acc'.
+            arr (NDArray): Window of shape (num_samples, ...).
+        """
+        arr = np.asarray(arr)
+        name = f'data/{modality}'
+        if name not in self.file:
+            self.file.create_dataset(name, shape=(0,) + arr.shape[1:], maxshape=(None,) + arr.shape[1:],
+                                     dtype=arr.dtype, chunks=(self.chunk_rows,) + arr.shape[1:])
+        dataset = self.file[name]
+        start = dataset.shape[0]
+        dataset.resize(start + len(arr), axis=0)
+        dataset[start:] = arr
+        self.offsets.resize(len(self.offsets) + 1, axis=0)
+        self.offsets[-1] = np.array((index, modality.encode(), start, start + len(arr)), dtype=OFFSET_DTYPE)
+
+    def close(self):
+        if self.file:
+            self.file.close()
+
+
+def load_offsets(h5_file):
+    """
+    Offset table of an open container, read once so windows can be looked up without scanning it.
+
+    Returns:
+        dict: {(index, modality): (start, stop)} of every window.
+    """
+    offsets = h5_file['offsets'][()]
+    return {(int(index), modality.decode()): (int(start), int(stop)) for index, modality, start, stop in offsets}
+
+
+def read_window(h5_file, index, modality, offsets=None):
+    """
+    Read the window of one event from an open container.
+
+    Parameters:
+        h5_file (h5py.File): Container opened for reading.
+        index (int): Event index (row of the events csv).
+        modality (str): Modality name.
+        offsets (dict): load_offsets of the container, kept by callers reading many windows. Loaded here if None.
+
+    Returns:
+        NDArray: The window, or None if the event has no window of this modality.
+    """
+    offsets = load_offsets(h5_file) if offsets is None else offsets
+    if (index, modality) not in offsets:
+        return None
+    start, stop = offsets[(index, modality)]
+    return h5_file[f'data/{modality}'][start:stop]
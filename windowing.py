@@ -0,0 +1,91 @@
+import numpy as np
+from numpy.typing import NDArray
+
+
+def slice_window(streams, start_ns, end_ns):
+    """
+    Slice [start_ns, end_ns) out of every stream. The slices are views, so memory-mapped streams stay on disk.
+
+    Parameters:
+        streams (dict): {modality: (time in epoch nanoseconds, data)}, e.g. from phone_streams.load_walk_streams.
+        start_ns (int): Start of the window in epoch nanoseconds.
+        end_ns (int): End of the window in epoch nanoseconds.
+
+    Returns:
+        tuple[dict, list]: {modality: data of the window} and the modalities without any sample in the window.
+    """
+    window = {}
+    missing = []
+    for modality, (time_ns, data) in streams.items():
+        start, end = np.searchsorted(time_ns, [start_ns, end_ns], side='left')
+        window[modality] = data[start:end]
+        if end <= start:
+            missing.append(modality)
+    return window, missing
+
+
+def window_starts(start_ns, end_ns, window_ns, stride_ns, anchor='center'):
+    """
+    Start times of the fixed windows covering [start_ns, end_ns).
+
+    A span shorter than the window gets one window. A longer span is split into as many windows of stride_ns
+    as fit into it. With anchor 'center' the windows are centered on the span, with 'start' they begin at start_ns.
+
+    Returns:
+        NDArray[np.int64]: Window start times in epoch nanoseconds.
+    """
+    duration = end_ns - start_ns
+    num_windows = 1 if duration <= window_ns else (duration - window_ns) // stride_ns + 1
+    covered = (num_windows - 1) * stride_ns + window_ns
+    if anchor == 'center':
+        offset = (duration - covered) // 2
+    elif anchor == 'start':
+        offset = 0
+    else:
+        raise ValueError(f"Unknown anchor: {anchor}")
+    return start_ns + offset + np.arange(num_windows, dtype=np.int64) * stride_ns
+
+
+def iter_windows(streams, start_ns, end_ns, window, stride=None):
+    """
+    Lazily slide fixed windows of all modalities over [start_ns, end_ns), e.g. a whole walk.
+
+    Parameters:
+        streams (dict): {modality: (time in epoch nanoseconds, data)}.
+        start_ns (int): Start of the span in epoch nanoseconds.
+        end_ns (int): End of the span in epoch nanoseconds.
+        window (float): Window length T (second).
+        stride (float): Step between window starts (second). Default is window, i.e. no overlap.
+
+    Yields:
+        dict: 'start' and 'end' in epoch nanoseconds, 'data' {modality: window data} and 'missing' modalities.
+    """
+    window_ns = int(round(window * 1e9))
+    stride_ns = int(round((stride or window) * 1e9))
+    for window_start in range(int(start_ns), int(end_ns) - window_ns + 1, stride_ns):
+        data, missing = slice_window(streams, window_start, window_start + window_ns)
+        yield {'start': window_start, 'end': window_start + window_ns, 'data': data, 'missing': missing}
+
+
+def iter_event_windows(streams, events, window, stride=None, anchor='center'):
+    """
+    Lazily yield fixed windows of all modalities anchored on events. Short (and instant) events get one window
+    around them; long events such as New Context are split into several windows.
+
+    Parameters:
+        streams (dict): {modality: (time in epoch nanoseconds, data)}.
+        events (iterable): (index, label, start in epoch nanoseconds, end in epoch nanoseconds) per event.
+        window (float): Window length T (second).
+        stride (float): Step between windows of one long event (second). Default is window, i.e. no overlap.
+        anchor (str): 'center' or 'start', see window_starts.
+
+    Yields:
+        dict: 'index', 'label', 'window' (number of the window in the event), 'start', 'end', 'data' and 'missing'.
+    """
+    window_ns = int(round(window * 1e9))
+    stride_ns = int(round((stride or window) * 1e9))
+    for index, label, event_start, event_end in events:
+        for num, window_start in enumerate(window_starts(int(event_start), int(event_end), window_ns, stride_ns, anchor)):
+            data, missing = slice_window(streams, window_start, window_start + window_ns)
+            yield {'index': index, 'label': label, 'window': num, 'start': int(window_start),
+                   'end': int(window_start) + window_ns, 'data': data, 'missing': missing}
@@ -0,0 +1,208 @@
+import json
+import os
+import re
+import zipfile
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import pandas as pd
+
+# Sheet of the Xsens export used by the pipeline
+XSENS_COM_SHEET = 'Center of Mass'
+
+SPREADSHEET_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+RELATIONSHIP_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+# A numeric (or empty) cell as written by Xsens MVN and openpyxl: <c r="B2" t="n"><v>0.1</v></c>
+NUMERIC_CELL_RE = re.compile(rb'<c r="([A-Z]+)(\d+)"(?: s="\d+")?(?: t="n")?(?: s="\d+")?(?:/>|><v>([^<]*)</v></c>)')
+HEADER_CELL_RE = re.compile(rb'<c r="([A-Z]+)1"([^>]*?)(?:/>|>(.*?)</c>)', re.S)
+
+
+def sheet_stem(save_folder, sheet):
+    """Path prefix of the converted sheet, e.g. {save_folder}data_xs_Center-of-Mass."""
+    return os.path.join(save_folder, 'data_xs_' + sheet.replace(' ', '-'))
+
+
+def column_index(letters):
+    """Zero based index of a column reference such as b'A' or b'AB'."""
+    index = 0
+    for letter in letters:
+        index = index * 26 + letter - ord('A') + 1
+    return index - 1
+
+
+def sheet_members(archive):
+    """{sheet name: path of its xml in the xlsx archive}."""
+    workbook = ET.fromstring(archive.read('xl/workbook.xml'))
+    rels = ET.fromstring(archive.read('xl/_rels/workbook.xml.rels'))
+    targets = {rel.get('Id'): rel.get('Target') for rel in rels}
+    members = {}
+    for sheet in workbook.iter(SPREADSHEET_NS + 'sheet'):
+        target = targets[sheet.get(RELATIONSHIP_NS + 'id')]
+        members[sheet.get('name')] = target.lstrip('/') if target.startswith('/') else 'xl/' + target
+    return members
+
+
+def read_sheet_xml(archive, member, chunk_bytes=1 << 24):
+    """
+    Parse a numeric sheet straight from its xml, in chunks of whole rows, with vectorized conversion to float.
+
+    Returns:
+        tuple[list, NDArray]: Header names and the table below the header (NaN for empty cells), or None if the
+            sheet holds cells other than numbers (e.g. shared strings below the header).
+    """
+    shared_strings = []
+    if 'xl/sharedStrings.xml' in archive.namelist():
+        shared_strings = [''.join(t.text or '' for t in si.iter(SPREADSHEET_NS + 't'))
+                          for si in ET.fromstring(archive.read('xl/sharedStrings.xml'))]
+
+    header = {}
+    cols, rows, values = [], [], []
+    buf = b''
+    with archive.open(member) as f:
+        while True:
+            chunk = f.read(chunk_bytes)
+            buf += chunk
+            if chunk:
+                # keep reading until the buffer holds a complete row
+                cut = buf.rfind(b'</row>')
+                cut = cut + len(b'</row>') if cut >= 0 else 0
+            else:
+                cut = len(buf)
+            part, buf = buf[:cut], buf[cut:]
+            if not header and b'<row r="1"' in part:
+                row_start = part.index(b'<row r="1"')
+                row_end = part.index(b'</row>', row_start) + len(b'</row>')
+                for letters, attrs, content in HEADER_CELL_RE.findall(part[row_start:row_end]):
+                    text = re.search(rb'<(?:v|t)[^>]*>([^<]*)</(?:v|t)>', content or b'')
+                    text = text.group(1).decode() if text else ''
+                    header[column_index(letters)] = shared_strings[int(text)] if b't="s"' in attrs else text
+                part = part[:row_start] + part[row_end:]
+            cells = NUMERIC_CELL_RE.findall(part)
+            if len(cells) != part.count(b'<c '):
+                return None
+            if cells:
+                letters, row, value = zip(*cells)
+                cols.extend(letters)
+                rows.append(np.array(row, dtype=np.int64))
+                values.extend(value)
+            if not chunk:
+                break
+
+    columns = [header.get(i, '') for i in range(max(header) + 1)] if header else []
+    unique_letters = {letters: column_index(letters) for letters in set(cols)}
+    num_columns = max([len(columns)] + [i + 1 for i in unique_letters.values()])
+    columns += [''] * (num_columns - len(columns))
+    rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+    table = np.full((rows.max() - 1 if len(rows) else 0, num_columns), np.nan)
+    col_index = np.array([unique_letters[letters] for letters in cols], dtype=np.int64)
+    filled = np.array([len(v) > 0 for v in values], dtype=bool)
+    table[rows[filled] - 2, col_index[filled]] = np.array([v for v in values if v], dtype=np.float64)
+    return columns, table
+
+
+def read_sheets(xlsx_path, sheets, engine='xml', block_rows=65536):
+    """
+    Stream the rows of selected sheets of an Xsens workbook. The other sheets are never parsed.
+
+    With engine 'xml', numeric sheets are parsed straight from the sheet xml with vectorized conversion, which is
+    several times faster than openpyxl; sheets with other content fall back to openpyxl in read-only mode.
+
+    Parameters:
+        xlsx_path (str): Path to the RW_{subject}_w{walk}.xlsx export.
+        sheets (list[str]): Sheet names, e.g. ['Center of Mass'].
+        engine (str): 'xml' or 'openpyxl'.
+        block_rows (int): Rows converted to a numpy block at once by openpyxl.
+
+    Returns:
+        dict: {sheet: {'columns': header names, 'frame': first column as int64, 'data': other columns as float64}}.
+            Empty cells are NaN.
+    """
+    arrays = {}
+    if engine == 'xml':
+        with zipfile.ZipFile(xlsx_path) as archive:
+            members = sheet_members(archive)
+            for sheet in sheets:
+                parsed = read_sheet_xml(archive, members[sheet])
+                if parsed is not None:
+                    columns, table = parsed
+                    arrays[sheet] = {'columns': columns, 'frame': table[:, 0].astype(np.int64), 'data': np.ascontiguousarray(table[:, 1:])}
+        sheets = [sheet for sheet in sheets if sheet not in arrays]
+        if not sheets:
+            return arrays
+
+    import openpyxl  # optional dependency, only needed for sheets the xml engine cannot parse
+    workbook = openpyxl.load_workbook(xlsx_path, read_only=True, data_only=True)
+    try:
+        for sheet in sheets:
+            rows = workbook[sheet].iter_rows(values_only=True)
+            columns = [str(c) for c in next(rows)]
+            num_columns = len(columns)
+            blocks, block = [], []
+            for row in rows:
+                if len(row) != num_columns:
+                    row = (tuple(row) + (None,) * num_columns)[:num_columns]
+                block.append(row)
+                if len(block) == block_rows:
+                    blocks.append(np.array(block, dtype=np.float64))  # None becomes NaN
+                    block = []
+            blocks.append(np.array(block, dtype=np.float64).reshape(-1, num_columns))
+            table = np.concatenate(blocks)
+            arrays[sheet] = {'columns': columns, 'frame': table[:, 0].astype(np.int64), 'data': np.ascontiguousarray(table[:, 1:])}
+    finally:
+        workbook.close()
+    return arrays
+
+
+def convert_xsens_workbook(xlsx_path, save_folder, sheets=(XSENS_COM_SHEET,), write_csv=True):
+    """
+    Convert sheets of an Xsens workbook into typed arrays {stem}.frame.npy and {stem}.data.npy plus {stem}.json
+    (column names and the size and mtime of the workbook), see sheet_stem. Sheets converted from the same
+    workbook before are skipped, so later runs do not open the workbook at all.
+
+    Parameters:
+        xlsx_path (str): Path to the RW_{subject}_w{walk}.xlsx export.
+        save_folder (str): The RW{subject}-Walk{walk}-extracted/ folder.
+        sheets (list[str]): Sheet names. 'Center of Mass' is used by synchronize.py; others, e.g. joint angles, on request.
+        write_csv (bool): Also write {stem}.csv as read by older versions of the pipeline.
+    """
+    stat = os.stat(xlsx_path)
+    todo = []
+    for sheet in sheets:
+        stem = sheet_stem(save_folder, sheet)
+        if os.path.exists(stem + '.json'):
+            with open(stem + '.json') as f:
+                meta = json.load(f)
+            if meta['src_size'] == stat.st_size and meta['src_mtime_ns'] == stat.st_mtime_ns \
+                    and os.path.exists(stem + '.data.npy') and (not write_csv or os.path.exists(stem + '.csv')):
+                print(f"Sheet {sheet} is up to date in {stem}.*")
+                continue
+        todo.append(sheet)
+    if not todo:
+        return
+
+    for sheet, arrays in read_sheets(xlsx_path, todo).items():
+        stem = sheet_stem(save_folder, sheet)
+        np.save(stem + '.frame.npy', arrays['frame'])
+        np.save(stem + '.data.npy', arrays['data'])
+        if write_csv:
+            df = pd.DataFrame(arrays['data'], columns=arrays['columns'][1:])
+            df.insert(0, arrays['columns'][0], arrays['frame'])
+            df.to_csv(stem + '.csv', index=False)
+        # The stats are written last so an interrupted run never validates a partial conversion
+        with open(stem + '.json.tmp', 'w') as f:
+            json.dump({'src_size': stat.st_size, 'src_mtime_ns': stat.st_mtime_ns, 'columns': arrays['columns']}, f)
+        os.replace(stem + '.json.tmp', stem + '.json')
+        print(f"Converted sheet {sheet}: {arrays['data'].shape} to {stem}.*")
+
+
+def load_xsens_sheet(save_folder, sheet=XSENS_COM_SHEET, mmap_mode=None):
+    """
+    Load a sheet converted by convert_xsens_workbook.
+
+    Returns:
+        dict: 'frame' and 'data' arrays, or None if the sheet has not been converted.
+    """
+    stem = sheet_stem(save_folder, sheet)
+    if not os.path.exists(stem + '.json'):
+        return None
+    return {key: np.load(f'{stem}.{key}.npy', mmap_mode=mmap_mode) for key in ['frame', 'data']}